@@ -0,0 +1,63 @@
+"""
+Import time benchmark of the lomap package
+
+Each run imports lomap in a fresh Python interpreter and measures the import
+time. The modules used just to draw the graphs (matplotlib, PyQt4 and the RDKit
+drawing module) must not be imported. The script exits with an error if they
+are imported or if the median import time is greater than the passed limit
+
+Usage: python devtools/import_time.py [--runs 5] [--limit 2.0]
+
+"""
+
+import argparse
+import subprocess
+import sys
+import json
+
+
+CODE = """
+import sys, time, json
+start = time.time()
+import lomap
+elapsed = time.time() - start
+heavy = [name for name in sys.modules if name.split('.')[0] in ('matplotlib', 'PyQt4') or name.startswith('rdkit.Chem.Draw')]
+print(json.dumps({'time': elapsed, 'heavy': heavy}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time benchmark of the lomap package')
+    parser.add_argument('--runs', default=5, type=int, help='The number of measured imports')
+    parser.add_argument('--limit', default=None, type=float, help='The maximum median import time in seconds')
+    ops = parser.parse_args()
+
+    times = []
+    heavy = set()
+
+    for run in range(0, ops.runs):
+        out = subprocess.check_output([sys.executable, '-c', CODE])
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        times.append(result['time'])
+        heavy.update(result['heavy'])
+
+    times.sort()
+    median = times[len(times)//2]
+
+    print('import lomap: median %.3f s, min %.3f s, max %.3f s over %d runs' % (median, times[0], times[-1], ops.runs))
+
+    status = 0
+
+    if heavy:
+        print('Drawing modules imported by lomap: %s' % ', '.join(sorted(heavy)))
+        status = 1
+
+    if ops.limit is not None and median > ops.limit:
+        print('The median import time exceeds the limit of %.3f s' % ops.limit)
+        status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
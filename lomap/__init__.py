@@ -61,9 +61,16 @@ Using
 
 from lomap.dbmol import DBMolecules
 from lomap.dbmol import SMatrix
+from lomap.dbmol import LazySMatrix
 from lomap.dbmol import Molecule
 from lomap.mcs import MCS
+from lomap.fp import PackedFingerprints
+from lomap.result import load_result
+from lomap.service import PlanningService
 
 del dbmol
 del graphgen
 del mcs
+del fp
+del result
+del service
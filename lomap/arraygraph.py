@@ -0,0 +1,706 @@
+#******************
+# MODULE DOCSTRING
+#******************
+
+"""
+
+LOMAP: Array based graph generation
+=====
+
+Alchemical free energy calculations hold increasing promise as an aid to drug
+discovery efforts. However, applications of these techniques in discovery
+projects have been relatively few, partly because of the difficulty of planning
+and setting up calculations. The Lead Optimization Mapper (LOMAP) is an
+automated algorithm to plan efficient relative free energy calculations between
+potential ligands within a substantial of compounds.
+
+"""
+
+#*****************************************************************************
+# Lomap2: A toolkit to plan alchemical relative binding affinity calculations
+# Copyright 2015 - 2016  UC Irvine and the Authors
+#
+# Authors: Dr Gaetano Calabro' and Dr David Mobley
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see http://www.gnu.org/licenses/
+#*****************************************************************************
+
+
+#****************
+# MODULE IMPORTS
+#****************
+
+import networkx as nx
+import numpy as np
+import os.path
+
+__all__ = ['ArrayGraph']
+
+
+#*************************
+# Array Graph Class
+#*************************
+
+
+class ArrayGraph(object):
+    """
+    This class performs the LOMAP graph generation on compact integer arrays.
+    The candidate edges are stored in a Compressed Sparse Row (CSR) adjacency
+    structure, the removed edges are tracked by a mask and the graph components
+    are handled by union-find structures. The NetworkX graph is only built at
+    the end by the getGraph function
+
+    Nodes and edges are visited following the ascending molecule indexes, which
+    is the order used by the NetworkX implementation in GraphGen
+
+    """
+
+    def __init__(self, dbase, lead_index=None, options=None, sorted_indexes=None):
+        """
+        Inizialization function
+
+        Parameters
+        ----------
+
+        dbase : dbase object
+            the molecule container
+
+        lead_index : int
+            the index of the hub compound if the radial option is used, None otherwise
+
+        options : argparse python object 
+            the graph options. If None the molecule container options are used
+
+        sorted_indexes : numpy array of int
+            the linear indexes of the positive strict similarity scores sorted
+            by decreasing score, see SMatrix.sorted_indexes
+
+        """
+
+        self.dbase = dbase
+
+        self.lead_index = lead_index
+
+        if options is None:
+            options = dbase.options
+
+        self.sorted_indexes = sorted_indexes
+
+        self.similarityScoresLimit = options.cutoff
+
+        self.maxPathLength = options.max
+
+        if (dbase.nums() * (dbase.nums() - 1)/2) != dbase.strict_mtx.size:
+            raise ValueError("There are errors in the similarity score matrices")
+
+        fast_map = options.fast and options.radial
+
+        # Edge arrays: the two edge nodes and the edge similarity score
+        self.edgeU, self.edgeV, self.edgeW = self.generateInitialEdges(fast_map)
+
+        # CSR adjacency: the incident edges of node i are stored between
+        # indptr[i] and indptr[i+1] of the adjNodes and adjEdges arrays
+        self.indptr, self.adjNodes, self.adjEdges = self.generateCSR()
+
+        # Edge mask. An edge is removed from the graph by setting its flag to 0
+        self.alive = bytearray([1]) * len(self.edgeW)
+
+        # The connected components of the initial graph, sorted by their first node
+        self.labels, self.components = self.generateComponents()
+
+        # Edges added to connect the components or to close the cycles: (i, j, similarity, strict_flag)
+        self.addedEdges = []
+
+        # Node order of the final graph
+        self.nodesOrder = [node for nodes in self.components for node in nodes]
+
+        if fast_map:
+            self.addSurroundEdges()
+        else:
+            self.minimizeEdges()
+            self.connectComponents()
+
+        return
+
+
+    def generateInitialEdges(self, fast_map=False):
+        """
+        This function extracts from the strict similarity score matrix the
+        starting edges, which connect the compounds with a positive strict
+        similarity score greater or equal to the hard limit
+
+        Parameters
+        ----------
+        fast_map : bool
+            if True only the radial edges connected to the hub compound are used
+
+        Returns
+        -------
+        edgeU, edgeV : numpy arrays of int
+            the edge nodes
+        edgeW : numpy array of float
+            the edge similarity scores
+
+        """
+
+        strict_mtx = self.dbase.strict_mtx
+
+        if not fast_map:
+            values = np.asarray(strict_mtx)
+
+            k = strict_mtx.positive_indexes(self.similarityScoresLimit, self.sorted_indexes)
+
+            edgeU, edgeV = strict_mtx.index_pairs(k)
+            edgeW = values[k]
+        else:
+            row = strict_mtx.row(self.lead_index)
+
+            edgeU = np.nonzero((row > 0.0) & (row >= self.similarityScoresLimit))[0]
+            edgeV = np.empty_like(edgeU)
+            edgeV.fill(self.lead_index)
+            edgeW = row[edgeU]
+
+        return edgeU.astype(np.int32), edgeV.astype(np.int32), edgeW.astype(np.float64)
+
+
+    def generateCSR(self):
+        """
+        This function generates the CSR adjacency structure of the starting
+        graph. For each node the incident edges are sorted by neighbour index
+
+        Returns
+        -------
+        indptr : numpy array of int
+            the offsets of each node in the adjacency arrays
+        adjNodes : numpy array of int
+            the neighbour nodes
+        adjEdges : numpy array of int
+            the indexes of the incident edges
+
+        """
+
+        n = self.dbase.nums()
+        m = len(self.edgeW)
+
+        ends = np.concatenate((self.edgeU, self.edgeV))
+        neighbours = np.concatenate((self.edgeV, self.edgeU))
+        edges = np.concatenate((np.arange(m, dtype=np.int32), np.arange(m, dtype=np.int32)))
+
+        order = np.lexsort((neighbours, ends))
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(ends, minlength=n))
+
+        return indptr, neighbours[order], edges[order]
+
+
+    def generateComponents(self):
+        """
+        This function generates the connected components of the starting graph
+
+        Returns
+        -------
+        labels : numpy array of int
+            the index of the component of each node
+        components : list of lists
+            the sorted component nodes. The components are sorted by their
+            first node
+
+        """
+
+        n = self.dbase.nums()
+
+        parent = list(range(0, n))
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for u, v in zip(self.edgeU.tolist(), self.edgeV.tolist()):
+            root_u = find(u)
+            root_v = find(v)
+            if root_u != root_v:
+                parent[max(root_u, root_v)] = min(root_u, root_v)
+
+        labels = np.zeros(n, dtype=np.int32)
+        components = []
+        root_labels = {}
+
+        for node in range(0, n):
+            root = find(node)
+            if root not in root_labels:
+                root_labels[root] = len(components)
+                components.append([])
+            labels[node] = root_labels[root]
+            components[root_labels[root]].append(node)
+
+        return labels, components
+
+
+    def findBridges(self, nodes):
+        """
+        This function finds the bridges of the subgraph made by the passed
+        nodes by using an iterative Tarjan depth first search over the alive
+        edges
+
+        Parameters
+        ----------
+        nodes : list of int
+            the subgraph nodes
+
+        Returns
+        -------
+        bridges : set of int
+            the indexes of the edges that are bridges
+        numComponents : int
+            the number of connected components of the subgraph
+
+        """
+
+        indptr = self._indptr
+        adjNodes = self._adjNodes
+        adjEdges = self._adjEdges
+        alive = self.alive
+
+        disc = self._disc
+        low = self._low
+
+        for node in nodes:
+            disc[node] = -1
+
+        bridges = set()
+        numComponents = 0
+        timer = 0
+
+        for root in nodes:
+
+            if disc[root] >= 0:
+                continue
+
+            numComponents += 1
+
+            disc[root] = low[root] = timer
+            timer += 1
+
+            # Stack of [node, edge used to reach the node, adjacency pointer]
+            stack = [[root, -1, indptr[root]]]
+
+            while stack:
+
+                top = stack[-1]
+                node = top[0]
+
+                if top[2] < indptr[node + 1]:
+
+                    ptr = top[2]
+                    top[2] += 1
+
+                    edge = adjEdges[ptr]
+
+                    if not alive[edge] or edge == top[1]:
+                        continue
+
+                    neighbour = adjNodes[ptr]
+
+                    if disc[neighbour] >= 0:
+                        if disc[neighbour] < low[node]:
+                            low[node] = disc[neighbour]
+                    else:
+                        disc[neighbour] = low[neighbour] = timer
+                        timer += 1
+                        stack.append([neighbour, edge, indptr[neighbour]])
+                else:
+                    stack.pop()
+
+                    if stack:
+                        parent = stack[-1][0]
+
+                        if low[node] < low[parent]:
+                            low[parent] = low[node]
+
+                        if low[node] > disc[parent]:
+                            bridges.add(top[1])
+
+        return bridges, numComponents
+
+
+    def findCyclicNodes(self, nodes, bridges):
+        """
+        This function returns the nodes of the subgraph that are in a cycle: a
+        node is in a cycle if at least one of its alive edges is not a bridge
+
+        Parameters
+        ----------
+        nodes : list of int
+            the subgraph nodes
+        bridges : set of int
+            the subgraph bridges
+
+        Returns
+        -------
+        cyclicNodes : set of int
+            the set of graph nodes that are in a cycle
+
+        """
+
+        indptr = self._indptr
+        adjEdges = self._adjEdges
+        alive = self.alive
+
+        cyclicNodes = set()
+
+        for node in nodes:
+            for ptr in range(indptr[node], indptr[node + 1]):
+                edge = adjEdges[ptr]
+                if alive[edge] and edge not in bridges:
+                    cyclicNodes.add(node)
+                    break
+
+        return cyclicNodes
+
+
+    def checkConstraints(self, nodes, cyclicNodes):
+        """
+        Determine if the subgraph made by the passed nodes still meets the
+        constraints: it must be connected, all the nodes that were in a
+        cycle must be still in a cycle and all the nodes must be within the
+        maximum distance
+
+        Parameters
+        ----------
+        nodes : list of int
+            the subgraph nodes
+        cyclicNodes : set of int
+            the subgraph nodes which were in a cycle before the edge removal
+
+        Returns
+        -------
+        constraintsMet : bool
+           True if all the constraints are met, False otherwise
+
+        """
+
+        bridges, numComponents = self.findBridges(nodes)
+
+        if numComponents != 1:
+            return False
+
+        if not cyclicNodes.issubset(self.findCyclicNodes(cyclicNodes, bridges)):
+            return False
+
+        return self.checkMaxDistance(nodes)
+
+
+    def checkMaxDistance(self, nodes):
+        """
+        Check to see if the connected subgraph made by the passed nodes has 
+        paths from all the nodes to all the other nodes within the specified
+        limit. A breadth first search limited to the maximum distance is run
+        from each node
+
+        Parameters
+        ----------
+        nodes : list of int
+            the subgraph nodes
+
+        Returns
+        -------
+        withinMaxDistance : bool
+            True if the subgraph has all the nodes within the specified 
+            max distance
+
+        """
+
+        # No path can be longer than the number of edges of a spanning tree
+        if len(nodes) - 1 <= self.maxPathLength:
+            return True
+
+        indptr = self._indptr
+        adjNodes = self._adjNodes
+        adjEdges = self._adjEdges
+        alive = self.alive
+
+        visited = self._disc
+
+        for source in nodes:
+
+            for node in nodes:
+                visited[node] = -1
+
+            visited[source] = 0
+            reached = 1
+            level = [source]
+
+            for distance in range(1, self.maxPathLength + 1):
+
+                next_level = []
+
+                for node in level:
+                    for ptr in range(indptr[node], indptr[node + 1]):
+                        neighbour = adjNodes[ptr]
+                        if alive[adjEdges[ptr]] and visited[neighbour] < 0:
+                            visited[neighbour] = distance
+                            next_level.append(neighbour)
+
+                reached += len(next_level)
+                level = next_level
+
+                if not level:
+                    break
+
+            if reached < len(nodes):
+                return False
+
+        return True
+
+
+    def setupTraversal(self):
+        """
+        This function prepares the plain Python copies of the CSR arrays and
+        the work arrays used by the depth first searches
+
+        """
+
+        n = self.dbase.nums()
+
+        self._indptr = self.indptr.tolist()
+        self._adjNodes = self.adjNodes.tolist()
+        self._adjEdges = self.adjEdges.tolist()
+        self._disc = [-1] * n
+        self._low = [-1] * n
+
+
+    def minimizeEdges(self):
+        """
+        Minimize edges in each component while ensuring constraints are met.
+        The edges are removed starting with the lowest similarity score first
+
+        """
+
+        self.setupTraversal()
+
+        edgeU = self.edgeU.tolist()
+        edgeV = self.edgeV.tolist()
+
+        # Edges grouped by component, each group following the linear matrix order
+        edge_labels = self.labels[self.edgeU]
+        edge_order = np.argsort(edge_labels, kind='mergesort')
+        edge_bounds = np.searchsorted(edge_labels[edge_order], np.arange(len(self.components) + 1))
+
+        for c, nodes in enumerate(self.components):
+
+            edges = edge_order[edge_bounds[c]:edge_bounds[c+1]]
+
+            # Graphs must have at least 3 edges to be minimzed
+            if len(edges) <= 2:
+                continue
+
+            # Sorted from the lowest to the highest weight
+            edges = edges[np.argsort(self.edgeW[edges], kind='mergesort')].tolist()
+
+            bridges, numComponents = self.findBridges(nodes)
+            cyclicNodes = self.findCyclicNodes(nodes, bridges)
+
+            for edge in edges:
+
+                if self.lead_index is not None and self.lead_index in (edgeU[edge], edgeV[edge]):
+                    continue
+
+                self.alive[edge] = 0
+
+                if not self.checkConstraints(nodes, cyclicNodes):
+                    self.alive[edge] = 1
+
+
+    def connectComponents(self):
+        """
+        Adds the edges connecting the components of the graph by using the loose
+        similarity scores. A first pass adds one edge at time between the
+        components to form a tree like structure, while a second pass adds a
+        second edge between the former components to provide cycles
+
+        """
+
+        numComponents = len(self.components)
+
+        if numComponents <= 1:
+            return
+
+        loose_mtx = self.dbase.loose_mtx
+        values = np.asarray(loose_mtx)
+
+        k = np.nonzero(values > 0.0)[0]
+
+        i, j = loose_mtx.index_pairs(k)
+
+        cross = self.labels[i] != self.labels[j]
+
+        i = i[cross]
+        j = j[cross]
+        s = values[k[cross]]
+
+        # The node of the component with the lower index comes first
+        swap = self.labels[i] > self.labels[j]
+        u = np.where(swap, j, i)
+        v = np.where(swap, i, j)
+        cu = self.labels[u]
+        cv = self.labels[v]
+
+        # Candidates sorted by decreasing similarity and then by component and node indexes
+        order = np.lexsort((v, u, cv, cu, -s))
+
+        u = u[order].tolist()
+        v = v[order].tolist()
+        cu = cu[order].tolist()
+        cv = cv[order].tolist()
+        s = s[order].tolist()
+
+        numCandidates = len(s)
+
+        # First pass. Between candidates with the same similarity the edge
+        # enumerated first among the current components is selected. Each
+        # merged component is ranked by its first former component
+        parent = list(range(0, numComponents))
+
+        def find(c):
+            while parent[c] != c:
+                parent[c] = parent[parent[c]]
+                c = parent[c]
+            return c
+
+        edgesAddedInFirstTreePass = []
+
+        ptr = 0
+        components_left = numComponents
+
+        while components_left > 1:
+
+            while ptr < numCandidates and find(cu[ptr]) == find(cv[ptr]):
+                ptr += 1
+
+            if ptr == numCandidates:
+                break
+
+            best = None
+            q = ptr
+
+            while q < numCandidates and s[q] == s[ptr]:
+
+                root_u = find(cu[q])
+                root_v = find(cv[q])
+
+                if root_u != root_v:
+                    if root_u < root_v:
+                        key = (root_u, root_v, u[q], v[q])
+                    else:
+                        key = (root_v, root_u, v[q], u[q])
+
+                    if best is None or key < best:
+                        best = key
+                q += 1
+
+            edge = (best[2], best[3], s[ptr])
+
+            edgesAddedInFirstTreePass.append(edge)
+            self.addedEdges.append(edge + (False,))
+
+            parent[best[1]] = best[0]
+            components_left -= 1
+
+
+        # Second pass. The candidates are visited once in sorted order
+        usedEdges = set(edgesAddedInFirstTreePass)
+
+        parent[:] = list(range(0, numComponents))
+        components_left = numComponents
+
+        for q in range(0, numCandidates):
+
+            if components_left == 1:
+                break
+
+            edge = (u[q], v[q], s[q])
+
+            if edge in usedEdges:
+                continue
+
+            root_u = find(cu[q])
+            root_v = find(cv[q])
+
+            if root_u == root_v:
+                continue
+
+            parent[root_v] = root_u
+            components_left -= 1
+
+            self.addedEdges.append(edge + (False,))
+
+
+    def addSurroundEdges(self):
+        """
+        Add surrounding edges in the component of the hub compound to make
+        sure all nodes are in cycle. Each node that is not in a cycle is
+        connected to its most similar compound
+
+        """
+
+        self.setupTraversal()
+
+        lead_component = self.components[self.labels[self.lead_index]]
+
+        bridges, numComponents = self.findBridges(lead_component)
+        cyclicNodes = self.findCyclicNodes(lead_component, bridges)
+
+        for node in lead_component:
+
+            if node in cyclicNodes:
+                continue
+
+            partner, score = self.dbase.best_partner(node, [self.lead_index], self.similarityScoresLimit)
+
+            if score > self.similarityScoresLimit:
+                self.addedEdges.append((node, partner, score, True))
+
+        # Only the component of the hub compound is retained
+        self.nodesOrder = lead_component
+
+
+    def getGraph(self):
+        """
+
+        Returns the final generated NetworkX graph
+
+        """
+
+        graph = nx.Graph()
+
+        for i in self.nodesOrder:
+            graph.add_node(i, ID=self.dbase[i].getID(), fname_comp = os.path.basename(self.dbase[i].getName()))
+
+        nodes = set(self.nodesOrder)
+
+        edgeU = self.edgeU.tolist()
+        edgeV = self.edgeV.tolist()
+        edgeW = self.edgeW.tolist()
+
+        for edge in range(0, len(edgeW)):
+            if self.alive[edge] and edgeU[edge] in nodes:
+                graph.add_edge(edgeU[edge], edgeV[edge], similarity = edgeW[edge], strict_flag = True)
+
+        for edge in self.addedEdges:
+            graph.add_edge(edge[0], edge[1], similarity = edge[2], strict_flag = edge[3])
+
+        return graph
@@ -45,18 +45,125 @@ import numpy as np
 from lomap import mcs
 from lomap import fp 
 from lomap import graphgen
+from lomap import result
 import sys,os
 import math
+import time
+import json
 import multiprocessing
 import networkx as nx
 import logging
 import glob
 import argparse
 import pickle
+import copy
 from rdkit import DataStructs
-from rdkit.Chem.Fingerprints import FingerprintMols
 
-__all__ = ['DBMolecules', 'SMatrix', 'Molecule']
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+# The python 2 file names can be unicode strings too
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+__all__ = ['DBMolecules', 'SMatrix', 'LazySMatrix', 'Molecule']
+
+
+def total_charge(mol):
+    """
+    This function computes the total charge of the passed molecule as the sum
+    of its Tripos partial charges
+
+    Parameters
+    ----------
+    mol : Rdkit molecule object 
+       the molecule
+
+    Returns
+    -------
+    charge : float
+       the total charge
+
+    """
+
+    charge = 0.0
+
+    for atom in mol.GetAtoms():
+        charge += float(atom.GetProp('_TriposPartialCharge'))
+
+    return charge
+
+
+def ecr(mol_i, mol_j):
+    """
+    This function computes the similariry score between the passed molecules 
+    by using the EleCtrostatic Rule (ECR)
+
+    Parameters
+    ----------
+    mol_i : Rdkit molecule object 
+       the first molecules used to calculate the ECR rule  
+    mol_j : Rdkit molecule object 
+       the second molecules used to calculate the ECR rule 
+
+    Returns
+    -------
+    scr_ecr: float
+        the calculated similarity score (1 if mol_i and mol_j have the
+        same total charges, 0  otherwire)
+
+    """
+    
+    if abs(total_charge(mol_j) - total_charge(mol_i)) < 1e-3:
+        scr_ecr = 1.0
+    else:
+        scr_ecr = 0.0
+    
+    return scr_ecr
+
+
+def bulk_similarity(fp, fps):
+    """
+    This function computes the Tanimoto similarities between a fingerprint 
+    and a list of fingerprints. The fingerprints with different sizes are 
+    folded as done by the DataStructs.FingerprintSimilarity function and the
+    fingerprints with the same size are compared in bulk
+
+    Parameters
+    ----------
+    fp : RDKit bit vector
+       the reference fingerprint
+    fps : list of RDKit bit vectors
+       the fingerprints compared with the reference fingerprint
+
+    Returns
+    -------
+    scores : numpy array of float
+       the Tanimoto similarities
+
+    """
+
+    scores = np.zeros(len(fps))
+
+    size = fp.GetNumBits()
+
+    groups = {}
+    for t, fp_t in enumerate(fps):
+        groups.setdefault(fp_t.GetNumBits(), []).append(t)
+
+    for size_t, indexes in groups.items():
+        if size_t > size:
+            scores[indexes] = DataStructs.BulkTanimotoSimilarity(fp, [DataStructs.FoldFingerprint(fps[t], size_t // size) for t in indexes])
+        elif size_t < size:
+            scores[indexes] = DataStructs.BulkTanimotoSimilarity(DataStructs.FoldFingerprint(fp, size // size_t), [fps[t] for t in indexes])
+        else:
+            scores[indexes] = DataStructs.BulkTanimotoSimilarity(fp, [fps[t] for t in indexes])
+
+    return scores
 
 
 #*************************
@@ -74,7 +181,12 @@ class DBMolecules(object):
     def __init__(self, directory, parallel=1, verbose='off',
                  time=20, ecrscore=0.0, output=False, 
                  name='out', display=False, 
-                 max=6, cutoff=0.4, radial=False, hub=None, fingerprint=False, fast=False): 
+                 max=6, cutoff=0.4, radial=False, hub=None, fingerprint=False, fast=False,
+                 engine='networkx', lazy=False, candidates=0, fingerprint_type='topological',
+                 fingerprint_radius=2, fingerprint_size=2048, fingerprint_cache=False, triage=0.0,
+                 cluster=0.0, bridges=3, depiction_cache=False, report_connected=False,
+                 report_threshold=0.0, report_gzip=False, timing=False, progress=0.0,
+                 status_file=None): 
 
         """
         Initialization of  the Molecule Database Class
@@ -101,6 +213,56 @@ class DBMolecules(object):
            the maximum distance used to cluster the graph nodes
         cutoff : float
            the Minimum Similarity Score (MSS) used to build the graph
+        engine : str
+           the graph engine: 'networkx' or 'native' to run the graph 
+           algorithm on compact arrays
+        lazy : bool
+           a flag used to compute the similarity scores on demand. In the 
+           radial fast mode only the hub compound scores are computed up front
+        candidates : int
+           if greater than zero, the number of candidate partners selected for 
+           each molecule by fingerprint similarity. Just the candidate pairs 
+           are scored by MCS
+        fingerprint_type : str
+           the structural fingerprint type: 'topological', 'morgan' or 'atompair'
+        fingerprint_radius : int
+           the Morgan fingerprint radius
+        fingerprint_size : int
+           the number of bits of the Morgan and atom pair fingerprints
+        fingerprint_cache : bool
+           a flag used to store the computed fingerprints in a cache file in the
+           mol2 directory and to reuse them in the following runs
+        triage : float
+           if greater than zero, the fingerprint Tanimoto similarity threshold
+           of the MCS scoring. The pairs below the threshold are not scored 
+           by MCS and their similarity scores are set to zero
+        cluster : float
+           if greater than zero, the fingerprint Tanimoto similarity threshold
+           used to cluster the molecules. Just the pairs inside the clusters 
+           and a few bridge pairs between the clusters are scored by MCS
+        bridges : int
+           the number of most similar bridge pairs scored between each 
+           cluster and the other clusters
+        depiction_cache : bool
+           a flag used to store the molecule images used to depict the graph 
+           in a cache directory in the mol2 directory and to reuse them in the
+           following runs
+        report_connected : bool
+           a flag used to write just the connected pairs in the score report
+        report_threshold : float
+           if greater than zero, just the pairs whose loose score is greater
+           or equal than the threshold are written in the score report
+        report_gzip : bool
+           a flag used to write the score report as gzip compressed file
+        timing : bool
+           a flag used to write the table of the pair scoring times and 
+           outcomes and their summary at the end of the matrix scoring
+        progress : float
+           if greater than zero, the interval in seconds between the progress
+           reports of the matrix scoring
+        status_file : str
+           if not None, the file where the matrix scoring progress is written
+           in JSON format at each progress report
 
         """
 
@@ -130,17 +292,48 @@ class DBMolecules(object):
 
             if not isinstance(radial,  bool):
                 raise TypeError('The radial flag is not a bool type')
+
+            if not isinstance(lazy,  bool):
+                raise TypeError('The lazy flag is not a bool type')
+
+            if not isinstance(fingerprint_cache,  bool):
+                raise TypeError('The fingerprint cache flag is not a bool type')
+
+            if not isinstance(depiction_cache,  bool):
+                raise TypeError('The depiction cache flag is not a bool type')
+
+            if not isinstance(report_connected,  bool):
+                raise TypeError('The report connected flag is not a bool type')
+
+            if not isinstance(report_gzip,  bool):
+                raise TypeError('The report gzip flag is not a bool type')
+
+            if not isinstance(timing,  bool):
+                raise TypeError('The timing flag is not a bool type')
             output_str=''
             display_str=''
             radial_str=''
             fingerprint_str=''
             fast_str=''
+            lazy_str=''
+            fingerprint_cache_str=''
+            depiction_cache_str=''
+            report_connected_str=''
+            report_gzip_str=''
+            timing_str=''
+            status_file_str=''
 
             parser.set_defaults(output=output)
             parser.set_defaults(display=display)
             parser.set_defaults(radial=radial)
             parser.set_defaults(fingerprint=fingerprint)
             parser.set_defaults(fast=fast)
+            parser.set_defaults(lazy=lazy)
+            parser.set_defaults(fingerprint_cache=fingerprint_cache)
+            parser.set_defaults(depiction_cache=depiction_cache)
+            parser.set_defaults(report_connected=report_connected)
+            parser.set_defaults(report_gzip=report_gzip)
+            parser.set_defaults(timing=timing)
             if output:
                 output_str='--output'
 
@@ -156,8 +349,31 @@ class DBMolecules(object):
             if fast:
                 fast_str = '--fast'
 
-            names_str = '%s --parallel %s --verbose %s --time %s --ecrscore %s --name %s --max %s --cutoff %s --hub %s %s %s %s %s %s'\
-                         % (directory, parallel, verbose, time, ecrscore, name, max, cutoff, hub, output_str, display_str, radial_str, fingerprint_str, fast_str)
+            if lazy:
+                lazy_str = '--lazy'
+
+            if fingerprint_cache:
+                fingerprint_cache_str = '--fingerprint_cache'
+
+            if depiction_cache:
+                depiction_cache_str = '--depiction_cache'
+
+            if report_connected:
+                report_connected_str = '--report_connected'
+
+            if report_gzip:
+                report_gzip_str = '--report_gzip'
+
+            if timing:
+                timing_str = '--timing'
+
+            if status_file:
+                status_file_str = '--status_file %s' % status_file
+
+            names_str = '%s --parallel %s --verbose %s --time %s --ecrscore %s --name %s --max %s --cutoff %s --hub %s --engine %s --candidates %s --fingerprint_type %s --fingerprint_radius %s --fingerprint_size %s --triage %s --cluster %s --bridges %s --report_threshold %s --progress %s %s %s %s %s %s %s %s %s %s %s %s %s'\
+                         % (directory, parallel, verbose, time, ecrscore, name, max, cutoff, hub, engine, candidates, fingerprint_type, fingerprint_radius, fingerprint_size, triage, cluster, bridges, report_threshold, progress,
+                            output_str, display_str, radial_str, fingerprint_str, fast_str, lazy_str, fingerprint_cache_str, depiction_cache_str,
+                            report_connected_str, report_gzip_str, timing_str, status_file_str)
 
             self.options = parser.parse_args(names_str.split())
 
@@ -179,6 +395,19 @@ class DBMolecules(object):
         self.strict_mtx = SMatrix(shape=(0,))
         self.loose_mtx = SMatrix(shape=(0,))
 
+        # Molecule fingerprints, computed on demand in fingerprint mode
+        self.fps = None
+
+        # Scoring records of the pairs computed by the last matrix scoring
+        self.pair_records = []
+
+        # Flags of the computed linear matrix elements in lazy mode. None if 
+        # all the similarity scores have been computed
+        self.scored = None
+
+        # Flags of the linear matrix elements selected by the candidate 
+        # options. None if the matrices have not been built from candidates
+        self.candidate_scored = None
         
         # Empty pointer to the networkx graph 
         self.Graph = nx.Graph() 
@@ -257,6 +486,177 @@ class DBMolecules(object):
         return len(self.__list)
 
 
+    def add_molecule(self, fname):
+        """
+        This function reads a mol2 file of the molecule directory and appends
+        the molecule to the molecule database. The fingerprints already computed
+        are extended with the new molecule fingerprint, while the similarity
+        score matrices must be built again
+
+        Parameters
+        ----------
+        fname : str
+           the mol2 file name, relative to the molecule directory
+
+        Returns
+        -------
+        mol : Molecule object
+           the appended molecule
+
+        """
+
+        fname = os.path.basename(fname)
+
+        if fname in self.dic_mapping.values():
+            raise ValueError('The molecule %s is already in the molecule database' % fname)
+
+        rdkit_mol = Chem.MolFromMol2File(os.path.join(self.options.directory, fname), sanitize=False, removeHs=False)
+
+        if rdkit_mol == None:
+            raise IOError('Error reading the file: %s' % fname)
+
+        mol = Molecule(rdkit_mol, self.nums(), fname)
+
+        self.__list.append(mol)
+        self.dic_mapping[mol.getID()] = mol.getName()
+
+        if self.fps is not None:
+            try:
+                self.fps.append(fp.options_fingerprint(mol.getMolecule(), self.options))
+            except Exception as e:
+                logging.warning('Skipping fingerprint molecule: %s\t\n\n%s' % (fname, e))
+                self.fps.append(None)
+
+        logging.info('ID %s\t%s' % (mol.getID(), fname))
+
+        return mol
+
+
+    def subset(self, indexes):
+        """
+        This function creates a molecule database with a selection of the
+        molecules and a copy of the user options. The selected molecules are
+        renumbered in the selection order, the computed fingerprints are shared
+        and the similarity score matrices are empty
+
+        Parameters
+        ----------
+        indexes : list of int
+           the indexes of the selected molecules
+
+        Returns
+        -------
+        dbase : DBMolecules object
+           the molecule database of the selected molecules
+
+        """
+
+        sub = copy.copy(self)
+        sub.options = argparse.Namespace(**vars(self.options))
+
+        sub.__list = [Molecule(self[i].getMolecule(), k, self[i].getName()) for k, i in enumerate(indexes)]
+        sub.dic_mapping = dict((mol.getID(), mol.getName()) for mol in sub.__list)
+        sub.__ci = 0
+
+        sub.strict_mtx = SMatrix(shape=(0,))
+        sub.loose_mtx = SMatrix(shape=(0,))
+        sub.ecr_mtx = SMatrix(shape=(0,))
+        sub.scored = None
+        sub.candidate_scored = None
+        sub.pair_records = []
+        sub.Graph = nx.Graph()
+
+        if self.fps is not None:
+            sub.fps = [self.fps[i] for i in indexes]
+
+        return sub
+
+
+    def subset_matrices(self, molecules, matrices=None):
+        """
+        This function creates the molecule database of a subset of the scored
+        molecules with its similarity score matrices gathered from the molecule
+        database matrices. Just the subset pairs which have not been scored yet
+        are computed, and they are stored in the molecule database matrices too.
+        If the matrices have not been built or loaded, they are set up in lazy
+        mode so that just the subset pairs are scored. The matrices built with
+        the candidates, triage or cluster options are not accepted, while the
+        pairs not selected by a loaded candidate run are computed
+
+        Parameters
+        ----------
+        molecules : list of int or str
+           the selected molecule IDs or file names
+        matrices : str
+           the score file saved by save_matrices or by a previous run, loaded
+           before the selection. If None the current matrices are used
+
+        Returns
+        -------
+        dbase : DBMolecules object
+           the molecule database of the selected molecules with the built
+           similarity score matrices, ready to build the graph
+
+        """
+
+        if matrices is not None:
+            self.load_matrices(matrices)
+
+        n = self.nums()
+
+        if self.strict_mtx.size != n*(n-1)//2:
+            self.strict_mtx = SMatrix(shape=(n,))
+            self.loose_mtx = SMatrix(shape=(n,))
+            self.ecr_mtx = SMatrix(shape=(n,))
+            self.build_lazy_matrices()
+        elif self.candidate_scored is not None and not self.candidate_scored.all():
+            # The pairs not selected by the candidate options have not been scored
+            raise ValueError("The subset scores need the matrices built without the candidates, triage and cluster options")
+
+        ids = [self[i].getID() for i in range(0, n)]
+        names = [self[i].getName() for i in range(0, n)]
+
+        indexes = []
+        for molecule in molecules:
+            if molecule in names:
+                indexes.append(names.index(molecule))
+            elif not isinstance(molecule, string_types) and molecule in ids:
+                indexes.append(ids.index(molecule))
+            else:
+                raise ValueError('The molecule %s is not in the molecule database' % molecule)
+
+        if len(set(indexes)) != len(indexes):
+            raise ValueError('The molecule selection contains duplicates')
+
+        if len(indexes) < 2:
+            raise ValueError('At least two molecules must be selected')
+
+        sub = self.subset(indexes)
+
+        m = sub.nums()
+        sub.strict_mtx = SMatrix(shape=(m,))
+        sub.loose_mtx = SMatrix(shape=(m,))
+        sub.ecr_mtx = SMatrix(shape=(m,))
+
+        # Linear indexes of the subset pairs in the molecule database matrices
+        i, j = sub.strict_mtx.index_pairs(np.arange(m*(m-1)//2))
+        indexes = np.array(indexes, dtype=np.int64)
+        gather = self.strict_mtx.linear_indexes(indexes[i], indexes[j])
+
+        if self.scored is not None:
+            missing = int((~self.scored[gather]).sum())
+            self.score_pairs(gather)
+            logging.info('Subset selection: %d scores reused, %d scores computed' % (gather.size - missing, missing))
+
+        strict_mtx, loose_mtx, ecr_mtx = self.computed_matrices()
+
+        sub.strict_mtx[:] = np.asarray(strict_mtx)[gather]
+        sub.loose_mtx[:] = np.asarray(loose_mtx)[gather]
+        sub.ecr_mtx[:] = np.asarray(ecr_mtx)[gather]
+
+        return sub
+
+
 
     def read_mol2_files(self):
         """
@@ -337,7 +737,8 @@ class DBMolecules(object):
         
 
         
-    def compute_mtx(self, a, b, strict_mtx, loose_mtx, ecr_mtx, fingerprint = False):
+    def compute_mtx(self, a, b, strict_mtx, loose_mtx, ecr_mtx, fingerprint = False, records = None,
+                    progress = None, slot = 0):
         """
         Compute a chunk of the similariry score matrices. The chunk is selected 
         by the start index a and the final index b. The matrices are indeed 
@@ -369,6 +770,15 @@ class DBMolecules(object):
         fingerprint: boolean
            using the structural fingerprint as the similarity matrix, 
            not suggested option but currently runs faster than mcss based similarity
+
+        records : list
+           if not None, the pair scoring records are appended to the list
+
+        progress : ScoringProgress object
+           if not None, the scoring progress where the computed pairs are counted
+
+        slot : int
+           the progress counter slot of the process
           
         """
         # name = multiprocessing.current_process().name
@@ -376,43 +786,10 @@ class DBMolecules(object):
         # print 'a = %d, b = %d' % (a,b)
         # print '\n'  
 
-        
-        def ecr(mol_i, mol_j):
-            """
-            This function computes the similariry score between the passed molecules 
-            by using the EleCtrostatic Rule (ECR)
-
-            Parameters
-            ----------
-            mol_i : Rdkit molecule object 
-               the first molecules used to calculate the ECR rule  
-            mol_j : Rdkit molecule object 
-               the second molecules used to calculate the ECR rule 
-
-            Returns
-            -------
-            scr_ecr: float
-                the calculated similarity score (1 if mol_i and mol_j have the
-                same total charges, 0  otherwire)
-
-            """
-            
-            total_charge_mol_i = 0.0
-            
-            for atom in mol_i.GetAtoms():
-                total_charge_mol_i += float(atom.GetProp('_TriposPartialCharge'))
+        if fingerprint:
+            self.compute_fingerprint_mtx(a, b, strict_mtx, loose_mtx, ecr_mtx)
+            return
 
-            total_charge_mol_j = 0.0
-            
-            for atom in mol_j.GetAtoms():
-                total_charge_mol_j += float(atom.GetProp('_TriposPartialCharge'))
-            if abs(total_charge_mol_j - total_charge_mol_i) < 1e-3:
-                scr_ecr = 1.0
-            else:
-                scr_ecr = 0.0
-            
-            return scr_ecr
-        
         # Total number of loaded molecules
         n = self.nums()
         
@@ -424,377 +801,2099 @@ class DBMolecules(object):
             i = int(n - 2 - math.floor(math.sqrt(-8*k + 4*n*(n-1)-7)/2.0 - 0.5))
             j = int(k + i + 1 - n*(n-1)/2 + (n-i)*((n-i)-1)/2)
             #print 'k = %d , i = %d , j = %d' % (k,i,j)
-    
-            # The Rdkit molecules moli and molj are extracted form the molecule database
-            moli = self[i].getMolecule()
-            molj = self[j].getMolecule()
-
-            #print 'Processing molecules:\n%s\n%s' % (self[i].getName(),self[j].getName())
-
-            # The Electrostatic score rule is calculated
-            ecr_score = ecr(moli, molj)
-
-            # The MCS is computed just if the passed molecules have the same charges 
-            if ecr_score or self.options.ecrscore:
-                try: 
-                    if self.options.verbose == 'pedantic':
-                        logging.info(50*'-')
-                        logging.info('MCS molecules: %s - %s' % (self[i].getName(), self[j].getName())) 
-                    
-                    # Maximum Common Subgraph (MCS) calculation    
-                    logging.info('MCS molecules: %s - %s' % (self[i].getName(), self[j].getName()))
-                    if not fingerprint:
-                        MC = mcs.MCS(moli, molj, options=self.options)
-                    else:
-                        #use the fingerprint as similarity calculation
-                        fps_moli = FingerprintMols.FingerprintMol(moli)
-                        fps_molj = FingerprintMols.FingerprintMol(molj)
-                        fps_tan = DataStructs.FingerprintSimilarity(fps_moli, fps_molj)
 
-                except Exception as e:
-                    if self.options.verbose == 'pedantic':
-                        logging.warning('Skipping MCS molecules: %s - %s\t\n\n%s' % (self[i].getName(), self[j].getName(), e))
-                        logging.info(50*'-')
-                    continue
-            else:
+            record = {}
+            if records is not None:
+                records.append(record)
+
+            scores = self.compute_pair(i, j, fingerprint, record)
+
+            if progress is not None:
+                progress.advance(slot, record['timeout'])
+
+            if scores is None:
                 continue
-                
-            if ecr_score == 0.0 and self.options.ecrscore:
-                logging.critical('WARNING: Mutation between different charge molecules is enabled')
-                ecr_score = self.options.ecrscore
-            
 
-            # The scoring between the two molecules is performed by using different rules.
-            # The total score will be the product of all the single rules
-            if not fingerprint:   
-                tmp_scr = ecr_score * MC.mncar() * MC.mcsr()
-                strict_scr = tmp_scr *  MC.tmcsr(strict_flag=True) 
-                loose_scr = tmp_scr * MC.tmcsr(strict_flag=False) 
-                strict_mtx[k] = strict_scr
-                loose_mtx[k] = loose_scr
-                ecr_mtx[k] = ecr_score
-            else:
-                #for the fingerprint option, currently just use the identical strict and loose mtx
-                strict_scr = fps_tan
-                loose_scr = fps_tan
-                strict_mtx[k] = strict_scr
-                loose_mtx[k] = loose_scr
-                ecr_mtx[k] = ecr_score
-                
-            logging.info('MCS molecules: %s - %s the strict scr is %s' % (self[i].getName(), self[j].getName(), strict_scr))
+            strict_mtx[k], loose_mtx[k], ecr_mtx[k] = scores
     
         return
 
 
-    def build_matrices(self):
+    def compute_fingerprint_mtx(self, a, b, strict_mtx, loose_mtx, ecr_mtx):
         """
-        This function coordinates the calculation of the similarity score matrices
-        by distribuiting chunks of the matrices between the allocated processes
+        Compute a chunk of the similariry score matrices by using the structural 
+        fingerprints. The chunk, selected by the start index a and the final 
+        index b, is split in row segments and the Tanimoto similarities of 
+        each segment are computed in bulk
 
+        Parameters
+        ----------
+        a : int 
+           the start index of the chunk 
+        b : int
+           the final index of the chunk
+        strict_mtx: python multiprocessing array
+           srict simimarity score matrix
+        loose_mtx: python multiprocessing array
+           loose similarity score matrix
+        ecr_mtx: python multiprocessing array
+           EleCtrostatic Rule (ECR) score matrix
+          
         """
-        
-        logging.info('\nMatrix scoring in progress....\n')   
-        
-        # The similarity score matrices are defined instances of the class SMatrix
-        # which implements a basic class for symmetric matrices
-        self.strict_mtx = SMatrix(shape=(self.nums(),))
-        self.loose_mtx = SMatrix(shape=(self.nums(),))
-        self.ecr_mtx = SMatrix(shape=(self.nums(),))
-        # The total number of the effective elements present in the symmetric matrix
-        l = int(self.nums()*(self.nums() - 1)/2)
 
-        
-        if self.options.parallel == 1: # Serial execution
-            self.compute_mtx(0, l-1, self.strict_mtx, self.loose_mtx, self.ecr_mtx, self.options.fingerprint)
-        else: # Parallel execution
-            #add the fingerprint option
-            fingerprint = self.options.fingerprint
-            
-            logging.info('Parallel mode is on')
-            
-            # Number of selected processes
-            np = self.options.parallel
+        fps = self.fingerprints()
+        charges = self.total_charges()
 
-            delta = int(l/np)
-            rem = l%np
+        n = self.nums()
 
-            if delta < 1:
-                kmax = l
-            else:
-                kmax = np
-            proc = []
-            # Shared memory array used by the different allocated processes
-            strict_mtx = multiprocessing.Array('d', self.strict_mtx)
-            loose_mtx =  multiprocessing.Array('d', self.loose_mtx)
-            ecr_mtx =  multiprocessing.Array('d', self.ecr_mtx)
+        k = a
 
-            # Chopping the indexes ridistribuiting the remainder
-            for k in range(0, kmax):
-    
-                spc = delta + int(int(rem/(k+1)) > 0)
-    
-                if k == 0:
-                    i = 0
-                else:
-                    i = j + 1
+        while k <= b:
 
-                if k!= kmax - 1:
-                    j = i + spc - 1
-                else:
-                    j = l - 1
+            i = int(n - 2 - math.floor(math.sqrt(-8*k + 4*n*(n-1)-7)/2.0 - 0.5))
+            j = int(k + i + 1 - n*(n-1)/2 + (n-i)*((n-i)-1)/2)
 
-                #print(i,j)
+            # Row segment A[i, j:j+m] inside the chunk
+            m = min(b - k + 1, n - j)
 
-                # Python multiprocessing allocation
-                p = multiprocessing.Process(target=self.compute_mtx , args=(i, j, strict_mtx, loose_mtx, ecr_mtx, fingerprint,))
-                p.start()
-                proc.append(p)
-            # End parallel execution        
-            for p in proc:
-                p.join()
-          
-            # Copying back the results
-            self.strict_mtx[:] = strict_mtx[:]
-            self.loose_mtx[:] = loose_mtx[:]
-            self.ecr_mtx[:] = ecr_mtx[:]
-        return (self.strict_mtx, self.loose_mtx)
+            # The molecule pairs are scored just if the molecules have the same charges
+            ecr_scores = (np.abs(charges[j:j+m] - charges[i]) < 1e-3).astype(np.float64)
 
+            if self.options.ecrscore and not ecr_scores.all():
+                logging.critical('WARNING: Mutation between different charge molecules is enabled')
+                ecr_scores[ecr_scores == 0.0] = self.options.ecrscore
 
-    def build_graph(self):
-        """
-        This function coordinates the Graph generation
+            # Molecules whose fingerprint generation failed are skipped
+            valid = np.array([fps[i] is not None and fps[j+t] is not None for t in range(0, m)]) & (ecr_scores > 0.0)
 
-        """
-        logging.info('\nGenerating graph in progress....')
+            scores = np.zeros(m)
 
-        # The Graph is build from an instance of the Class GraphGen by passing
-        # the selected user options
-        Gr = graphgen.GraphGen(self)
-        
-        # Writing the results is files
-        if self.options.output:
-            try:
-                Gr.writeGraph()
-                pickle_f = open(self.options.name+".pickle", "w")
-                pickle.dump(Gr, pickle_f)
-            except Exception as e:
-                logging.error(str(e))
+            if valid.any():
+                scores[valid] = bulk_similarity(fps[i], [fps[j+t] for t in np.nonzero(valid)[0]])
 
-        # Handle to the the NetworkX generated graph
-        self.Graph = Gr.getGraph()
+            ecr_scores[~valid] = 0.0
 
-        #print self.Graph.nodes(data=True)
-       
-        # Display the graph by using Matplotlib
-        if self.options.display:
-            Gr.draw()
+            strict_mtx[k:k+m] = scores.tolist()
+            loose_mtx[k:k+m] = scores.tolist()
+            ecr_mtx[k:k+m] = ecr_scores.tolist()
 
-        return self.Graph
+            k += m
+
+        return
 
 
-    def write_dic(self):
+    def fingerprints(self):
         """
-        This function write out a text file with the mapping between the 
-        generated molecule indexes and the corresponding molecule file names
+        This function returns the structural fingerprints of the molecules. The
+        fingerprints are computed once and cached
+
+        Returns
+        -------
+        fps : list of fingerprints
+           the molecule fingerprints. The fingerprint is None if its generation 
+           failed
 
         """
 
-        try:
-            file_txt = open(self.options.name+'.txt', 'w')
-        except Exception:
-            raise IOError('It was not possible to write out the mapping file')
-            
-        file_txt.write('#ID\tFileName\n')
-        for key in self.dic_mapping:
-            file_txt.write('%d\t%s\n' % (key, self.dic_mapping[key]))
+        if self.fps is None:
 
-        file_txt.close() 
+            cache = {}
+            if self.options.fingerprint_cache:
+                cache = self.read_fingerprint_cache()
 
-#*************************
-# Symmetric  Class
-#*************************
+            computed = 0
 
-class SMatrix(np.ndarray):
-    """
-    This class implements a "basic" interface for symmetric matrices 
-    subclassing ndarray. The class interanlly stores a bidimensional 
-    numpy array as a linear array A[k], however the user can still 
+            self.fps = []
+            for i in range(0, self.nums()):
+
+                fname = self[i].getName()
+                stamp = self.file_stamp(fname)
+
+                # Fingerprints cached for an unchanged mol2 file are reused
+                if fname in cache and cache[fname][0] == stamp:
+                    self.fps.append(DataStructs.ExplicitBitVect(cache[fname][1]))
+                    continue
+                
+                try:
+                    fps = fp.options_fingerprint(self[i].getMolecule(), self.options)
+                except Exception as e:
+                    logging.warning('Skipping fingerprint molecule: %s\t\n\n%s' % (fname, e))
+                    self.fps.append(None)
+                    continue
+
+                self.fps.append(fps)
+                cache[fname] = (stamp, fps.ToBinary())
+                computed += 1
+
+            if self.options.fingerprint_cache and computed:
+                self.write_fingerprint_cache(cache)
+
+        return self.fps
+
+
+    def fingerprint_cache_file(self):
+        """
+        This function returns the name of the fingerprint cache file. The 
+        file is stored in the mol2 directory and its name depends on the 
+        fingerprint type and parameters
+
+        Returns
+        -------
+        fname : str
+           the cache file name
+
+        """
+
+        key = self.options.fingerprint_type
+
+        if key == 'morgan':
+            key += '_%d' % self.options.fingerprint_radius
+
+        if key != 'topological':
+            key += '_%d' % self.options.fingerprint_size
+
+        return os.path.join(self.options.directory, '.lomap_fingerprints_%s.pickle' % key)
+
+
+    def file_stamp(self, fname):
+        """
+        This function returns the modification time and the size of a mol2 
+        file, used to detect the cached fingerprints of modified files
+
+        Parameters
+        ----------
+        fname : str
+           the mol2 file name
+
+        Returns
+        -------
+        stamp : tuple
+           the file modification time and size
+
+        """
+
+        stat = os.stat(os.path.join(self.options.directory, fname))
+
+        return (stat.st_mtime, stat.st_size)
+
+
+    def read_fingerprint_cache(self):
+        """
+        This function reads the fingerprint cache file. A missing or 
+        unreadable file gives an empty cache
+
+        Returns
+        -------
+        cache : dictionary
+           the cached binary fingerprints and file stamps keyed by the mol2 
+           file names
+
+        """
+
+        fname = self.fingerprint_cache_file()
+
+        if not os.path.isfile(fname):
+            return {}
+
+        try:
+            with open(fname, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+        except Exception as e:
+            logging.warning('Ignoring the fingerprint cache file: %s\t\n\n%s' % (fname, e))
+            return {}
+
+        if not isinstance(cache, dict):
+            logging.warning('Ignoring the fingerprint cache file: %s' % fname)
+            return {}
+
+        return cache
+
+
+    def write_fingerprint_cache(self, cache):
+        """
+        This function writes the fingerprint cache file. The run goes on if 
+        the file cannot be written
+
+        Parameters
+        ----------
+        cache : dictionary
+           the cached binary fingerprints and file stamps keyed by the mol2 
+           file names
+
+        """
+
+        fname = self.fingerprint_cache_file()
+
+        try:
+            with open(fname, 'wb') as cache_file:
+                pickle.dump(cache, cache_file, protocol=2)
+        except Exception as e:
+            logging.warning('Unable to write the fingerprint cache file: %s\t\n\n%s' % (fname, e))
+
+
+    def total_charges(self):
+        """
+        This function returns the total charges of the molecules
+
+        Returns
+        -------
+        charges : numpy array of float
+           the molecule total charges
+
+        """
+
+        return np.array([total_charge(self[i].getMolecule()) for i in range(0, self.nums())])
+
+
+    def compute_pair(self, i, j, fingerprint = False, record = None):
+        """
+        Compute the similarity scores between the molecules i and j
+
+        Parameters
+        ----------
+        i : int 
+           the index of the first molecule
+        j : int
+           the index of the second molecule
+        fingerprint: boolean
+           using the structural fingerprint as the similarity score
+        record : dictionary
+           if not None, it is filled with the pair scoring times in seconds 
+           and outcome, see the pair_record function
+
+        Returns
+        -------
+        scores : tuple of float or None
+           the strict, loose and ECR scores. None if the molecules have not 
+           been scored
+
+        """
+
+        start = time.time()
+
+        if record is None:
+            record = {}
+
+        record.update(pair_record(i, j))
+
+        # The Rdkit molecules moli and molj are extracted form the molecule database
+        moli = self[i].getMolecule()
+        molj = self[j].getMolecule()
+
+        #print 'Processing molecules:\n%s\n%s' % (self[i].getName(),self[j].getName())
+
+        # The Electrostatic score rule is calculated
+        ecr_score = ecr(moli, molj)
+
+        # The MCS is computed just if the passed molecules have the same charges 
+        if ecr_score or self.options.ecrscore:
+            try: 
+                if self.options.verbose == 'pedantic':
+                    logging.info(50*'-')
+                    logging.info('MCS molecules: %s - %s' % (self[i].getName(), self[j].getName())) 
+                
+                # Maximum Common Subgraph (MCS) calculation    
+                logging.info('MCS molecules: %s - %s' % (self[i].getName(), self[j].getName()))
+                if not fingerprint:
+                    MC = mcs.MCS(moli, molj, options=self.options)
+                    record['mcs'] = MC.timings['mcs']
+                    record['mapping'] = MC.timings['mapping']
+                    record['timeout'] = MC.timeout
+                    record['mcs_atoms'] = MC.mcs_mol.GetNumAtoms()
+                else:
+                    #use the fingerprint as similarity calculation
+                    fps = self.fingerprints()
+                    fps_tan = DataStructs.FingerprintSimilarity(fps[i], fps[j])
+
+            except Exception as e:
+                if self.options.verbose == 'pedantic':
+                    logging.warning('Skipping MCS molecules: %s - %s\t\n\n%s' % (self[i].getName(), self[j].getName(), e))
+                    logging.info(50*'-')
+
+                # The MCS search time is not available for a failed MCS, the
+                # search is assumed timed out if the whole time has been used
+                record['total'] = time.time() - start
+                record['timeout'] = record['total'] >= self.options.time
+                record['status'] = 'failed'
+                record['reason'] = str(e)
+                return None
+        else:
+            record['total'] = time.time() - start
+            record['status'] = 'charge'
+            record['reason'] = 'Different charges'
+            return None
+            
+        if ecr_score == 0.0 and self.options.ecrscore:
+            logging.critical('WARNING: Mutation between different charge molecules is enabled')
+            ecr_score = self.options.ecrscore
+        
+
+        # The scoring between the two molecules is performed by using different rules.
+        # The total score will be the product of all the single rules
+        if not fingerprint:   
+            tmp_scr = ecr_score * MC.mncar() * MC.mcsr()
+            tmcsr_start = time.time()
+            strict_scr = tmp_scr *  MC.tmcsr(strict_flag=True) 
+            loose_scr = tmp_scr * MC.tmcsr(strict_flag=False) 
+            record['tmcsr'] = time.time() - tmcsr_start
+        else:
+            #for the fingerprint option, currently just use the identical strict and loose mtx
+            strict_scr = fps_tan
+            loose_scr = fps_tan
+            
+        logging.info('MCS molecules: %s - %s the strict scr is %s' % (self[i].getName(), self[j].getName(), strict_scr))
+
+        record['total'] = time.time() - start
+        record['status'] = 'scored'
+
+        return (strict_scr, loose_scr, ecr_score)
+
+
+    def build_matrices(self):
+        """
+        This function coordinates the calculation of the similarity score matrices
+        by distribuiting chunks of the matrices between the allocated processes
+
+        """
+        
+        logging.info('\nMatrix scoring in progress....\n')   
+        
+        # The similarity score matrices are defined instances of the class SMatrix
+        # which implements a basic class for symmetric matrices
+        self.strict_mtx = SMatrix(shape=(self.nums(),))
+        self.loose_mtx = SMatrix(shape=(self.nums(),))
+        self.ecr_mtx = SMatrix(shape=(self.nums(),))
+        # The total number of the effective elements present in the symmetric matrix
+        l = int(self.nums()*(self.nums() - 1)/2)
+
+        self.scored = None
+        self.candidate_scored = None
+
+        # Scoring records of the computed pairs
+        self.pair_records = []
+        start = time.time()
+
+        # In lazy mode the scoring records are reported by build_graph
+        if self.options.lazy:
+            self.build_lazy_matrices()
+            return (self.strict_mtx, self.loose_mtx)
+
+        if self.options.candidates or self.options.triage or self.options.cluster:
+            self.build_candidate_matrices()
+            self.report_timings(time.time() - start)
+            return (self.strict_mtx, self.loose_mtx)
+
+        # The fingerprints are computed once and shared with the allocated processes
+        if self.options.fingerprint:
+            self.fingerprints()
+        
+        # The records are collected just with the timing option
+        records = self.pair_records if self.options.timing else None
+
+        # The fingerprint scores are fast and their progress is not reported
+        progress = None
+        if not self.options.fingerprint:
+            progress = self.scoring_progress(l, max(1, min(self.options.parallel, l)))
+
+        if self.options.parallel == 1: # Serial execution
+            self.compute_mtx(0, l-1, self.strict_mtx, self.loose_mtx, self.ecr_mtx, self.options.fingerprint, records, progress)
+        else: # Parallel execution
+            #add the fingerprint option
+            fingerprint = self.options.fingerprint
+            
+            logging.info('Parallel mode is on')
+            
+            # Number of selected processes
+            np = self.options.parallel
+
+            delta = int(l/np)
+            rem = l%np
+
+            if delta < 1:
+                kmax = l
+            else:
+                kmax = np
+            proc = []
+            # Queue used to collect the scoring records of the processes
+            queue = None
+            if records is not None:
+                queue = multiprocessing.Queue()
+            # Shared memory array used by the different allocated processes
+            strict_mtx = multiprocessing.Array('d', self.strict_mtx)
+            loose_mtx =  multiprocessing.Array('d', self.loose_mtx)
+            ecr_mtx =  multiprocessing.Array('d', self.ecr_mtx)
+
+            # Chopping the indexes ridistribuiting the remainder
+            for k in range(0, kmax):
+    
+                spc = delta + int(int(rem/(k+1)) > 0)
+    
+                if k == 0:
+                    i = 0
+                else:
+                    i = j + 1
+
+                if k!= kmax - 1:
+                    j = i + spc - 1
+                else:
+                    j = l - 1
+
+                #print(i,j)
+
+                # Python multiprocessing allocation
+                p = multiprocessing.Process(target=score_chunk , args=(self, i, j, strict_mtx, loose_mtx, ecr_mtx, fingerprint, queue, progress, k,))
+                p.start()
+                proc.append(p)
+            # The records are collected before joining the processes and the
+            # progress is reported while waiting for them. The processes ended
+            # without sending their records, e.g. killed, are not waited for
+            received = 0
+            while True:
+                wait = 1.0
+                if progress is not None:
+                    wait = min(wait, max(0.0, progress.next_report - time.time()))
+
+                if queue is not None and received < len(proc):
+                    try:
+                        records.extend(queue.get(timeout=wait))
+                        received += 1
+                        continue
+                    except Empty:
+                        if all(p.exitcode is not None for p in proc) and queue.empty():
+                            break
+                else:
+                    running = [p for p in proc if p.exitcode is None]
+                    if not running:
+                        break
+                    running[0].join(wait)
+
+                if progress is not None and time.time() >= progress.next_report:
+                    progress.report()
+
+            if queue is not None and received < len(proc):
+                logging.warning('The scoring records of %d processes are missing' % (len(proc) - received))
+            # End parallel execution        
+            for p in proc:
+                p.join()
+          
+            # Copying back the results
+            self.strict_mtx[:] = strict_mtx[:]
+            self.loose_mtx[:] = loose_mtx[:]
+            self.ecr_mtx[:] = ecr_mtx[:]
+
+        if progress is not None:
+            progress.report(final=True)
+
+        self.report_timings(time.time() - start)
+
+        return (self.strict_mtx, self.loose_mtx)
+
+
+    def save_matrices(self, fname):
+        """
+        This function saves the similarity score matrices in an uncompressed 
+        numpy .npz file with the molecule names and mol2 file hashes, so that 
+        the scores can be reloaded by the load_matrices function
+
+        Parameters
+        ----------
+        fname : str
+           the score file name
+
+        """
+
+        np.savez(fname, **result.score_arrays(self))
+
+
+    def load_matrices(self, fname):
+        """
+        This function loads the similarity score matrices saved by the 
+        save_matrices function or in the result bundle of a previous run, 
+        skipping the scoring. The saved molecule names and mol2 file hashes 
+        must match the molecules of the database, and the pairs must have 
+        been selected by the same candidates, triage and cluster options. The
+        scores not computed by a lazy run, or not selected as candidates, are
+        computed on demand
+
+        Parameters
+        ----------
+        fname : str
+           the score file name
+
+        Returns
+        -------
+        strict_mtx, loose_mtx : SMatrix
+           the strict and loose similarity score matrices
+
+        """
+
+        logging.info('\nLoading the similarity scores from %s....\n' % fname)
+
+        data = result.load_result(fname, mmap_mode=None)
+
+        names = [self[i].getName() for i in range(0, self.nums())]
+        hashes = [result.file_hash(os.path.join(self.options.directory, name)) for name in names]
+
+        if list(data['names']) != names:
+            raise ValueError('The molecules of the score file %s do not match the molecule database' % fname)
+
+        if list(data['hashes']) != hashes:
+            raise ValueError('The mol2 files have been modified since the score file %s was saved' % fname)
+
+        if 'scoring' in data and str(data['scoring']) != result.scoring_settings(self.options):
+            if result.selection_settings(str(data['scoring'])) != result.selection_settings(result.scoring_settings(self.options)):
+                raise ValueError('The pairs of the score file %s have been selected by different candidate options: %s' 
+                                 % (fname, str(data['scoring'])))
+            logging.warning('The scoring options of the score file %s are different: %s' % (fname, str(data['scoring'])))
+
+        self.strict_mtx = SMatrix(shape=(self.nums(),))
+        self.loose_mtx = SMatrix(shape=(self.nums(),))
+        self.ecr_mtx = SMatrix(shape=(self.nums(),))
+
+        self.strict_mtx[:] = data['strict']
+        self.loose_mtx[:] = data['loose']
+        self.ecr_mtx[:] = data['ecr']
+
+        self.scored = None
+        self.candidate_scored = None
+
+        if not data['scored'].all():
+            self.build_lazy_matrices(np.array(data['scored'], dtype=bool))
+
+        return (self.strict_mtx, self.loose_mtx)
+
+
+    def find_hub(self):
+        """
+        This function returns the index of the hub compound selected by the
+        hub option
+
+        Returns
+        -------
+        hub_index : int or None
+           the hub compound index. None if the hub compound has not been found
+        
+        """
+
+        hub_index = None
+
+        for i in range(0, self.nums()):
+            if os.path.basename(self[i].getName()) == self.options.hub:
+                hub_index = i
+
+        return hub_index
+
+
+    def candidate_pairs(self, k):
+        """
+        This function selects the candidate molecule pairs for the MCS scoring.
+        For each molecule, the k molecules with the most similar structural 
+        fingerprints are selected
+
+        Parameters
+        ----------
+        k : int
+           the number of candidate partners of each molecule
+
+        Returns
+        -------
+        indexes : numpy array of int
+           the sorted linear matrix indexes of the union of the candidate pairs
+
+        """
+
+        if k < 1:
+            raise ValueError('%s is not a positive integer number' % k)
+
+        packed = fp.PackedFingerprints(self.fingerprints())
+
+        nearest, scores = packed.top_k(k, self.options.parallel)
+
+        rows = np.repeat(np.arange(0, self.nums()), nearest.shape[1])
+
+        return np.unique(self.strict_mtx.linear_indexes(rows, nearest.ravel()))
+
+
+    def triage_pairs(self, threshold, indexes=None, similarities=None):
+        """
+        This function selects the molecule pairs whose structural fingerprint 
+        Tanimoto similarity is greater or equal than the passed threshold
+
+        Parameters
+        ----------
+        threshold : float
+           the fingerprint similarity threshold
+        indexes : numpy array of int
+           the linear matrix indexes of the pairs to select from. All the 
+           pairs are used if None
+        similarities : numpy array of float
+           the fingerprint similarities of all the pairs stored as linear 
+           matrix array. If None just the similarities of the pairs to select
+           from are computed
+
+        Returns
+        -------
+        indexes : numpy array of int
+           the sorted linear matrix indexes of the selected pairs
+
+        """
+
+        if similarities is not None:
+            if indexes is None:
+                indexes = np.arange(0, similarities.size)
+            return indexes[similarities[indexes] >= threshold]
+
+        packed = fp.PackedFingerprints(self.fingerprints())
+
+        if indexes is None:
+            similarities = packed.all_pairs(self.options.parallel)
+            return np.nonzero(similarities >= threshold)[0]
+
+        i, j = self.strict_mtx.index_pairs(indexes)
+
+        return indexes[packed.pair_similarity(i, j) >= threshold]
+
+
+    def fingerprint_clusters(self, threshold, similarities=None):
+        """
+        This function clusters the molecules by using the Butina algorithm on
+        the structural fingerprint similarities. The molecules are visited by 
+        decreasing number of neighbors, the molecules with similarity greater 
+        or equal than the threshold. Each molecule not yet clustered starts a 
+        new cluster with its neighbors not yet clustered
+
+        Parameters
+        ----------
+        threshold : float
+           the fingerprint similarity threshold
+        similarities : numpy array of float
+           the fingerprint similarities stored as linear matrix array. They 
+           are computed if None
+
+        Returns
+        -------
+        labels : numpy array of int
+           the cluster index of each molecule
+
+        """
+
+        n = self.nums()
+
+        if similarities is None:
+            similarities = fp.PackedFingerprints(self.fingerprints()).all_pairs(self.options.parallel)
+
+        i, j = self.strict_mtx.index_pairs(np.nonzero(similarities >= threshold)[0])
+
+        neighbors = [[] for a in range(0, n)]
+        for a, b in zip(i.tolist(), j.tolist()):
+            neighbors[a].append(b)
+            neighbors[b].append(a)
+
+        counts = np.array([len(nb) for nb in neighbors])
+
+        labels = -np.ones(n, dtype=np.int64)
+
+        cluster = 0
+        
+        # Ties are broken by the lowest molecule index
+        for c in np.argsort(-counts, kind='mergesort').tolist():
+            if labels[c] >= 0:
+                continue
+            labels[c] = cluster
+            for b in neighbors[c]:
+                if labels[b] < 0:
+                    labels[b] = cluster
+            cluster += 1
+
+        return labels
+
+
+    def cluster_pairs(self, threshold, bridges, similarities=None):
+        """
+        This function selects the molecule pairs for the MCS scoring after 
+        clustering the molecules by fingerprint similarity. All the pairs 
+        inside each cluster are selected. Between the clusters, for each 
+        cluster just the pairs with the most similar fingerprints linking it 
+        to the other clusters are selected, so that the graph generation 
+        still has bridges to connect the cluster subgraphs
+
+        Parameters
+        ----------
+        threshold : float
+           the fingerprint similarity threshold used to cluster the molecules
+        bridges : int
+           the number of bridge pairs selected for each cluster
+        similarities : numpy array of float
+           the fingerprint similarities stored as linear matrix array. They 
+           are computed if None
+
+        Returns
+        -------
+        indexes : numpy array of int
+           the sorted linear matrix indexes of the selected pairs
+
+        """
+
+        if similarities is None:
+            similarities = fp.PackedFingerprints(self.fingerprints()).all_pairs(self.options.parallel)
+
+        labels = self.fingerprint_clusters(threshold, similarities)
+
+        logging.info('Found %d clusters of %d molecules' % (labels.max() + 1, self.nums()))
+
+        selected = []
+
+        # The pairs are generated cluster by cluster. Each bridge pair is 
+        # ranked inside both the clusters that it links
+        for c in range(0, labels.max() + 1):
+            members = np.nonzero(labels == c)[0]
+            others = np.nonzero(labels != c)[0]
+
+            a, b = np.triu_indices(members.size, 1)
+            selected.append(self.strict_mtx.linear_indexes(members[a], members[b]))
+
+            if bridges <= 0 or others.size == 0:
+                continue
+
+            pairs = self.strict_mtx.linear_indexes(members[:, None], others[None, :]).ravel()
+            scores = similarities[pairs]
+
+            # Just the pairs up to the last bridge similarity, ties included,
+            # are sorted. Ties are broken by the lowest pair index
+            if pairs.size > bridges:
+                last = np.partition(-scores, bridges - 1)[bridges - 1]
+                pairs = pairs[-scores <= last]
+                scores = scores[-scores <= last]
+
+            selected.append(pairs[np.lexsort((pairs, -scores))[:bridges]])
+
+        return np.unique(np.concatenate(selected))
+
+
+    def build_candidate_matrices(self):
+        """
+        This function computes the similarity scores of the candidate molecule 
+        pairs only. The candidates are the pairs selected by all the enabled 
+        selections: the fingerprint nearest neighbors, the fingerprint clusters
+        with their bridges and the pairs over the fingerprint triage threshold.
+        The scores of the other pairs are left to zero, therefore these pairs 
+        are not used to build the graph
+
+        """
+
+        logging.info('Candidate mode is on')
+
+        indexes = None
+
+        if self.options.candidates:
+            indexes = self.candidate_pairs(self.options.candidates)
+
+        # The similarities of all the pairs are needed by the clustering and
+        # are computed once. Otherwise the triage compares just the candidates
+        similarities = None
+
+        if self.options.cluster:
+            similarities = fp.PackedFingerprints(self.fingerprints()).all_pairs(self.options.parallel)
+            selected = self.cluster_pairs(self.options.cluster, self.options.bridges, similarities)
+            indexes = selected if indexes is None else np.intersect1d(indexes, selected)
+
+        if self.options.triage:
+            indexes = self.triage_pairs(self.options.triage, indexes, similarities)
+
+        logging.info('Scoring %d candidate pairs out of %d' % (indexes.size, self.strict_mtx.size))
+
+        self.compute_pairs(indexes, self.strict_mtx, self.loose_mtx, self.ecr_mtx, report=True)
+
+        self.candidate_scored = np.zeros(self.strict_mtx.size, dtype=bool)
+        self.candidate_scored[indexes] = True
+
+
+    def candidate_report(self, k_values):
+        """
+        This function measures how well the candidate pair selection reproduces
+        the complete MCS scoring for different numbers of candidate partners.
+        The similarity score matrices must be completely built. For each k value 
+        the graph is generated by using just the candidate pair scores and it is
+        compared with the graph generated by using all the scores
+
+        Parameters
+        ----------
+        k_values : list of int
+           the numbers of candidate partners of each molecule
+
+        Returns
+        -------
+        report : list of dictionaries
+           for each k value: the number of candidate pairs and their fraction 
+           of all the pairs, the fraction of the pairs scored above the cutoff 
+           that are candidates (pair recall), the fraction of molecules whose
+           most similar molecule is a candidate (partner recall) and the 
+           fraction of the complete graph edges found in the candidate graph 
+           (edge recall)
+
+        """
+
+        if (self.nums() * (self.nums() - 1)/2) != self.strict_mtx.size or self.scored is not None:
+            raise ValueError("The complete similarity score matrices must be built before the candidate report")
+
+        # The pairs not selected by the candidate options have not been scored
+        if not self.scored_flags().all():
+            raise ValueError("The candidate report needs the matrices built without the candidates, triage and cluster options")
+
+        full_graph = graphgen.GraphGen(self).getGraph()
+        full_edges = set([(min(u, v), max(u, v)) for u, v in full_graph.edges()])
+
+        values = np.asarray(self.strict_mtx)
+
+        # Pairs that can be graph edges
+        above = np.nonzero((values > 0.0) & (values >= self.options.cutoff))[0]
+
+        # Most similar molecule of each molecule with a positive score
+        partners = [(i,) + self.best_partner(i) for i in range(0, self.nums())]
+        partners = np.array([self.strict_mtx.linear_indexes(i, j) for i, j, score in partners if score > 0.0], dtype=np.int64)
+
+        report = []
+
+        for k in k_values:
+
+            candidates = np.zeros(values.size, dtype=bool)
+            candidates[self.candidate_pairs(k)] = True
+
+            # Copy of the database with the not candidate scores set to zero
+            sparse = copy.copy(self)
+            sparse.strict_mtx, sparse.loose_mtx, sparse.ecr_mtx = [mtx.copy() for mtx in (self.strict_mtx, self.loose_mtx, self.ecr_mtx)]
+
+            for mtx in (sparse.strict_mtx, sparse.loose_mtx, sparse.ecr_mtx):
+                mtx.view(np.ndarray)[~candidates] = 0.0
+
+            sparse_graph = graphgen.GraphGen(sparse).getGraph()
+            sparse_edges = set([(min(u, v), max(u, v)) for u, v in sparse_graph.edges()])
+
+            report.append({'k': k,
+                           'pairs': int(candidates.sum()),
+                           'fraction': float(candidates.mean()) if values.size else 0.0,
+                           'pair_recall': float(candidates[above].mean()) if above.size else 1.0,
+                           'partner_recall': float(candidates[partners].mean()) if partners.size else 1.0,
+                           'edge_recall': len(full_edges & sparse_edges)/float(len(full_edges)) if full_edges else 1.0})
+
+        lines = ["%-10s,%-10s,%-10s,%-12s,%-15s,%-12s\n" % ("K", "Pairs", "Fraction", "Pair_recall", "Partner_recall", "Edge_recall")]
+
+        for row in report:
+            lines.append("%-10d,%-10d,%-10.4f,%-12.4f,%-15.4f,%-12.4f\n" % (row['k'], row['pairs'], row['fraction'], 
+                                                                          row['pair_recall'], row['partner_recall'], row['edge_recall']))
+
+        for line in lines:
+            logging.info(line.rstrip())
+
+        if self.options.output:
+            try:
+                report_txt = open(self.options.name+'_candidates.txt', 'w')
+                report_txt.writelines(lines)
+                report_txt.close()
+            except Exception as e:
+                logging.error(str(e))
+
+        return report
+
+
+    def build_lazy_matrices(self, scored=None):
+        """
+        This function sets up the lazy similarity score matrices. The scores 
+        are computed on first access and cached. In the radial fast mode with
+        a hub compound, the scores between the hub and all the other compounds 
+        are computed in advance and the remaining scores are computed on demand 
+        by the best_partner function
+
+        Parameters
+        ----------
+        scored : numpy array of bool
+           the flags of the already computed linear matrix elements. No 
+           score has been computed if None
+
+        """
+
+        logging.info('Lazy mode is on')
+
+        n = self.nums()
+
+        if scored is None:
+            scored = np.zeros(self.strict_mtx.size, dtype=bool)
+
+        self.scored = scored
+
+        # The three matrices share the flags, a computed pair fills all of them
+        self.strict_mtx = LazySMatrix(self.strict_mtx, self.scored, self.score_pairs)
+        self.loose_mtx = LazySMatrix(self.loose_mtx, self.scored, self.score_pairs)
+        self.ecr_mtx = LazySMatrix(self.ecr_mtx, self.scored, self.score_pairs)
+
+        # Heavy atom numbers and total charges used to bound the scores
+        self.heavy_atoms = np.array([self[i].getMolecule().GetNumHeavyAtoms() for i in range(0, n)], dtype=np.float64)
+        self.charges = self.total_charges()
+
+        if self.options.radial and self.options.fast:
+            hub_index = self.find_hub()
+            if hub_index is not None:
+                self.strict_mtx.row(hub_index)
+
+
+    def score_pairs(self, indexes):
+        """
+        This function computes in lazy mode the similarity scores of the 
+        selected linear matrix elements that have not been computed yet. The 
+        scores are distribuited between the allocated processes 
+
+        Parameters
+        ----------
+        indexes : numpy array of int
+           the linear matrix indexes
+
+        """
+
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = indexes[~self.scored[indexes]]
+
+        if indexes.size == 0:
+            return
+
+        strict_mtx, loose_mtx, ecr_mtx = self.computed_matrices()
+
+        self.compute_pairs(indexes, strict_mtx, loose_mtx, ecr_mtx)
+
+        self.scored[indexes] = True
+
+
+    def compute_pairs(self, indexes, strict_mtx, loose_mtx, ecr_mtx, report=False):
+        """
+        This function computes the similarity scores of the selected linear 
+        matrix elements. The scores are distribuited between the allocated 
+        processes 
+
+        Parameters
+        ----------
+        indexes : numpy array of int
+           the linear matrix indexes
+        strict_mtx, loose_mtx, ecr_mtx : SMatrix
+           the strict, loose and ECR score matrices where the scores are stored
+        report : bool
+           a flag used to report the scoring progress
+
+        """
+
+        i, j = strict_mtx.index_pairs(indexes)
+        pairs = list(zip(i.tolist(), j.tolist()))
+
+        progress = None
+        if report and not self.options.fingerprint:
+            progress = self.scoring_progress(len(pairs))
+
+        results = []
+
+        if self.options.parallel == 1 or len(pairs) <= 1:
+            for a, b in pairs:
+                scored = score_pair((a, b), self)
+                results.append(scored)
+                if progress is not None:
+                    progress.advance(0, scored[1])
+        else:
+            processes = min(self.options.parallel, len(pairs))
+
+            # The results are received in chunks and counted by the main process
+            chunksize = int(math.ceil(len(pairs)/(4.0*processes)))
+
+            pool = multiprocessing.Pool(processes=processes, initializer=init_scoring, initargs=(self,))
+            try:
+                for scored in pool.imap(score_pair, pairs, chunksize):
+                    results.append(scored)
+                    if progress is not None:
+                        progress.advance(0, scored[1])
+            finally:
+                pool.close()
+                pool.join()
+
+        if progress is not None:
+            progress.report(final=True)
+
+        scores = [score for score, timeout, record in results]
+
+        if self.options.timing:
+            self.pair_records.extend(record for score, timeout, record in results)
+
+        for k, score in zip(np.asarray(indexes).tolist(), scores):
+            if score is not None:
+                strict_mtx[k], loose_mtx[k], ecr_mtx[k] = score
+
+
+    def scoring_progress(self, total, processes=1):
+        """
+        This function creates the progress of a matrix scoring if the progress 
+        or status file options are set
+
+        Parameters
+        ----------
+        total : int
+           the number of pairs to score
+        processes : int
+           the number of scoring processes
+
+        Returns
+        -------
+        progress : ScoringProgress object or None
+           the scoring progress, None if the progress is not reported
+
+        """
+
+        if not self.options.progress and not self.options.status_file:
+            return None
+
+        # Without the progress option the status file is updated every 10 seconds
+        interval = self.options.progress or 10.0
+
+        return ScoringProgress(total, processes, interval, self.options.status_file)
+
+
+    def timing_summary(self, slowest=10, wall_time=None):
+        """
+        This function summarizes the scoring records of the pairs computed 
+        by the last matrix scoring
+
+        Parameters
+        ----------
+        slowest : int
+           the number of slowest pairs listed in the summary
+        wall_time : float
+           the elapsed time in seconds of the matrix scoring. If not None it
+           is compared with the total scoring time to measure the parallel
+           efficiency
+
+        Returns
+        -------
+        summary : dictionary
+           the number of computed, scored, failed and charge skipped pairs,
+           the number and rate of the MCS timeouts, the total scoring time 
+           and its MCS, mapping and TMCSR parts and the slowest pair records
+
+        """
+
+        records = self.pair_records
+
+        attempts = [r for r in records if r['status'] != 'charge']
+        timeouts = sum(1 for r in attempts if r['timeout'])
+
+        summary = {'pairs': len(records),
+                   'scored': sum(1 for r in records if r['status'] == 'scored'),
+                   'failed': sum(1 for r in records if r['status'] == 'failed'),
+                   'charge': sum(1 for r in records if r['status'] == 'charge'),
+                   'timeouts': timeouts,
+                   'timeout_rate': float(timeouts)/len(attempts) if attempts else 0.0,
+                   'cpu_time': sum(r['total'] for r in records),
+                   'mcs_time': sum(r['mcs'] for r in records),
+                   'mapping_time': sum(r['mapping'] for r in records),
+                   'tmcsr_time': sum(r['tmcsr'] for r in records),
+                   'wall_time': wall_time,
+                   'slowest': sorted(records, key=lambda r: -r['total'])[0:slowest]}
+
+        return summary
+
+
+    def report_timings(self, wall_time):
+        """
+        This function writes the table of the scoring records of the computed 
+        pairs, sorted by molecule indexes, in the name_timing.txt file and 
+        logs their summary. Nothing is done if the timing option is off. In 
+        lazy mode the table is written after the graph generation, which 
+        scores the pairs, and the wall time is the graph generation time
+
+        Parameters
+        ----------
+        wall_time : float
+           the elapsed time in seconds of the matrix scoring
+
+        """
+
+        if not self.options.timing:
+            return
+
+        summary = self.timing_summary(wall_time=wall_time)
+
+        lines = ['# Pairs %d, scored %d, failed %d, different charges %d\n' % (summary['pairs'], summary['scored'], 
+                                                                               summary['failed'], summary['charge']),
+                 '# MCS timeouts %d, timeout rate %.3f, time limit %d s\n' % (summary['timeouts'], summary['timeout_rate'],
+                                                                             self.options.time),
+                 '# CPU time %.3f s (MCS %.3f s, mapping %.3f s, TMCSR %.3f s), wall time %.3f s, processes %d\n' 
+                 % (summary['cpu_time'], summary['mcs_time'], summary['mapping_time'], summary['tmcsr_time'], 
+                    wall_time, self.options.parallel)]
+
+        for r in summary['slowest']:
+            lines.append('# Slow pair %s - %s %.3f s\n' % (self[r['i']].getName(), self[r['j']].getName(), r['total']))
+
+        for line in lines:
+            logging.info(line[2:].rstrip())
+
+        atoms = [self[i].getMolecule().GetNumHeavyAtoms() for i in range(0, self.nums())]
+
+        lines.append("%-6s,%-6s,%-8s,%-10s,%-10s,%-10s,%-10s,%-8s,%-8s,%-8s,%-9s,%-20s,%-20s,%s\n" 
+                     % ("I", "J", "Status", "Total", "MCS", "Mapping", "TMCSR", "Timeout", "AtomsI", "AtomsJ", 
+                        "MCSAtoms", "MolI", "MolJ", "Reason"))
+
+        for r in sorted(self.pair_records, key=lambda r: (r['i'], r['j'])):
+            lines.append("%-6d,%-6d,%-8s,%-10.4f,%-10.4f,%-10.4f,%-10.4f,%-8d,%-8d,%-8d,%-9d,%-20s,%-20s,%s\n" 
+                         % (r['i'], r['j'], r['status'], r['total'], r['mcs'], r['mapping'], r['tmcsr'], r['timeout'],
+                            atoms[r['i']], atoms[r['j']], r['mcs_atoms'], self[r['i']].getName(), 
+                            self[r['j']].getName(), ' '.join(r['reason'].split())))
+
+        try:
+            timing_txt = open(self.options.name+'_timing.txt', 'w')
+            timing_txt.writelines(lines)
+            timing_txt.close()
+        except Exception as e:
+            logging.error(str(e))
+
+
+    def scored_flags(self):
+        """
+        This function returns the flags of the linear matrix elements whose 
+        similarity scores have been computed. The scores not computed in lazy
+        mode and the pairs not selected as candidates are not flagged
+
+        Returns
+        -------
+        scored : numpy array of bool
+           the computed linear matrix element flags
+
+        """
+
+        if self.scored is not None:
+            return np.asarray(self.scored, dtype=bool)
+
+        if self.candidate_scored is not None:
+            return self.candidate_scored
+
+        return np.ones(self.strict_mtx.size, dtype=bool)
+
+
+    def computed_matrices(self):
+        """
+        This function returns the similarity score matrices without computing
+        the missing lazy scores, which are set to zero
+
+        Returns
+        -------
+        strict_mtx, loose_mtx, ecr_mtx : SMatrix
+           the strict, loose and ECR score matrices
+
+        """
+
+        if self.scored is None:
+            return self.strict_mtx, self.loose_mtx, self.ecr_mtx
+
+        return self.strict_mtx.values, self.loose_mtx.values, self.ecr_mtx.values
+
+
+    def score_bounds(self, i):
+        """
+        This function returns upper bounds of the strict similarity scores 
+        between the compound i and all the compounds. The MCS cannot be larger 
+        than the smaller molecule, therefore the MCSR rule is bounded by the 
+        heavy atom number difference and the other rules are at most 1
+
+        Parameters
+        ----------
+        i : int
+           the compound index
+
+        Returns
+        -------
+        bounds : numpy array of float
+           the score upper bounds
+
+        """
+
+        same_charge = np.abs(self.charges - self.charges[i]) < 1e-3
+
+        ecr_bounds = np.where(same_charge, 1.0, self.options.ecrscore)
+
+        if self.options.fingerprint:
+            # The fingerprint similarity is not scaled by the ECR score
+            bounds = (ecr_bounds > 0.0).astype(np.float64)
+        else:
+            bounds = ecr_bounds * np.exp(-0.1*np.abs(self.heavy_atoms - self.heavy_atoms[i]))
+
+        # Relative slack covering the exponential rounding
+        return bounds * (1.0 + 1e-9)
+
+
+    def best_partner(self, i, exclude=None, cutoff=0.0):
+        """
+        This function finds the compound with the highest strict similarity 
+        score to the compound i. Ties are resolved by picking the lowest index.
+        In lazy mode the scores are computed on demand by decreasing upper 
+        bound and the search stops as soon as the remaining bounds cannot 
+        reach the best score found or exceed the cutoff
+
+        Parameters
+        ----------
+        i : int
+           the compound index
+        exclude : list of int
+           the compound indexes excluded from the search
+        cutoff : float
+           the scores that are not greater than the cutoff are not searched
+
+        Returns
+        -------
+        partner : int
+           the index of the most similar compound
+        score : float
+           the strict similarity score of the selected compound
+
+        """
+
+        if self.scored is None:
+            row = self.strict_mtx.row(i)
+
+            if exclude is not None:
+                row[exclude] = 0.0
+
+            partner = int(np.argmax(row))
+
+            return partner, float(row[partner])
+
+        bounds = self.score_bounds(i)
+        bounds[i] = 0.0
+
+        if exclude is not None:
+            bounds[exclude] = 0.0
+
+        partner = 0
+        score = 0.0
+
+        for j in np.argsort(-bounds, kind='mergesort').tolist():
+            if bounds[j] <= cutoff or bounds[j] < score:
+                break
+
+            value = self.strict_mtx[i, j]
+
+            if value > score or (value == score and j < partner):
+                partner = j
+                score = float(value)
+
+        return partner, score
+
+
+    def build_graph(self):
+        """
+        This function coordinates the Graph generation
+
+        """
+        logging.info('\nGenerating graph in progress....')
+
+        start = time.time()
+
+        # The Graph is build from an instance of the Class GraphGen by passing
+        # the selected user options
+        Gr = graphgen.GraphGen(self)
+        
+        # Writing the results is files
+        if self.options.output:
+            try:
+                Gr.writeGraph()
+            except Exception as e:
+                logging.error(str(e))
+
+            # Compact result bundle with the scores and the graph edges
+            try:
+                result.save_result(self, Gr, self.options.name+".npz")
+            except Exception as e:
+                logging.error(str(e))
+
+        # Handle to the the NetworkX generated graph
+        self.Graph = Gr.getGraph()
+
+        #print self.Graph.nodes(data=True)
+       
+        # In lazy mode the pairs are scored while the graph is generated
+        if self.options.lazy:
+            self.report_timings(time.time() - start)
+
+        # Display the graph by using Matplotlib
+        if self.options.display:
+            Gr.draw()
+
+        return self.Graph
+
+
+    def build_graph_sweep(self, cutoffs=None, max_values=None):
+        """
+        This function generates the graphs for a grid of cutoff and max distance
+        values by using the already built similarity score matrices. The sorted 
+        strict scores are computed once and shared between the settings, which 
+        are distributed between the allocated processes. A summary line with the 
+        number of edges, cycles and the diameter is produced for each setting
+
+        Parameters
+        ----------
+        cutoffs : list of float
+           the Minimum Similarity Score (MSS) values. If None, the current cutoff is used
+        max_values : list of int
+           the maximum distance values. If None, the current max distance is used
+
+        Returns
+        -------
+        graphs : dictionary
+           the generated NetworkX graphs keyed by the (cutoff, max) settings
+
+        """
+
+        if cutoffs is None:
+            cutoffs = [self.options.cutoff]
+
+        if max_values is None:
+            max_values = [self.options.max]
+
+        for cutoff in cutoffs:
+            if cutoff < 0.0:
+                raise ValueError('%s is not a positive real number' % cutoff)
+
+        for max_value in max_values:
+            if max_value < 1:
+                raise ValueError('%s is not a positive integer number' % max_value)
+
+        if (self.nums() * (self.nums() - 1)/2) != self.strict_mtx.size:
+            raise ValueError("The similarity score matrices must be built before the graph sweep")
+
+        logging.info('\nGraph sweep in progress....')
+
+        settings = [(float(cutoff), int(max_value)) for cutoff in cutoffs for max_value in max_values]
+
+        # Sorted strict scores shared between all the settings
+        sorted_indexes = self.strict_mtx.sorted_indexes()
+
+        if self.options.parallel == 1 or len(settings) == 1:
+            init_sweep(self, sorted_indexes)
+            graph_list = [sweep_graph(setting) for setting in settings]
+        else:
+            pool = multiprocessing.Pool(processes=min(self.options.parallel, len(settings)),
+                                        initializer=init_sweep, initargs=(self, sorted_indexes))
+            try:
+                graph_list = pool.map(sweep_graph, settings)
+            finally:
+                pool.close()
+                pool.join()
+
+        graphs = dict(zip(settings, graph_list))
+
+        lines = ["%-10s,%-10s,%-10s,%-10s,%-12s,%-10s,%-10s\n" % ("Cutoff", "Max", "Nodes", "Edges", "Components", "Cycles", "Diameter")]
+        
+        for setting, graph in zip(settings, graph_list):
+            summary = graph_summary(graph)
+            lines.append("%-10.3f,%-10d,%-10d,%-10d,%-12d,%-10d,%-10d\n" % (setting[0], setting[1], summary['nodes'], 
+                                                                          summary['edges'], summary['components'], 
+                                                                          summary['cycles'], summary['diameter']))
+
+        for line in lines:
+            logging.info(line.rstrip())
+
+        if self.options.output:
+            try:
+                sweep_txt = open(self.options.name+'_sweep.txt', 'w')
+                sweep_txt.writelines(lines)
+                sweep_txt.close()
+            except Exception as e:
+                logging.error(str(e))
+
+        return graphs
+
+
+    def write_dic(self):
+        """
+        This function write out a text file with the mapping between the 
+        generated molecule indexes and the corresponding molecule file names
+
+        """
+
+        try:
+            file_txt = open(self.options.name+'.txt', 'w')
+        except Exception:
+            raise IOError('It was not possible to write out the mapping file')
+            
+        file_txt.write('#ID\tFileName\n')
+        for key in self.dic_mapping:
+            file_txt.write('%d\t%s\n' % (key, self.dic_mapping[key]))
+
+        file_txt.close() 
+
+#*************************
+# Scoring Progress Class
+#*************************
+
+class ScoringProgress(object):
+    """
+    This class follows the progress of a matrix scoring. Each scoring process
+    counts its computed pairs and MCS timeouts in its own slot of shared 
+    arrays, without locks, and the main process periodically reports the 
+    totals with the throughput and the estimated remaining time
+
+    """
+
+    def __init__(self, total, processes=1, interval=10.0, status_file=None):
+        """
+        Initialization class function
+
+        Parameters
+        ----------
+        total : int
+           the number of pairs to score
+        processes : int
+           the number of scoring processes, one counter slot each
+        interval : float
+           the interval in seconds between the reports
+        status_file : str
+           if not None, the file where the progress is written in JSON format
+           at each report
+
+        """
+
+        self.total = total
+        self.processes = processes
+        self.interval = interval
+        self.status_file = status_file
+
+        self.done = multiprocessing.RawArray('l', processes)
+        self.timeouts = multiprocessing.RawArray('l', processes)
+
+        self.start = time.time()
+        self.next_report = self.start + interval
+
+        # The process which reports the progress
+        self.owner = os.getpid()
+
+
+    def advance(self, slot, timeout=False):
+        """
+        This function counts a computed pair. The progress is reported if the
+        report is due and the function is called by the main process
+
+        Parameters
+        ----------
+        slot : int
+           the counter slot of the calling process
+        timeout : bool
+           the MCS timeout flag of the pair
+
+        """
+
+        self.done[slot] += 1
+
+        if timeout:
+            self.timeouts[slot] += 1
+
+        if time.time() >= self.next_report and os.getpid() == self.owner:
+            self.report()
+
+
+    def status(self):
+        """
+        This function returns the current scoring status
+
+        Returns
+        -------
+        status : dictionary
+           the number of computed and total pairs, the MCS timeouts, the 
+           elapsed time, the throughput in pairs per second and the estimated 
+           remaining time in seconds, None if it is not known yet
+
+        """
+
+        done = sum(self.done)
+        elapsed = time.time() - self.start
+        rate = done/elapsed if elapsed > 0.0 else 0.0
+
+        eta = None
+        if rate > 0.0:
+            eta = (self.total - done)/rate
+
+        return {'pairs_done': done, 'pairs_total': self.total, 'timeouts': sum(self.timeouts),
+                'elapsed': elapsed, 'pairs_per_second': rate, 'eta': eta, 
+                'processes': self.processes}
+
+
+    def report(self, final=False):
+        """
+        This function logs the scoring status and writes it in the status file
+
+        Parameters
+        ----------
+        final : bool
+           a flag used to mark the scoring as completed
+
+        Returns
+        -------
+        status : dictionary
+           the scoring status with its state, 'running' or 'done'
+
+        """
+
+        self.next_report = time.time() + self.interval
+
+        status = self.status()
+        status['state'] = 'done' if final else 'running'
+
+        eta = '%.0f s' % status['eta'] if status['eta'] is not None else '-'
+        percent = 100.0*status['pairs_done']/self.total if self.total else 100.0
+
+        logging.info('Scoring progress: %d/%d pairs (%.1f%%), %.2f pairs/s, %d timeouts, elapsed %.0f s, remaining %s' 
+                     % (status['pairs_done'], self.total, percent, status['pairs_per_second'], 
+                        status['timeouts'], status['elapsed'], eta))
+
+        if self.status_file:
+            # The status is replaced in a single step, the readers never see a
+            # partially written file
+            try:
+                tmp = self.status_file + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(status, f)
+                os.rename(tmp, self.status_file)
+            except Exception as e:
+                logging.error(str(e))
+
+        return status
+
+
+
+#*************************
+# Symmetric  Class
+#*************************
+
+class SMatrix(np.ndarray):
+    """
+    This class implements a "basic" interface for symmetric matrices 
+    subclassing ndarray. The class interanlly stores a bidimensional 
+    numpy array as a linear array A[k], however the user can still 
     access to the matrix elements by using a two indeces notation A[i,j]
  
     """
 
-    def __new__(subtype, shape, dtype=float, buffer=None, offset=0, strides=None, order=None):
-        
-        if len(shape) > 2:
-            raise ValueError('The matrix shape is greater than two')
+    def __new__(subtype, shape, dtype=float, buffer=None, offset=0, strides=None, order=None):
+        
+        if len(shape) > 2:
+            raise ValueError('The matrix shape is greater than two')
+
+        elif len(shape) == 2:
+            if shape[0] != shape[1]:
+                raise ValueError('The matrix must be a squre matrix')
+
+        n = shape[0]        
+        l = int(shape[0]*(shape[0] - 1)/2)
+
+        shape = (l,)
+        
+        obj = np.ndarray.__new__(subtype, shape , dtype, buffer, offset, strides, order)
+
+        # Array inizialization
+        obj = obj*0.0
+        
+        return obj
+        
+
+    def __getitem__(self, *kargs):
+        """
+        This function retrieves the selected elements i,j from the symmetric
+        matrix A[i,j]
+        
+        Parameters
+        ----------
+        *kargs : python tuples
+           the passed elements i,j  
+        
+        Returns
+        -------
+            : float
+            the selected element extracted from the allocated linear array
+            
+        """
+        
+        if isinstance( kargs[0], int ):
+            k = kargs[0]
+            return super(SMatrix, self).__getitem__(k)
+
+        if isinstance( kargs[0], slice ):
+            k = kargs[0]
+            return super(SMatrix, self).__getitem__(k)
+
+        elif len(kargs[0]) > 2:
+            raise ValueError('Two indices can be addressed')
+                
+        i = kargs[0][0]
+        j = kargs[0][1]
+
+        if i == j:
+            return 0.0
+        
+        # Length of the linear array 
+        l = self.size
+        
+        # Total number of elements in the corresponding bi-dimensional symmetric matrix
+        n = int((1+math.sqrt(1+8*l))/2)
+
+        if i > n - 1:
+            raise ValueError('First index out of bound')
+        
+        if j > n - 1:
+            raise ValueError('Second index out of bound')
+      
+        if i < j:
+            k = int((n*(n-1)/2) - (n-i)*((n-i)-1)/2 + j - i - 1)
+        else:
+            k = int((n*(n-1)/2) - (n-j)*((n-j)-1)/2 + i - j - 1) 
+        
+        return super(SMatrix, self).__getitem__(k)
+
+   
+    def __setitem__(self, *kargs):
+        """
+        This function set the matrix elements i,j to the passed value
+        
+        Parameters
+        ----------
+        *kargs : python tuples
+           the passed elements i,j, value to set  
+        
+            
+        """
+        
+        if isinstance( kargs[0], int ):
+            k = kargs[0]
+            value = kargs[1]
+            return super(SMatrix, self).__setitem__(k,value)
+
+        elif isinstance(kargs[0], slice):
+            start, stop, step = kargs[0].indices(len(self))
+            value = kargs[1]
+            return super(SMatrix, self).__setitem__(kargs[0],value)
+
+        elif len(kargs[0]) > 2:
+            raise ValueError('Two indices can be addressed')
+            
+
+        # Passed indexes and value to set
+        i = kargs[0][0]
+        j = kargs[0][1]
+        value = kargs[1]
+        
+        # Length of the linear array 
+        l = self.size
+        
+        # Total number of elements in the corresponding bi-dimensional symmetric matrix
+        n = int((1+math.sqrt(1+8*l))/2)
+        
+        if i > n - 1:
+            raise ValueError('First index out of bound')
+        if j > n - 1:
+            raise ValueError('Second index out of bound')
+        
+        if i < j:
+            k = int((n*(n-1)/2) - (n-i)*((n-i)-1)/2 + j - i - 1)
+        else:
+            k = int((n*(n-1)/2) - (n-j)*((n-j)-1)/2 + i - j - 1) 
+        
+        super(SMatrix, self).__setitem__(k,value)
+
+
+    def to_numpy_2D_array(self) :
+        """
+        This function returns the symmetric similarity score numpy matrix 
+        generated from the linear array
+        
+        Returns
+        -------
+        np_mat : numpy matrix
+           the symmetric similarity score numpy matrix built by using the linear
+           array 
+        
+        """
+
+        # Length of the linear array 
+        l = self.size
+        
+        # Total number of elements in the corresponding bi-dimensional symmetric matrix
+        n = int((1+math.sqrt(1+8*l))/2)
+
+        np_mat = np.zeros((n,n))
+
+        for i in range (0,n):
+            for j in range(0,n):
+                np_mat[i,j] = self[i,j]
+
+        return np_mat
+        
+    def index_pairs(self, k):
+        """
+        This function converts linear array indexes into the row and column 
+        indexes i < j of the corresponding bidimensional symmetric matrix
+
+        Parameters
+        ----------
+        k : int or numpy array of int
+           the linear array indexes
+
+        Returns
+        -------
+        i, j : numpy arrays of int
+           the row and column indexes related to the passed linear indexes
+        
+        """
+
+        n = self.mat_size()
+
+        k = np.asarray(k, dtype=np.int64)
+
+        i = (n - 2 - np.floor(np.sqrt(-8*k + 4*n*(n-1) - 7)/2.0 - 0.5)).astype(np.int64)
+        j = k + i + 1 - n*(n-1)//2 + (n-i)*((n-i)-1)//2
+
+        return i, j
+
+
+    def linear_indexes(self, i, j):
+        """
+        This function converts the row and column indexes of the bidimensional 
+        symmetric matrix into the corresponding linear array indexes
+
+        Parameters
+        ----------
+        i : int or numpy array of int
+           the row indexes
+        j : int or numpy array of int
+           the column indexes, different from the row indexes
+
+        Returns
+        -------
+        k : numpy array of int
+           the linear array indexes
+        
+        """
+
+        n = self.mat_size()
+
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+
+        a = np.minimum(i, j)
+        b = np.maximum(i, j)
+
+        return (n*(n-1)//2) - (n-a)*((n-a)-1)//2 + b - a - 1
+
+
+    def sorted_indexes(self):
+        """
+        This function returns the linear indexes of the positive elements
+        sorted by decreasing value. The sorted indexes can be shared between
+        different selections of the elements above a cutoff
+
+        Returns
+        -------
+        indexes : numpy array of int
+           the sorted linear indexes
+
+        """
+
+        values = self.view(np.ndarray)
+
+        indexes = np.nonzero(values > 0.0)[0]
+
+        # Stable sort: equal values keep the linear array order
+        return indexes[np.argsort(-values[indexes], kind='mergesort')]
+
+
+    def positive_indexes(self, cutoff=0.0, sorted_indexes=None):
+        """
+        This function returns the linear indexes of the positive elements
+        greater or equal to the passed cutoff, in increasing order
+
+        Parameters
+        ----------
+        cutoff : float
+           the selection cutoff
+        sorted_indexes : numpy array of int
+           the linear indexes of the positive elements sorted by decreasing 
+           value, as returned by the sorted_indexes function. If passed, the 
+           selection is done by bisection without scanning the whole array
+
+        Returns
+        -------
+        indexes : numpy array of int
+           the selected linear indexes
+
+        """
+
+        values = self.view(np.ndarray)
+
+        if sorted_indexes is None:
+            return np.nonzero((values > 0.0) & (values >= cutoff))[0]
+
+        count = np.searchsorted(-values[sorted_indexes], -cutoff, side='right')
+
+        return np.sort(sorted_indexes[:count])
+
+
+    def row(self, i):
+        """
+        This function returns the selected matrix row i as a numpy array
+        gathered from the linear array. The diagonal element is set to zero
+
+        Parameters
+        ----------
+        i : int
+           the row index
+
+        Returns
+        -------
+        row : numpy array
+           the matrix row i
+
+        """
+
+        n = self.mat_size()
+
+        if i > n - 1:
+            raise ValueError('Row index out of bound')
+
+        values = self.view(np.ndarray)
+
+        row = np.zeros(n, dtype=self.dtype)
+
+        # Elements A[j,i] with j < i are stored in the rows above i
+        j = np.arange(0, i)
+        row[:i] = values[(n*(n-1)//2) - (n-j)*((n-j)-1)//2 + i - j - 1]
+
+        # Elements A[i,j] with j > i are stored contiguously
+        start = (n*(n-1)//2) - (n-i)*((n-i)-1)//2
+        row[i+1:] = values[start:start + n - i - 1]
+
+        return row
+
+
+    def row_sums(self):
+        """
+        This function returns the sums of the matrix rows as a numpy array. 
+        Each stored row segment A[i,i+1:] is reduced once and accumulated 
+        in both the row i and the columns j > i
+
+        Returns
+        -------
+        sums : numpy array
+           the sums of the matrix rows
+
+        """
+
+        n = self.mat_size()
+
+        values = self.view(np.ndarray)
+
+        sums = np.zeros(n, dtype=np.float64)
+
+        start = 0
+        for i in range(0, n - 1):
+            segment = values[start:start + n - i - 1]
+            sums[i] += segment.sum()
+            sums[i+1:] += segment
+            start += n - i - 1
+
+        return sums
+
+
+    def mat_size(self) :
+        """
+        This function returns the size of the square similarity score matrix 
+        
+        Returns
+        -------
+        n : int
+           the size of the similarity score matrix
+        
+        """ 
+
+        # Length of the linear array 
+        l =  self.size
+        
+        # Total number of elements in the corresponding bi-dimensional symmetric matrix
+        n = int((1+math.sqrt(1+8*l))/2)
+
+        return n 
+        
+
+
+
+#*************************
+# Lazy Symmetric Class
+#*************************
+
+class LazySMatrix(object):
+    """
+    This class implements the SMatrix interface for similarity score matrices
+    whose elements are computed on first access. The computed elements are 
+    stored in a SMatrix and flagged as computed, so that each element is 
+    computed just once. Selections of elements can be computed in advance 
+    by using the prefetch function
+
+    """
+
+    def __init__(self, values, scored, evaluate):
+        """
+        Inizialization function
+
+        Parameters
+        ----------
+        values : SMatrix
+           the matrix storing the computed elements
+        scored : numpy array of bool
+           the flags of the computed linear matrix elements
+        evaluate : function
+           the function computing and storing the elements selected by the 
+           passed linear indexes which have not been computed yet
+
+        """
 
-        elif len(shape) == 2:
-            if shape[0] != shape[1]:
-                raise ValueError('The matrix must be a squre matrix')
+        self.values = values
+        self.scored = scored
+        self.evaluate = evaluate
 
-        n = shape[0]        
-        l = int(shape[0]*(shape[0] - 1)/2)
 
-        shape = (l,)
-        
-        obj = np.ndarray.__new__(subtype, shape , dtype, buffer, offset, strides, order)
+    @property
+    def size(self):
+        """
+        The length of the linear array
+        """
+        return self.values.size
+
+
+    def __len__(self):
+        return len(self.values)
 
-        # Array inizialization
-        obj = obj*0.0
-        
-        return obj
-        
 
     def __getitem__(self, *kargs):
         """
-        This function retrieves the selected elements i,j from the symmetric
-        matrix A[i,j]
-        
+        This function retrieves the selected elements i,j or k from the 
+        symmetric matrix computing them if required
+
         Parameters
         ----------
         *kargs : python tuples
-           the passed elements i,j  
-        
+           the passed elements i,j or the linear index k
+
         Returns
         -------
             : float
-            the selected element extracted from the allocated linear array
-            
+            the selected element
+
         """
-        
-        if isinstance( kargs[0], int ):
-            k = kargs[0]
-            return super(SMatrix, self).__getitem__(k)
 
-        if isinstance( kargs[0], slice ):
-            k = kargs[0]
-            return super(SMatrix, self).__getitem__(k)
+        if isinstance(kargs[0], slice):
+            self.evaluate(np.arange(self.size)[kargs[0]])
+            return self.values[kargs[0]]
 
-        elif len(kargs[0]) > 2:
-            raise ValueError('Two indices can be addressed')
-                
-        i = kargs[0][0]
-        j = kargs[0][1]
+        if isinstance(kargs[0], tuple):
+            if len(kargs[0]) > 2:
+                raise ValueError('Two indices can be addressed')
 
-        if i == j:
-            return 0.0
-        
-        # Length of the linear array 
-        l = self.size
-        
-        # Total number of elements in the corresponding bi-dimensional symmetric matrix
-        n = int((1+math.sqrt(1+8*l))/2)
+            i = kargs[0][0]
+            j = kargs[0][1]
 
-        if i > n - 1:
-            raise ValueError('First index out of bound')
-        
-        if j > n - 1:
-            raise ValueError('Second index out of bound')
-      
-        if i < j:
-            k = int((n*(n-1)/2) - (n-i)*((n-i)-1)/2 + j - i - 1)
+            if i == j:
+                return 0.0
+
+            k = int(self.linear_indexes(i, j))
         else:
-            k = int((n*(n-1)/2) - (n-j)*((n-j)-1)/2 + i - j - 1) 
-        
-        return super(SMatrix, self).__getitem__(k)
+            k = kargs[0]
 
-   
-    def __setitem__(self, *kargs):
+        if not self.scored[k]:
+            self.evaluate([k])
+
+        return self.values[k]
+
+
+    def __array__(self, dtype=None):
         """
-        This function set the matrix elements i,j to the passed value
-        
+        The whole matrix is computed when it is converted into a numpy array
+        """
+
+        self.complete()
+
+        return np.asarray(self.values.view(np.ndarray), dtype=dtype)
+
+
+    def prefetch(self, i, j):
+        """
+        This function computes in a single batch the selected elements i,j 
+        that have not been computed yet
+
         Parameters
         ----------
-        *kargs : python tuples
-           the passed elements i,j, value to set  
-        
-            
+        i : numpy array of int
+           the row indexes
+        j : numpy array of int
+           the column indexes, different from the row indexes
+
         """
-        
-        if isinstance( kargs[0], int ):
-            k = kargs[0]
-            value = kargs[1]
-            return super(SMatrix, self).__setitem__(k,value)
 
-        elif isinstance(kargs[0], slice):
-            start, stop, step = kargs[0].indices(len(self))
-            value = kargs[1]
-            return super(SMatrix, self).__setitem__(kargs[0],value)
+        self.evaluate(np.atleast_1d(self.linear_indexes(i, j)))
 
-        elif len(kargs[0]) > 2:
-            raise ValueError('Two indices can be addressed')
-            
 
-        # Passed indexes and value to set
-        i = kargs[0][0]
-        j = kargs[0][1]
-        value = kargs[1]
-        
-        # Length of the linear array 
-        l = self.size
-        
-        # Total number of elements in the corresponding bi-dimensional symmetric matrix
-        n = int((1+math.sqrt(1+8*l))/2)
-        
-        if i > n - 1:
-            raise ValueError('First index out of bound')
-        if j > n - 1:
-            raise ValueError('Second index out of bound')
-        
-        if i < j:
-            k = int((n*(n-1)/2) - (n-i)*((n-i)-1)/2 + j - i - 1)
-        else:
-            k = int((n*(n-1)/2) - (n-j)*((n-j)-1)/2 + i - j - 1) 
-        
-        super(SMatrix, self).__setitem__(k,value)
+    def complete(self):
+        """
+        This function computes all the elements that have not been computed yet
+        """
 
+        if not self.scored.all():
+            self.evaluate(np.nonzero(~self.scored)[0])
 
-    def to_numpy_2D_array(self) :
+
+    def row(self, i):
         """
-        This function returns the symmetric similarity score numpy matrix 
-        generated from the linear array
-        
-        Returns
-        -------
-        np_mat : numpy matrix
-           the symmetric similarity score numpy matrix built by using the linear
-           array 
-        
+        This function returns the selected matrix row i as a numpy array,
+        computing the missing row elements in a single batch
+
         """
 
-        # Length of the linear array 
-        l = self.size
-        
-        # Total number of elements in the corresponding bi-dimensional symmetric matrix
-        n = int((1+math.sqrt(1+8*l))/2)
+        others = np.array([j for j in range(0, self.mat_size()) if j != i], dtype=np.int64)
 
-        np_mat = np.zeros((n,n))
+        self.prefetch(i, others)
 
-        for i in range (0,n):
-            for j in range(0,n):
-                np_mat[i,j] = self[i,j]
+        return self.values.row(i)
 
-        return np_mat
-        
-    def mat_size(self) :
-        """
-        This function returns the size of the square similarity score matrix 
-        
-        Returns
-        -------
-        n : int
-           the size of the similarity score matrix
-        
-        """ 
 
-        # Length of the linear array 
-        l =  self.size
-        
-        # Total number of elements in the corresponding bi-dimensional symmetric matrix
-        n = int((1+math.sqrt(1+8*l))/2)
+    def mat_size(self):
+        return self.values.mat_size()
+
+
+    def index_pairs(self, k):
+        return self.values.index_pairs(k)
+
+
+    def linear_indexes(self, i, j):
+        return self.values.linear_indexes(i, j)
+
+
+    # The following functions require the whole matrix
+
+    def row_sums(self):
+        self.complete()
+        return self.values.row_sums()
+
+
+    def sorted_indexes(self):
+        self.complete()
+        return self.values.sorted_indexes()
+
+
+    def positive_indexes(self, cutoff=0.0, sorted_indexes=None):
+        self.complete()
+        return self.values.positive_indexes(cutoff, sorted_indexes)
+
+
+    def to_numpy_2D_array(self):
+        self.complete()
+        return self.values.to_numpy_2D_array()
 
-        return n 
-        
 
 
 
@@ -853,6 +2952,10 @@ class Molecule(object):
         # The variable __name saves the molecule identification name 
         # The variable is defined as private
         self.__name = molname
+
+        # The variable __max_dist saves the maximum atom distance, computed
+        # on demand. The variable is defined as private
+        self.__max_dist = None
     
         
 
@@ -901,6 +3004,216 @@ class Molecule(object):
         return self.__name
 
 
+    
+    def getMaxDistance(self):
+        """
+        Get the maximum distance between the molecule atoms. The distance is
+        computed once and cached
+
+        Returns
+        -------
+           : float
+           the maximum atom distance in angstroms
+
+        """
+
+        if self.__max_dist is None:
+            self.__max_dist = graphgen.max_dist_mol(self.__molecule)
+
+        return self.__max_dist
+
+
+
+# Functions used by the processes of the lazy scoring and of the graph sweep
+
+# Molecule database shared by the lazy scoring processes
+scoring_data = {}
+
+def init_scoring(dbase):
+    """
+    This function stores the molecule database used by the lazy scoring processes
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule database
+
+    """
+    scoring_data['dbase'] = dbase
+
+
+def score_pair(pair, dbase=None):
+    """
+    This function computes the similarity scores of a single compound pair
+
+    Parameters
+    ----------
+    pair : tuple
+       the (i, j) compound indexes
+    dbase : DBMolecules object
+       the molecule database. If None, the database of the scoring process 
+       is used
+
+    Returns
+    -------
+    scores : tuple of float or None
+       the strict, loose and ECR scores
+    timeout : bool
+       a flag set if the MCS search timed out
+    record : dictionary or None
+       the pair scoring record, None if the timing option is off
+
+    """
+
+    if dbase is None:
+        dbase = scoring_data['dbase']
+
+    record = {}
+    scores = dbase.compute_pair(pair[0], pair[1], dbase.options.fingerprint, record)
+
+    if not dbase.options.timing:
+        return scores, record['timeout'], None
+
+    return scores, record['timeout'], record
+
+
+def score_chunk(dbase, a, b, strict_mtx, loose_mtx, ecr_mtx, fingerprint, queue, progress, slot):
+    """
+    This function computes a chunk of the similarity score matrices in a 
+    parallel process and sends the pair scoring records to the main process
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule database
+    a, b : int
+       the start and final linear indexes of the chunk
+    strict_mtx, loose_mtx, ecr_mtx : python multiprocessing array
+       the shared strict, loose and ECR score matrices
+    fingerprint : bool
+       using the structural fingerprint as the similarity score
+    queue : python multiprocessing queue or None
+       the queue where the list of records is put. If None, the records are
+       not collected
+    progress : ScoringProgress object or None
+       the scoring progress
+    slot : int
+       the progress counter slot of the process
+
+    """
+
+    if queue is None:
+        dbase.compute_mtx(a, b, strict_mtx, loose_mtx, ecr_mtx, fingerprint, None, progress, slot)
+        return
+
+    records = []
+
+    try:
+        dbase.compute_mtx(a, b, strict_mtx, loose_mtx, ecr_mtx, fingerprint, records, progress, slot)
+    finally:
+        queue.put(records)
+
+
+def pair_record(i, j):
+    """
+    This function returns the empty scoring record of a molecule pair
+
+    Parameters
+    ----------
+    i, j : int
+       the molecule indexes
+
+    Returns
+    -------
+    record : dictionary
+       the molecule indexes, the outcome status ('scored', 'charge' for the
+       pairs with different charges which are not scored or 'failed') with
+       the failure reason, the times in seconds spent to find the MCS, to map 
+       it, to apply the TMCSR rule and in total, the MCS timeout flag and the
+       number of MCS atoms
+
+    """
+
+    return {'i': i, 'j': j, 'status': '', 'reason': '', 'mcs': 0.0, 'mapping': 0.0,
+            'tmcsr': 0.0, 'total': 0.0, 'timeout': False, 'mcs_atoms': 0}
+
+
+
+# Molecule database and sorted strict score indexes shared by the sweep processes
+sweep_data = {}
+
+def init_sweep(dbase, sorted_indexes):
+    """
+    This function stores the data shared between the graph sweep settings
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule database with the built similarity score matrices
+    sorted_indexes : numpy array of int
+       the linear indexes of the positive strict scores sorted by decreasing score
+
+    """
+    sweep_data['dbase'] = dbase
+    sweep_data['sorted_indexes'] = sorted_indexes
+
+
+def sweep_graph(setting):
+    """
+    This function generates the graph for a single sweep setting
+
+    Parameters
+    ----------
+    setting : tuple
+       the (cutoff, max) graph setting
+
+    Returns
+    -------
+    graph : NetworkX graph
+       the generated graph
+
+    """
+
+    dbase = sweep_data['dbase']
+
+    options = argparse.Namespace(**vars(dbase.options))
+    options.cutoff, options.max = setting
+
+    Gr = graphgen.GraphGen(dbase, options=options, sorted_indexes=sweep_data['sorted_indexes'])
+
+    return Gr.getGraph()
+
+
+def graph_summary(graph):
+    """
+    This function summarizes a generated graph
+
+    Parameters
+    ----------
+    graph : NetworkX graph
+       the graph to summarize
+
+    Returns
+    -------
+    summary : dictionary
+       the number of nodes, edges, connected components and independent cycles
+       and the largest diameter of the graph components
+
+    """
+
+    nodes = graph.number_of_nodes()
+    edges = graph.number_of_edges()
+    components = nx.number_connected_components(graph)
+
+    diameter = 0
+    for component in nx.connected_component_subgraphs(graph):
+        if component.number_of_nodes() > 1:
+            diameter = max(diameter, nx.diameter(component))
+
+    return {'nodes': nodes, 'edges': edges, 'components': components,
+            'cycles': edges - nodes + components, 'diameter': diameter}
+
+
 
 # Classes used to check some of the passed user options in the main function
 
@@ -922,14 +3235,22 @@ class check_pos(argparse.Action):
         setattr(namespace, self.dest, value)
 
 
-# Class used to check the cutoff user option
+# Class used to check the non negative integer user options
+class check_non_neg(argparse.Action):
+    def __call__(self, parser, namespace, value, option_string=None):
+        if value < 0:
+            raise argparse.ArgumentTypeError('%s is not a non negative integer number' % value)
+        setattr(namespace, self.dest, value)
+
+
+# Class used to check the cutoff and progress user options
 class check_cutoff(argparse.Action):
     def __call__(self, parser, namespace, value, option_string=None):
         if not isinstance(value, float) or value < 0.0:
             raise argparse.ArgumentTypeError('%s is not a positive real number' % value)
         setattr(namespace, self.dest, value)
 
-# Class used to check the handicap user option
+# Class used to check the handicap, triage, cluster and report threshold user options
 class check_ecrscore(argparse.Action):
     def __call__(self, parser, namespace, value, option_string=None):
         if not isinstance(value, float) or value < 0.0 or value > 1.0:
@@ -941,19 +3262,49 @@ class check_ecrscore(argparse.Action):
 def startup():
     # Options and arguments passed by the user
     ops= parser.parse_args()
+
+    # The candidate report compares the candidate selections with the complete scoring
+    if ops.candidate_report and (ops.candidates or ops.triage or ops.cluster or ops.lazy):
+        parser.error('--candidate_report needs the complete scoring, without --candidates, --triage, --cluster and --lazy')
     
     # Molecule DataBase initialized with the passed user options
     db_mol = DBMolecules(ops.directory, ops.parallel, ops.verbose, ops.time, ops.ecrscore,
-                        ops.output, ops.name, ops.display, ops.max, ops.cutoff, ops.radial, ops.hub, ops.fast)
-    # Similarity score linear array generation
-    strict, loose =  db_mol.build_matrices()
+                        ops.output, ops.name, ops.display, ops.max, ops.cutoff, ops.radial, ops.hub,
+                        fingerprint=ops.fingerprint, fast=ops.fast, engine=ops.engine, lazy=ops.lazy,
+                        candidates=ops.candidates, fingerprint_type=ops.fingerprint_type,
+                        fingerprint_radius=ops.fingerprint_radius, fingerprint_size=ops.fingerprint_size,
+                        fingerprint_cache=ops.fingerprint_cache, triage=ops.triage,
+                        cluster=ops.cluster, bridges=ops.bridges, depiction_cache=ops.depiction_cache,
+                        report_connected=ops.report_connected, report_threshold=ops.report_threshold, report_gzip=ops.report_gzip,
+                        timing=ops.timing, progress=ops.progress, status_file=ops.status_file)
+    # Planning service answering the requests from the molecules and the scores kept in memory.
+    # The scores of a previous run are used to fill the pair score cache
+    if ops.serve is not None:
+        from lomap import service
+        if ops.matrices:
+            db_mol.load_matrices(ops.matrices)
+        service.serve(db_mol, ops.host, ops.serve)
+        return
+
+    # Similarity score linear array generation, or reuse of the scores of a previous run
+    if ops.matrices:
+        strict, loose = db_mol.load_matrices(ops.matrices)
+    else:
+        strict, loose =  db_mol.build_matrices()
+
+    # Candidate pair selection compared with the complete scoring
+    if ops.candidate_report:
+        db_mol.candidate_report(ops.candidate_report)
     
     # Get the 2D numpy matrices
     # strict.to_numpy_2D_array()
     # loose.to_numpy_2D_array()
    
     # Graph generation based on the similarity score matrix
-    nx_graph = db_mol.build_graph()   
+    if ops.sweep_cutoff or ops.sweep_max:
+        db_mol.build_graph_sweep(ops.sweep_cutoff, ops.sweep_max)
+    else:
+        nx_graph = db_mol.build_graph()   
 
     # print nx_graph.nodes(data=True)
     # print nx_graph.edges(data=True)
@@ -978,6 +3329,8 @@ mcs_group.add_argument('-t', '--time', default=20, action=check_pos, type=int,\
                     help='Set the maximum time in seconds to perform the mcs search between pair of molecules')
 mcs_group.add_argument('-e', '--ecrscore', default=0.0, action=check_ecrscore, type=float,\
                     help='If different from 0.0 the value is use to set the electrostatic score between two molecules with different charges')
+mcs_group.add_argument('--matrices', default=None, type=str,\
+                    help='Load the similarity scores saved in the .npz file of a previous run and skip the scoring. The molecules must be unchanged')
 
 
 out_group = parser.add_argument_group('Output setting')
@@ -985,6 +3338,20 @@ out_group.add_argument('-o', '--output', default=True, action='store_true',\
                        help='Generates output files')
 out_group.add_argument('-n', '--name', type=str, default='out',\
                        help='File name prefix used to generate the output files')
+out_group.add_argument('--depiction_cache', default=False, action='store_true',\
+                       help='Store the molecule images of the graph depiction in a cache directory in the mol2 directory and reuse them in the following runs')
+out_group.add_argument('--report_connected', default=False, action='store_true',\
+                       help='Write just the connected pairs in the score report')
+out_group.add_argument('--report_threshold', default=0.0, action=check_ecrscore, type=float,\
+                       help='Write in the score report just the pairs whose loose score is greater or equal than the selected threshold in the range [0,1]')
+out_group.add_argument('--report_gzip', default=False, action='store_true',\
+                       help='Write the score report as gzip compressed file')
+out_group.add_argument('--timing', default=False, action='store_true',\
+                       help='Write the table of the pair scoring times and outcomes and their summary at the end of the matrix scoring')
+out_group.add_argument('--progress', default=0.0, action=check_cutoff, type=float,\
+                       help='Report the matrix scoring progress, throughput and estimated remaining time at the selected interval in seconds')
+out_group.add_argument('--status_file', default=None, type=str,\
+                       help='Write the matrix scoring progress in JSON format in the selected file at each progress report')
 
 parser.add_argument('-d', '--display', default=False, action='store_true',\
                     help='Display the generated graph by using Matplotlib')
@@ -1000,8 +3367,40 @@ graph_group.add_argument('-b', '--hub', default= None , type=str,\
                          help='Using a radial graph approach with a manually specified hub compound')
 graph_group.add_argument('-f', '--fingerprint', default=False, action='store_true',\
                          help='Using the fingerprint option to build similarity matrices')
+graph_group.add_argument('--fingerprint_type', default='topological', type=str,\
+                         choices=fp.FINGERPRINT_TYPES, help='The structural fingerprint type used by the fingerprint options')
+graph_group.add_argument('--fingerprint_radius', default=2, action=check_non_neg, type=int,\
+                         help='The Morgan fingerprint radius')
+graph_group.add_argument('--fingerprint_size', default=2048, action=check_pos, type=int,\
+                         help='The number of bits of the Morgan and atom pair fingerprints')
+graph_group.add_argument('--fingerprint_cache', default=False, action='store_true',\
+                         help='Store the fingerprints in a cache file in the mol2 directory and reuse them in the following runs')
 graph_group.add_argument('-a', '--fast', default=False, action='store_true',\
                          help='Using the fast graphing when the lead compound is specificed')
+graph_group.add_argument('--lazy', default=False, action='store_true',\
+                         help='Compute the similarity scores on demand. Using the radial fast option with a hub, just the hub scores are computed in advance')
+graph_group.add_argument('--candidates', default=0, action=check_non_neg, type=int,\
+                         help='Score by MCS just the pairs made by each molecule and its selected number of most similar molecules by fingerprint')
+graph_group.add_argument('--triage', default=0.0, action=check_ecrscore, type=float,\
+                         help='Score by MCS just the pairs whose fingerprint similarity is greater or equal than the selected threshold in the range [0,1]')
+graph_group.add_argument('--cluster', default=0.0, action=check_ecrscore, type=float,\
+                         help='Cluster the molecules by fingerprint similarity with the selected threshold in the range [0,1] and score by MCS just the pairs inside the clusters and the bridge pairs')
+graph_group.add_argument('--bridges', default=3, action=check_non_neg, type=int,\
+                         help='The number of bridge pairs scored between each cluster and the other clusters')
+graph_group.add_argument('--candidate_report', default=None, type=int, nargs='+',\
+                         help='Compare the graphs built from the candidate pairs for the listed numbers of candidates with the complete scoring graph')
+graph_group.add_argument('--sweep_cutoff', default=None, type=float, nargs='+',\
+                         help='Generate the graphs for the listed Minimum Similariry Score (MSS) values and write a summary')
+graph_group.add_argument('--sweep_max', default=None, type=int, nargs='+',\
+                         help='Generate the graphs for the listed maximum distance values and write a summary')
+graph_group.add_argument('-g', '--engine', default='networkx', type=str,\
+                         choices=['networkx', 'native'], help='Graph engine selection. The native engine runs the graph algorithm on compact arrays')
+
+service_group = parser.add_argument_group('Service setting')
+service_group.add_argument('--serve', default=None, action=check_non_neg, type=int,\
+                           help='Run the planning service on the selected port instead of a single run. The molecules and the pair scores are kept in memory between the requests')
+service_group.add_argument('--host', default='127.0.0.1', type=str,\
+                           help='The planning service address')
 
 #------------------------------------------------------------------
 
@@ -45,8 +45,7 @@ potential ligands within a substantial of compounds.
 from rdkit import Chem
 from rdkit.Chem import rdFMCS
 from rdkit.Chem import AllChem
-from rdkit.Chem.Draw.MolDrawing import DrawingOptions
-from rdkit.Chem import Draw
+from rdkit.Chem import rdMolDescriptors
 from rdkit import DataStructs
 from rdkit.Chem.Fingerprints import FingerprintMols
 import sys
@@ -54,6 +53,8 @@ import math
 from rdkit import RDLogger
 import logging
 import argparse
+import multiprocessing
+import numpy as np
 
 
 #*******************************
@@ -61,7 +62,79 @@ import argparse
 #*******************************
 
 
-__all__ = ['FIGUREPRINT']
+__all__ = ['Figureprint', 'PackedFingerprints', 'FINGERPRINT_TYPES', 'molecule_fingerprint', 'options_fingerprint']
+
+
+# Fingerprint types selectable in fingerprint mode
+FINGERPRINT_TYPES = ['topological', 'morgan', 'atompair']
+
+
+def molecule_fingerprint(mol, kind='topological', radius=2, size=2048):
+    """
+    This function computes the structural fingerprint of a molecule
+
+    Parameters
+    ----------
+    mol : RDKit molecule object
+       the molecule to fingerprint
+    kind : str
+       the fingerprint type: 'topological' (RDKit path based fingerprint
+       folded to the RDKit default density), 'morgan' (ECFP like circular
+       fingerprint) or 'atompair' (hashed atom pair fingerprint)
+    radius : int
+       the Morgan fingerprint radius
+    size : int
+       the number of bits of the Morgan and atom pair fingerprints
+
+    Returns
+    -------
+    fps : RDKit ExplicitBitVect
+       the molecule fingerprint
+
+    """
+
+    if kind == 'topological':
+        return FingerprintMols.FingerprintMol(mol)
+
+    # The molecules are not sanitized: the valences and the rings used by the
+    # atom invariants are set on a copy of the molecule
+    mol = Chem.Mol(mol)
+    mol.UpdatePropertyCache(strict=False)
+    Chem.FastFindRings(mol)
+
+    if kind == 'morgan':
+        return AllChem.GetMorganFingerprintAsBitVect(mol, radius, nBits=size)
+
+    if kind == 'atompair':
+        return rdMolDescriptors.GetHashedAtomPairFingerprintAsBitVect(mol, nBits=size)
+
+    raise ValueError('Unknown fingerprint type: %s' % kind)
+
+
+def options_fingerprint(mol, options):
+    """
+    This function computes the structural fingerprint of a molecule with the
+    fingerprint type selected in the user options. The topological
+    fingerprint is used if the options do not select a type
+
+    Parameters
+    ----------
+    mol : RDKit molecule object
+       the molecule to fingerprint
+    options : argparse python object
+       the list of user options
+
+    Returns
+    -------
+    fps : RDKit ExplicitBitVect
+       the molecule fingerprint
+
+    """
+
+    return molecule_fingerprint(mol, getattr(options, 'fingerprint_type', 'topological'),
+                                getattr(options, 'fingerprint_radius', 2),
+                                getattr(options, 'fingerprint_size', 2048))
+
 
 class Figureprint(object):
     """
@@ -71,7 +144,7 @@ class Figureprint(object):
     
     """
 
-    def __init__(self, moli, molj ):
+    def __init__(self, moli, molj, options=argparse.Namespace(verbose='info')):
         """
         Inizialization function
     
@@ -100,9 +173,407 @@ class Figureprint(object):
             lg.setLevel(RDLogger.CRITICAL)
         
 
-        self.fps_moli = FingerprintMols.FingerprintMol(self.moli)
-        self.fps_molj = FingerprintMols.FingerprintMol(self.molj)
+        self.fps_moli = options_fingerprint(self.moli, options)
+        self.fps_molj = options_fingerprint(self.molj, options)
         self.fps_tan = DataStructs.FingerprintSimilarity(self.fps_moli, self.fps_molj)
+
     def get_fps_tan(self):
         return self.fps_tan
-        
+
+
+
+#*******************************
+# Packed Fingerprints Class
+#*******************************
+
+
+# Number of set bits of each byte value
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(0, 256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """
+    This function counts the set bits along the last axis of an array of 
+    packed 64 bit words
+
+    Parameters
+    ----------
+    words : numpy array of uint64
+       the packed bits
+
+    Returns
+    -------
+    counts : numpy array of int
+       the number of set bits
+
+    """
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+    return POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def unpack(words):
+    """
+    This function unpacks rows of packed 64 bit words into rows of single 
+    precision 0/1 values. The number of common set bits between two sets of
+    rows is then given by their matrix product, which is exact in single 
+    precision for the fingerprint sizes
+
+    Parameters
+    ----------
+    words : numpy 2D array of uint64
+       the packed bit rows
+
+    Returns
+    -------
+    bits : numpy 2D array of float32
+       the unpacked bit rows
+
+    """
+
+    return np.unpackbits(words.view(np.uint8), axis=1).astype(np.float32)
+
+
+class PackedFingerprints(object):
+    """
+
+    This class stores a library of RDKit bit vector fingerprints as packed 
+    uint64 matrices with their popcounts and computes the Tanimoto similarities 
+    between them in blocked tiles. The row blocks are distributed between the
+    allocated processes and compared with column slices, so that the tile 
+    size bounds the memory used by the unpacked bits and the temporary score
+    arrays of each process. The scores 
+    are the same computed by the DataStructs.FingerprintSimilarity function: 
+    fingerprints with different sizes are compared by folding the larger one
+
+    """
+
+    def __init__(self, fps, tile=1 << 24):
+        """
+        Inizialization function
+    
+        Parameters
+        ----------
+
+        fps : list of RDKit bit vectors
+            the fingerprints. None fingerprints have zero similarity with all 
+            the others
+        tile : int
+            the maximum number of fingerprint bits unpacked in a single tile
+
+        """
+
+        self.n = len(fps)
+
+        self.tile = tile
+
+        # Fingerprint sizes, zero for the missing fingerprints
+        self.sizes = np.array([fp.GetNumBits() if fp is not None else 0 for fp in fps], dtype=np.int64)
+
+        # For each fingerprint size S, the packed fingerprints folded to S bits and 
+        # their bit counts. The rows of the fingerprints smaller than S are not used
+        self.packed = {}
+        self.counts = {}
+
+        bits = {}
+        for i, fp in enumerate(fps):
+            if fp is not None:
+                arr = np.zeros(0, dtype=np.uint8)
+                DataStructs.ConvertToNumpyArray(fp, arr)
+                bits[i] = arr.astype(bool)
+
+        for size in sorted(set(self.sizes.tolist()) - set([0])):
+            words = (size + 63) // 64
+            mtx = np.zeros((self.n, words*64), dtype=bool)
+            for i, arr in bits.items():
+                if arr.size >= size:
+                    # RDKit folding: bit i is set if any bit i + k*size is set
+                    mtx[i, :size] = arr.reshape(-1, size).any(axis=0)
+            self.packed[size] = np.packbits(mtx, axis=1).view(np.uint64)
+            self.counts[size] = popcount(self.packed[size]).astype(np.float64)
+
+
+    def similarity(self, rows, cols):
+        """
+        This function computes the Tanimoto similarities between the selected 
+        fingerprints. The temporary arrays have the rows times columns size
+
+        Parameters
+        ----------
+        rows : numpy array of int
+           the row fingerprint indexes
+        cols : numpy array of int
+           the column fingerprint indexes
+
+        Returns
+        -------
+        scores : numpy 2D array of float
+           the Tanimoto similarities between the row and column fingerprints
+
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+
+        scores = np.zeros((rows.size, cols.size))
+
+        # Each pair is compared at the smaller of the two fingerprint sizes
+        pair_sizes = np.minimum.outer(self.sizes[rows], self.sizes[cols])
+
+        for size, packed in self.packed.items():
+
+            ri = np.nonzero(self.sizes[rows] >= size)[0]
+            ci = np.nonzero(self.sizes[cols] >= size)[0]
+
+            selected = pair_sizes[np.ix_(ri, ci)] == size
+
+            if not selected.any():
+                continue
+
+            bits_a = unpack(packed[rows[ri]])
+            b = packed[cols[ci]]
+
+            # Column block size bounding the tile memory
+            step = max(1, self.tile // bits_a.shape[1])
+
+            # The common bit counts are exact integers
+            common = np.empty((ri.size, ci.size))
+            for start in range(0, ci.size, step):
+                common[:, start:start+step] = np.dot(bits_a, unpack(b[start:start+step]).T)
+
+            union = self.counts[size][rows[ri]][:, None] + self.counts[size][cols[ci]][None, :] - common
+
+            # Empty fingerprints have zero similarity
+            union[union == 0.0] = 1.0
+
+            common /= union
+
+            if selected.all() and ri.size == rows.size and ci.size == cols.size:
+                scores = common
+            else:
+                block = scores[np.ix_(ri, ci)]
+                block[selected] = common[selected]
+                scores[np.ix_(ri, ci)] = block
+
+        return scores
+
+
+    def pair_similarity(self, i, j, block=1 << 16):
+        """
+        This function computes the Tanimoto similarities of the selected 
+        fingerprint pairs only
+
+        Parameters
+        ----------
+        i : numpy array of int
+           the first fingerprint indexes of the pairs
+        j : numpy array of int
+           the second fingerprint indexes of the pairs
+        block : int
+           the number of pairs compared in a single step
+
+        Returns
+        -------
+        scores : numpy array of float
+           the Tanimoto similarities of the pairs
+
+        """
+
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+
+        scores = np.zeros(i.size)
+
+        # Each pair is compared at the smaller of the two fingerprint sizes
+        pair_sizes = np.minimum(self.sizes[i], self.sizes[j])
+
+        for size, packed in self.packed.items():
+
+            selected = np.nonzero(pair_sizes == size)[0]
+
+            for start in range(0, selected.size, block):
+                k = selected[start:start+block]
+
+                common = popcount(packed[i[k]] & packed[j[k]]).astype(np.float64)
+                union = self.counts[size][i[k]] + self.counts[size][j[k]] - common
+
+                # Empty fingerprints have zero similarity
+                union[union == 0.0] = 1.0
+
+                scores[k] = common/union
+
+        return scores
+
+
+    def blocks(self, block):
+        """
+        This function splits the fingerprint indexes in row blocks
+
+        """
+        return [(start, min(start + block, self.n)) for start in range(0, self.n, block)]
+
+
+    def all_pairs(self, parallel=1, block=1024):
+        """
+        This function computes the Tanimoto similarities between all the pairs
+        of fingerprints
+
+        Parameters
+        ----------
+        parallel : int
+           the number of allocated processes
+        block : int
+           the number of rows computed in a single task
+
+        Returns
+        -------
+        scores : numpy array of float
+           the similarities stored as the linear array of the upper triangular
+           matrix, with the same element order used by the SMatrix class
+
+        """
+
+        segments = self.map(all_pairs_block, self.blocks(block), parallel)
+
+        if not segments:
+            return np.zeros(0)
+
+        return np.concatenate(segments)
+
+
+    def top_k(self, k, parallel=1, block=1024):
+        """
+        This function finds for each fingerprint the k most similar fingerprints.
+        Ties are resolved by picking the lowest indexes
+
+        Parameters
+        ----------
+        k : int
+           the number of selected fingerprints
+        parallel : int
+           the number of allocated processes
+        block : int
+           the number of rows computed in a single task
+
+        Returns
+        -------
+        indexes : numpy 2D array of int
+           the indexes of the most similar fingerprints of each fingerprint
+        scores : numpy 2D array of float
+           the corresponding similarities
+
+        """
+
+        k = min(k, self.n - 1)
+
+        results = self.map(top_k_block, [(start, stop, k) for start, stop in self.blocks(block)], parallel)
+
+        if not results:
+            return np.zeros((0, k), dtype=np.int64), np.zeros((0, k))
+
+        indexes = np.concatenate([result[0] for result in results])
+        scores = np.concatenate([result[1] for result in results])
+
+        return indexes, scores
+
+
+    def map(self, function, tasks, parallel):
+        """
+        This function distributes the tasks between the allocated processes
+
+        """
+
+        if parallel == 1 or len(tasks) <= 1:
+            init_packed(self)
+            return [function(task) for task in tasks]
+
+        pool = multiprocessing.Pool(processes=min(parallel, len(tasks)), initializer=init_packed, initargs=(self,))
+        try:
+            return pool.map(function, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+
+
+# Packed fingerprints shared by the allocated processes
+packed_data = {}
+
+def init_packed(packed):
+    packed_data['fps'] = packed
+
+
+def all_pairs_block(task):
+    """
+    This function computes the upper triangular matrix rows between start 
+    and stop as a linear array, scanning the columns in blocks
+
+    """
+
+    start, stop = task
+
+    fps = packed_data['fps']
+
+    if start >= fps.n - 1:
+        return np.zeros(0)
+
+    stop = min(stop, fps.n - 1)
+
+    # Row segments of the linear array, one list for each row
+    segments = [[] for i in range(start, stop)]
+
+    step = max(fps.tile // (64*64), 1)
+
+    for col_start in range(start + 1, fps.n, step):
+        col_stop = min(col_start + step, fps.n)
+
+        # Just the rows with columns j > i in the slice are compared
+        rows = np.arange(start, min(stop, col_stop - 1))
+
+        scores = fps.similarity(rows, np.arange(col_start, col_stop))
+
+        for i in rows.tolist():
+            segments[i - start].append(scores[i - start, max(0, i + 1 - col_start):])
+
+    return np.concatenate([segment for row in segments for segment in row])
+
+
+def top_k_block(task):
+    """
+    This function finds the k most similar fingerprints of the rows between 
+    start and stop, scanning the columns in blocks
+
+    """
+
+    start, stop, k = task
+
+    fps = packed_data['fps']
+
+    rows = np.arange(start, stop)
+
+    best_indexes = np.zeros((rows.size, 0), dtype=np.int64)
+    best_scores = np.zeros((rows.size, 0))
+
+    step = max(fps.tile // (64*64), k, 1)
+
+    for col_start in range(0, fps.n, step):
+        cols = np.arange(col_start, min(col_start + step, fps.n))
+
+        scores = fps.similarity(rows, cols)
+
+        # A fingerprint is not compared with itself
+        scores[rows[:, None] == cols[None, :]] = -1.0
+
+        cand_indexes = np.concatenate([best_indexes, np.broadcast_to(cols, scores.shape)], axis=1)
+        cand_scores = np.concatenate([best_scores, scores], axis=1)
+
+        # Sort by decreasing score and increasing index
+        order = np.lexsort((cand_indexes, -cand_scores), axis=1)[:, :k]
+
+        best_indexes = np.take_along_axis(cand_indexes, order, axis=1)
+        best_scores = np.take_along_axis(cand_scores, order, axis=1)
+
+    return best_indexes, best_scores
+
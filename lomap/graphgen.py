@@ -48,16 +48,23 @@ potential ligands within a substantial of compounds.
 import networkx as nx
 import numpy as np
 import sys
-import matplotlib.pyplot as plt
-import copy
+import math
+import bisect
 from operator import itemgetter
-from rdkit.Chem import Draw
 from rdkit.Chem import AllChem
 import os.path
 import logging
-from PyQt4 import QtGui
 import tempfile
 import shutil
+from lomap import arraygraph
+
+import gzip
+import hashlib
+import subprocess
+import multiprocessing
+
+# The plotting, Qt and drawing modules are imported by the functions that use 
+# them, so that the batch runs that never draw do not pay their import cost
 
 __all__ = ['GraphGen']
 
@@ -73,7 +80,7 @@ class GraphGen(object):
     binding free energy calculation
     """
 
-    def __init__(self, dbase):
+    def __init__(self, dbase, options=None, sorted_indexes=None):
 
         """
         Inizialization function
@@ -83,16 +90,31 @@ class GraphGen(object):
 
         dbase : dbase object
             the molecule container
+
+        options : argparse python object 
+            the graph options. If None the molecule container options are used
+
+        sorted_indexes : numpy array of int
+            the linear indexes of the positive strict similarity scores sorted
+            by decreasing score, see SMatrix.sorted_indexes. If passed, it is 
+            used to select the graph edges above the cutoff
        
         """
 
         self.dbase = dbase
 
-        self.maxPathLength = dbase.options.max
+        if options is None:
+            options = dbase.options
+
+        self.options = options
 
-        self.similarityScoresLimit = dbase.options.cutoff
+        self.sorted_indexes = sorted_indexes
+
+        self.maxPathLength = self.options.max
+
+        self.similarityScoresLimit = self.options.cutoff
        
-        if dbase.options.radial:
+        if self.options.radial:
             self.lead_index = self.pick_lead()
         else:
             self.lead_index = None
@@ -116,10 +138,16 @@ class GraphGen(object):
         self.edge_labels = False
         
 
+        # The native engine generates the graph on compact arrays and builds
+        # the NetworkX graph only at the end
+        if self.options.engine == 'native':
+            self.resultGraph = arraygraph.ArrayGraph(dbase, self.lead_index, self.options, self.sorted_indexes).getGraph()
+            return
+
         # The following Section has been strongly copied/adapted from the original implementation
 
         # Generate a list related to the disconnected graphs present in the initial graph 
-        if dbase.options.fast and dbase.options.radial:
+        if self.options.fast and self.options.radial:
             #only enable the fast map option if use the radial option
             self.initialSubgraphList = self.generateInitialSubgraphList(fast_map = True)
         else:
@@ -131,7 +159,9 @@ class GraphGen(object):
     
 
         
-        # Elimintates from each subgraph those edges whose weights are less than the hard limit
+        # Elimintates from each subgraph those edges whose weights are less than the hard limit.
+        # The initial graph is already built from the edges above the hard limit,
+        # so this only checks the sorted weights lists
         self.removeEdgesBelowHardLimit()
 
 
@@ -147,7 +177,7 @@ class GraphGen(object):
         # Remove edges, whose removal does not violate constraints, from the subgraphs,
         # starting with lowest similarity score first
     
-        if dbase.options.fast and dbase.options.radial:
+        if self.options.fast and self.options.radial:
             #if we use the fast and radial option, just need to add the surrounding edges from the initial graph
             self.resultGraph = self.addsurroundEdges()
             #after adding the surround edges, some subgraphs may merge into a larger graph and so need to update the current subgraphs
@@ -163,15 +193,13 @@ class GraphGen(object):
         
 
 
-            # Collect together disjoint subgraphs of like charge into subgraphs
-            self.resultingSubgraphsList = copy.deepcopy(self.workingSubgraphsList)
+            # Collect together disjoint subgraphs of like charge into subgraphs.
+            # The subgraphs are not modified anymore, so a shallow copy of the list is enough
+            self.resultingSubgraphsList = list(self.workingSubgraphsList)
 
             # Combine seperate subgraphs into a single resulting graph
             self.resultGraph = self.mergeAllSubgraphs()
 
-            # Make a copy of the resulting graph for later processing in connectResultingComponents()
-            self.copyResultGraph = self.resultGraph.copy()
-
             # Holds list of edges that were added in the connect components phase
             self.edgesAddedInFirstTreePass = []
 
@@ -184,33 +212,27 @@ class GraphGen(object):
     def pick_lead(self):
         if (self.dbase.nums() * (self.dbase.nums() - 1)/2) != self.dbase.strict_mtx.size:
             raise ValueError("There are errors in the similarity score matrices")
-        if not self.dbase.options.hub == "None":
+        if not self.options.hub == "None":
             #hub radial option. Use the provided reference compound as a hub 
             hub_index = None
             for i in range(0, self.dbase.nums()):
-                if os.path.basename(self.dbase[i].getName()) == self.dbase.options.hub:
+                if os.path.basename(self.dbase[i].getName()) == self.options.hub:
                     hub_index = i
             if hub_index is None:
-                logging.info("Warning: the specified center ligand %s is not in the ligand database, will not use the radial option."%self.dbase.options.hub)
+                logging.info("Warning: the specified center ligand %s is not in the ligand database, will not use the radial option."%self.options.hub)
             return hub_index
         else:
             #complete radial option. Pick the compound with the highest total similarity to all other compounds to use as a hub
-            all_sum_i = []
-            for i in range(0, self.dbase.nums()):
-                sum_i = 0
-                for j in range(0, self.dbase.nums()):
-                    sum_i += self.dbase.strict_mtx[i,j]
-                all_sum_i.append(sum_i)
-            max_value = max(all_sum_i)
-            max_index = [i for i, x in enumerate(all_sum_i) if x == max_value]
-            max_index_final = max_index[0]
+            all_sum_i = self.dbase.strict_mtx.row_sums()
+            max_index_final = int(np.argmax(all_sum_i))
             return max_index_final
 
     def generateInitialSubgraphList(self, fast_map = False):
         
         """
         This function generates a starting graph connecting with edges all the 
-        compounds with a positive strict similarity score  
+        compounds with a positive strict similarity score greater or equal to
+        the hard limit
         
         Returns
         -------
@@ -225,30 +247,26 @@ class GraphGen(object):
         if (self.dbase.nums() * (self.dbase.nums() - 1)/2) != self.dbase.strict_mtx.size:
             raise ValueError("There are errors in the similarity score matrices")
 
+        for i in range(0, self.dbase.nums()):
+            compound_graph.add_node(i,ID=self.dbase[i].getID(), fname_comp = os.path.basename(self.dbase[i].getName()))
+
         if not fast_map:
-            #if not fast map option, connect all possible nodes to generate the initial graph
-            for i in range(0, self.dbase.nums()):
-                if i==0:
-                    compound_graph.add_node(i,ID=self.dbase[i].getID(), fname_comp = os.path.basename(self.dbase[i].getName()))
-            
-                for j in range(i+1, self.dbase.nums()):
-                
-                    if i == 0:
-                        compound_graph.add_node(j,ID=self.dbase[j].getID(), fname_comp = os.path.basename(self.dbase[j].getName()))
-                
-                    wgt = self.dbase.strict_mtx[i,j]
-                
-                    if wgt > 0.0:
-                        compound_graph.add_edge(i,j,similarity = wgt, strict_flag = True)
+            #if not fast map option, connect all possible nodes to generate the initial graph.
+            #The candidate edges are extracted in one step from the linear array
+            strict_mtx = np.asarray(self.dbase.strict_mtx)
+
+            k = self.dbase.strict_mtx.positive_indexes(self.similarityScoresLimit, self.sorted_indexes)
+
+            i, j = self.dbase.strict_mtx.index_pairs(k)
+
+            compound_graph.add_weighted_edges_from(zip(i.tolist(), j.tolist(), strict_mtx[k].tolist()), weight='similarity', strict_flag = True)
         else:
             #if fast map option, then add all possible radial edges as the initial graph
-            for i in range(0, self.dbase.nums()):
-                #add the node for i
-                compound_graph.add_node(i,ID=self.dbase[i].getID(), fname_comp = os.path.basename(self.dbase[i].getName()))
-                if i != self.lead_index:
-                    wgt = self.dbase.strict_mtx[i, self.lead_index]
-                    if wgt > 0:
-                        compound_graph.add_edge(i,self.lead_index,similarity = wgt, strict_flag = True)
+            row = self.dbase.strict_mtx.row(self.lead_index)
+
+            i = np.nonzero((row > 0.0) & (row >= self.similarityScoresLimit))[0]
+
+            compound_graph.add_weighted_edges_from([(x, self.lead_index, row[x]) for x in i.tolist()], weight='similarity', strict_flag = True)
 
         initialSubgraphGen = nx.connected_component_subgraphs(compound_graph)
         initialSubgraphList = [x for x in initialSubgraphGen]
@@ -301,22 +319,17 @@ class GraphGen(object):
         
         totalEdges = 0
         
-        for subgraph in self.initialSubgraphList:
-
-            weightsList = self.subgraphScoresLists[self.initialSubgraphList.index(subgraph)]
+        for subgraph, weightsList in zip(self.initialSubgraphList, self.subgraphScoresLists):
 
-            index = 0
+            # The weights list is sorted from the lowest to the highest weight,
+            # so the edges below the hard limit are found by a single bisection
+            weights = [edge[2] for edge in weightsList]
 
-            for edge in weightsList:
+            index = bisect.bisect_left(weights, self.similarityScoresLimit)
 
-                if edge[2] < self.similarityScoresLimit:
-                    
-                    
-                    subgraph.remove_edge(edge[0],edge[1])
+            subgraph.remove_edges_from(weightsList[:index])
 
-                    index = weightsList.index(edge)
-
-            del weightsList[:index + 1]
+            del weightsList[:index]
         
             totalEdges = totalEdges + subgraph.number_of_edges()
         
@@ -360,10 +373,7 @@ class GraphGen(object):
         """
 
 
-        for subgraph in self.workingSubgraphsList:
-
-            weightsList = self.workingSubgraphScoresLists[self.workingSubgraphsList.index(subgraph)]
-
+        for subgraph, weightsList in zip(self.workingSubgraphsList, self.workingSubgraphScoresLists):
 
         
             # ISSUE ORDER IS ORIGINATED HERE
@@ -402,16 +412,8 @@ class GraphGen(object):
                 self.nonCycleNodesSet = self.findNonCyclicNodes(subgraph)
                 for node in self.nonCycleNodesSet:
                     #for each node in the noncyclenodeset, find the fingerprint similarity compare to all other surrounding nodes and pick the one with the max score and connect them
-                    node_score_list = []
-                    for i in range(0, self.dbase.nums()):
-                        if i != node and i != self.lead_index:
-                            node_score_list.append(self.dbase.strict_mtx[node, i])
-                        else:
-                            node_score_list.append(0.0)
-                    max_value = max(node_score_list)
+                    max_index_final, max_value = self.dbase.best_partner(node, [self.lead_index], self.similarityScoresLimit)
                     if max_value > self.similarityScoresLimit:
-                        max_index = [i for i, x in enumerate(node_score_list) if x == max_value]
-                        max_index_final = max_index[0]
                         subgraph.add_edge(node, max_index_final, similarity = self.dbase.strict_mtx[node, max_index_final], strict_flag = True )
                 return subgraph
         
@@ -476,7 +478,7 @@ class GraphGen(object):
         
         if constraintsMet:
             if not self.checkMaxDistance(subgraph):
-                constaintsMet = False
+                constraintsMet = False
 
         return constraintsMet
 
@@ -582,9 +584,12 @@ class GraphGen(object):
 
         finalGraph = nx.Graph()
 
+        # The subgraphs are disjoint, so their nodes and edges are added in 
+        # bulk to a single graph
         for subgraph in self.workingSubgraphsList:
 
-            finalGraph = nx.union(finalGraph, subgraph)
+            finalGraph.add_nodes_from(subgraph.nodes(data=True))
+            finalGraph.add_edges_from(subgraph.edges(data=True))
 
         return finalGraph
 
@@ -608,11 +613,8 @@ class GraphGen(object):
         # WARNING: The self.workingSubgraphsList at this point is different from 
         # the copy self.resultingSubgraphsList made before
 
-        connectSuccess = self.connectGraphComponents_brute_force_2()
-
-        while (connectSuccess) :
-
-            connectSuccess = self.connectGraphComponents_brute_force_2()
+        # The second pass adds all its edges in a single call
+        self.connectGraphComponents_brute_force_2()
 
 
 
@@ -694,7 +696,10 @@ class GraphGen(object):
     def connectGraphComponents_brute_force_2(self):
         """
         Adds a second edge between each of the (former) components of the
-        resultGraph to try to provide cycles between (former) components
+        resultGraph to try to provide cycles between (former) components.
+        The candidate edges between the (former) components are collected and 
+        sorted once, while a union-find structure keeps track of the components 
+        merged by the added edges
         
         Returns
         -------
@@ -703,53 +708,87 @@ class GraphGen(object):
 
         """
 
-        if len(self.resultingSubgraphsList) == 1:
+        if len(self.resultingSubgraphsList) <= 1:
 
             return False
 
-        edgesToCheck = []
 
-        for i in range(0,len(self.resultingSubgraphsList)):
+        # Union-find parent map. Each node initially points to the first node
+        # of its (former) component
+        parent = {}
 
-            nodesOfI = self.resultingSubgraphsList[i].nodes()
+        def find(node):
+            """
+            Returns the representative node of the component holding node
+            """
+            root = node
+            
+            while parent[root] != root:
+                root = parent[root]
+            
+            # Path compression
+            while parent[node] != root:
+                next_node = parent[node]
+                parent[node] = root
+                node = next_node
 
-            for j in range(i+1,len(self.resultingSubgraphsList)):
+            return root
 
-                nodesOfJ = self.resultingSubgraphsList[j].nodes()
 
-                #print '(%d,%d)' % (i,j)
-                
-                for k in range(0,len(nodesOfI)):
+        nodesList = [subgraph.nodes() for subgraph in self.resultingSubgraphsList]
 
-                    for l in range(0,len(nodesOfJ)):
+        for nodes in nodesList:
+            for node in nodes:
+                parent[node] = nodes[0]
 
-                        """produce an edge from nodesOfI[k] and nodesofJ[l] if nonzero weights push this edge into possibleEdgeList """
+        edgesToCheck = []
 
-                        #print 'Molecules (%d,%d)' % (nodesOfI[k],nodesOfJ[l])
-                        # I assumed that the score matrix is symmetric. In the Graph part this does not seems to be true: <<<<<<<<<<<<<DEBUG>>>>>>>>>>>>>>>
-                        similarity = self.dbase.loose_mtx[nodesOfI[k],nodesOfJ[l]]
+        for i in range(0,len(nodesList)):
+
+            for j in range(i+1,len(nodesList)):
+
+                for nodeOfI in nodesList[i]:
+
+                    for nodeOfJ in nodesList[j]:
+
+                        similarity = self.dbase.loose_mtx[nodeOfI,nodeOfJ]
                         
                         if (similarity > 0.0):
-                            edgesToCheck.append((nodesOfI[k], nodesOfJ[l], similarity))
+                            edgesToCheck.append((nodeOfI, nodeOfJ, similarity))
 
-        finalEdgesToCheck = [edge for edge in edgesToCheck if edge not in self.edgesAddedInFirstTreePass]
+        # The edges added in the first pass are hashed to avoid a linear 
+        # membership test for each candidate edge
+        usedEdges = set(self.edgesAddedInFirstTreePass)
 
-        if len(finalEdgesToCheck) > 0:
+        sortedList = sorted(edgesToCheck, key = itemgetter(2), reverse=True)
 
-            sortedList = sorted(finalEdgesToCheck, key = itemgetter(2), reverse=True)
-            edgeToAdd = sortedList[0]
-            
-            self.resultGraph.add_edge(edgeToAdd[0], edgeToAdd[1], similarity=edgeToAdd[2], strict_flag = False)
-            self.copyResultGraph.add_edge(edgeToAdd[0], edgeToAdd[1], similarity=edgeToAdd[2], strict_flag = False)
+        numComponents = len(nodesList)
+
+        edgeAdded = False
+
+        for edgeToAdd in sortedList:
+
+            if numComponents == 1:
+                break
+
+            if edgeToAdd in usedEdges:
+                continue
+
+            rootOfI = find(edgeToAdd[0])
+            rootOfJ = find(edgeToAdd[1])
+
+            # The edge does not connect two different components anymore
+            if rootOfI == rootOfJ:
+                continue
             
-            generator_graph = nx.connected_component_subgraphs(self.copyResultGraph)
-            self.resultingSubgraphsList = [x for x in generator_graph]
+            parent[rootOfJ] = rootOfI
+            numComponents -= 1
 
-            return True
+            self.resultGraph.add_edge(edgeToAdd[0], edgeToAdd[1], similarity=edgeToAdd[2], strict_flag = False)
 
-        else:
+            edgeAdded = True
 
-            return False
+        return edgeAdded
 
 
 
@@ -765,28 +804,22 @@ class GraphGen(object):
 
 
     def generate_depictions(self):
+        """
+        This function depicts the graph by using graphviz. The molecule 
+        images used as graph nodes are rendered by the allocated processes. 
+        With the depiction cache option the images are stored in a cache 
+        directory, keyed by the molecule and the drawing options, and reused 
+        by the following runs. The png, eps and pdf files are generated by 
+        concurrent dot processes
 
-        def max_dist_mol(mol):
-            
-            max_dist = 0.0
-            conf = mol.GetConformer()
-            
-            for i in range(0,conf.GetNumAtoms()):
-                
-                crdi = np.array([conf.GetAtomPosition(i).x,conf.GetAtomPosition(i).y,conf.GetAtomPosition(i).z])
-                
-                for j in range(i+1,conf.GetNumAtoms()):
-                    crdj = np.array([conf.GetAtomPosition(j).x,conf.GetAtomPosition(i).y,conf.GetAtomPosition(j).z])
-                    dist = np.linalg.norm(crdi-crdj)
-                    
-                    if dist > max_dist:
-                        max_dist = dist
-
-            return max_dist
-
-
+        """
 
-        directory_name = tempfile.mkdtemp()
+        if getattr(self.options, 'depiction_cache', False):
+            directory_name = os.path.join(self.options.directory, '.lomap_depictions')
+            if not os.path.isdir(directory_name):
+                os.makedirs(directory_name)
+        else:
+            directory_name = tempfile.mkdtemp()
 
         temp_graph = self.resultGraph.copy()
 
@@ -794,35 +827,35 @@ class GraphGen(object):
             
             #Draw.DrawingOptions.atomLabelFontSize=30
             #Draw.DrawingOptions.dotsPerAngstrom=100            
-            
-            for n in temp_graph:
 
+            # Just the molecules smaller than the maximum size are depicted
+            nodes = [n for n in temp_graph if self.dbase[temp_graph.node[n]['ID']].getMaxDistance() < self.max_mol_size]
+
+            tasks = []
+            for n in nodes:
                 id_mol = temp_graph.node[n]['ID']
                 mol = self.dbase[id_mol].getMolecule()
-                max_dist = max_dist_mol(mol)
-
-                if max_dist < self.max_mol_size:
-                    fname = os.path.join(directory_name, self.dbase[id_mol].getName() + ".png")
-                    #1, modify here to calculate the 2D structure for ligands cannot remove Hydrogens by rdkit
-                    #2, change the graph size to get better resolution            
-                    try:
-                        mol = AllChem.RemoveHs(mol)
-                        AllChem.Compute2DCoords(mol)
-                        from rdkit.Chem.Draw.MolDrawing import DrawingOptions
-                        DrawingOptions.bondLineWidth = 2.5
-                        Draw.MolToFile(mol, fname, size=(200,200), kekulize=False, fitimage=True, imageType='png', options=DrawingOptions)
-                    except:
-                        ######need to ask RDKit to fix this if possible, see the code issue tracker for more details######
-                        logging.info("Error attempting to remove hydrogens for molecule %s using RDKit. RDKit cannot kekulize the molecule"%self.dbase[id_mol].getName())
-                        AllChem.Compute2DCoords(mol)
-                        from rdkit.Chem.Draw.MolDrawing import DrawingOptions
-                        DrawingOptions.bondLineWidth = 2.5
-                        Draw.MolToFile(mol, fname, size=(200,200), kekulize=False, fitimage=True, imageType='png', options=DrawingOptions)
-                    temp_graph.node[n]['image'] = fname
-                    #self.resultGraph.node[n]['label'] = ''
-                    temp_graph.node[n]['labelloc'] = 't'
-                    temp_graph.node[n]['penwidth'] =2.5
-                    #self.resultGraph.node[n]['xlabel'] =  self.resultGraph.node[n]['ID']
+                fname = os.path.join(directory_name, depiction_key(mol) + '.png')
+                tasks.append((mol, self.dbase[id_mol].getName(), fname))
+
+            parallel = getattr(self.options, 'parallel', 1)
+
+            if parallel > 1 and len(tasks) > 1:
+                pool = multiprocessing.Pool(min(parallel, len(tasks)))
+                try:
+                    fnames = pool.map(render_depiction, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                fnames = [render_depiction(task) for task in tasks]
+
+            for n, fname in zip(nodes, fnames):
+                temp_graph.node[n]['image'] = fname
+                #self.resultGraph.node[n]['label'] = ''
+                temp_graph.node[n]['labelloc'] = 't'
+                temp_graph.node[n]['penwidth'] =2.5
+                #self.resultGraph.node[n]['xlabel'] =  self.resultGraph.node[n]['ID']
         for u,v,d in temp_graph.edges(data=True):
             if d['strict_flag']==True:
                 temp_graph[u][v]['color'] = 'cyan'
@@ -831,69 +864,121 @@ class GraphGen(object):
                 temp_graph[u][v]['color'] = 'red'
                 temp_graph[u][v]['penwidth'] = 2.5
         
-        nx.nx_agraph.write_dot(temp_graph, self.dbase.options.name+'_tmp.dot')
-        
-        cmd = 'dot -Tpng ' + self.dbase.options.name + '_tmp.dot -o ' + self.dbase.options.name + '.png' 
-           
-        os.system(cmd)
-        cmd = 'dot -Teps ' + self.dbase.options.name + '_tmp.dot -o ' + self.dbase.options.name + '.eps' 
-           
-        os.system(cmd)
-        cmd = 'dot -Tpdf ' + self.dbase.options.name + '_tmp.dot -o ' + self.dbase.options.name + '.pdf' 
-           
-        os.system(cmd)
-        os.remove(self.dbase.options.name+'_tmp.dot')
-        shutil.rmtree(directory_name, ignore_errors=True)
+        nx.nx_agraph.write_dot(temp_graph, self.options.name+'_tmp.dot')
+
+        # The three graphviz formats are generated concurrently
+        processes = []
+        for fmt in ['png', 'eps', 'pdf']:
+            cmd = ['dot', '-T' + fmt, self.options.name + '_tmp.dot', '-o', self.options.name + '.' + fmt]
+            try:
+                processes.append(subprocess.Popen(cmd))
+            except OSError as e:
+                logging.warning('Unable to run graphviz dot: %s' % e)
+
+        for process in processes:
+            process.wait()
+
+        os.remove(self.options.name+'_tmp.dot')
+
+        if not getattr(self.options, 'depiction_cache', False):
+            shutil.rmtree(directory_name, ignore_errors=True)
     #The function to output the score and connectivity txt file
     def layout_info(self):
+        """
+        This function writes the score report of the molecule pairs with their
+        connection flags and, if the radial option is on, the morph pairs 
+        required by FESetup. The report is written while iterating over the 
+        rows of the score matrices, so that it is never stored in memory. It 
+        can be limited to the connected pairs or to the pairs whose loose 
+        score is greater or equal than a threshold, and can be gzip compressed
+
+        """
+
+        connected_only = getattr(self.options, 'report_connected', False)
+        threshold = getattr(self.options, 'report_threshold', 0.0)
+
         #pass the lead compound index if the radial option is on and generate the morph type of output required by FESetup
         if self.lead_index is not None:
-            morph_txt = open(self.dbase.options.name+"_morph.txt", "w")
-            morph_data = "morph_pairs = "
-        info_txt = open(self.dbase.options.name+"_score_with_connection.txt", "w")
-        all_key_id = self.dbase.dic_mapping.keys()
-        data = ["%-10s,%-10s,%-25s,%-25s,%-15s,%-15s,%-15s,%-10s\n"%("Index_1", "Index_2","Filename_1","Filename_2", "Erc_sim","Str_sim", "Loose_sim", "Connect")]
-        for i in range (len(all_key_id)-1):
-            for j in range(i+1, len(all_key_id)):
-                morph_string = None
-                connected = False
-                try:
-                    similarity = self.resultGraph.edge[i][j]['similarity']
-                    #print "Check the similarity", similarity
-                    connected = True
-                except:
-                    pass
-                Filename_i = self.dbase.dic_mapping[i]
-                Filename_j = self.dbase.dic_mapping[j]
-                #print "Check the filename", Filename_i, Filename_j
-                strict_similarity = self.dbase.strict_mtx[i,j]
-                loose_similarity = self.dbase.loose_mtx[i,j]
-                ecr_similarity = self.dbase.ecr_mtx[i,j]
-                if connected:
-                    new_line = "%-10s,%-10s,%-25s,%-25s,%-15.2f,%-15.5f,%-15.5f,%-10s\n"%(i, j, Filename_i, Filename_j, ecr_similarity, strict_similarity, loose_similarity, "Yes")
-                    #generate the morph type, and pick the start ligand based on the similarity
-                    if self.lead_index is not None:
-                        morph_i = Filename_i.split(".")[0]
-                        morph_j = Filename_j.split(".")[0]
-                        if i == self.lead_index:
+            morph_txt = open(self.options.name+"_morph.txt", "w")
+            morph_data = ["morph_pairs = "]
+
+        # The gzip text mode is not available in python 2, the gzip file is
+        # written in binary mode
+        if getattr(self.options, 'report_gzip', False):
+            info_txt = gzip.open(self.options.name+"_score_with_connection.txt.gz", "wb")
+            write = lambda text: info_txt.write(text if isinstance(text, bytes) else text.encode('utf-8'))
+        else:
+            info_txt = open(self.options.name+"_score_with_connection.txt", "w")
+            write = info_txt.write
+
+        # The lazy scores which have not been computed are written as zero
+        strict_mtx, loose_mtx, ecr_mtx = self.dbase.computed_matrices()
+
+        strict = np.asarray(strict_mtx).ravel()
+        loose = np.asarray(loose_mtx).ravel()
+        ecr = np.asarray(ecr_mtx).ravel()
+
+        n = len(self.dbase.dic_mapping)
+        names = [self.dbase.dic_mapping[i] for i in range(0, n)]
+
+        # Connected partners j > i of each molecule i
+        partners = {}
+        for u, v in self.resultGraph.edges():
+            partners.setdefault(min(u, v), []).append(max(u, v))
+
+        line = "%-10s,%-10s,%-25s,%-25s,%-15.2f,%-15.5f,%-15.5f,%-10s\n"
+
+        write("%-10s,%-10s,%-25s,%-25s,%-15s,%-15s,%-15s,%-10s\n"%("Index_1", "Index_2","Filename_1","Filename_2", "Erc_sim","Str_sim", "Loose_sim", "Connect"))
+
+        k = 0
+
+        # The pairs of each row i of the score matrices are stored in the 
+        # linear arrays at the indexes k:k+m
+        for i in range(0, n-1):
+            m = n - i - 1
+
+            connected = np.zeros(m, dtype=bool)
+            connected[np.asarray(partners.get(i, []), dtype=np.int64) - i - 1] = True
+
+            selected = np.ones(m, dtype=bool)
+            if connected_only:
+                selected &= connected
+            if threshold:
+                selected &= loose[k:k+m] >= threshold
+
+            rows = [(i, i+1+t, names[i], names[i+1+t], e, s, l, 'Yes' if c else 'No') 
+                    for t, e, s, l, c in zip(np.nonzero(selected)[0].tolist(), ecr[k:k+m][selected].tolist(), 
+                                             strict[k:k+m][selected].tolist(), loose[k:k+m][selected].tolist(), 
+                                             connected[selected].tolist())]
+
+            write(''.join([line % row for row in rows]))
+
+            #generate the morph type, and pick the start ligand based on the similarity
+            if self.lead_index is not None:
+                for j in sorted(partners.get(i, [])):
+                    morph_i = names[i].split(".")[0]
+                    morph_j = names[j].split(".")[0]
+                    if i == self.lead_index:
+                        morph_string = "%s > %s, "%(morph_i, morph_j)
+                    elif j == self.lead_index:
+                        morph_string = "%s > %s, "%(morph_j, morph_i)
+                    else:
+                        #compare i and j with the lead compound, and pick the one with the higher similarity as the start ligand
+                        similarity_i = strict_mtx[self.lead_index, i]
+                        similarity_j = strict_mtx[self.lead_index, j]
+                        if similarity_i> similarity_j:
                             morph_string = "%s > %s, "%(morph_i, morph_j)
-                        elif j == self.lead_index:
-                            morph_string = "%s > %s, "%(morph_j, morph_i)
                         else:
-                            #compare i and j with the lead compound, and pick the one with the higher similarity as the start ligand
-                            similarity_i = self.dbase.strict_mtx[self.lead_index, i]
-                            similarity_j = self.dbase.strict_mtx[self.lead_index, j]
-                            if similarity_i> similarity_j:
-                                morph_string = "%s > %s, "%(morph_i, morph_j)
-                            else:
-                                morph_string = "%s > %s, "%(morph_j, morph_i)
-                        morph_data += morph_string
-                else:
-                    new_line = "%-10s,%-10s,%-25s,%-25s,%-15.2f,%-15.5f,%-15.5f,%-10s\n"%(i, j, Filename_i, Filename_j, ecr_similarity, strict_similarity, loose_similarity, "No")
-                data.append(new_line)
-        info_txt.writelines(data)
+                            morph_string = "%s > %s, "%(morph_j, morph_i)
+                    morph_data.append(morph_string)
+
+            k += m
+
+        info_txt.close()
+
         if self.lead_index is not None:
-            morph_txt.write(morph_data)
+            morph_txt.write(''.join(morph_data))
+            morph_txt.close()
 
     def writeGraph(self):
         """
@@ -909,17 +994,17 @@ class GraphGen(object):
             self.dbase.write_dic()
             self.layout_info()
         except Exception as e:
-            raise IOError("%s: %s.txt" % (str(e), self.dbase.options.name))
+            raise IOError("%s: %s.txt" % (str(e), self.options.name))
  
         try:
             self.generate_depictions()
-            nx.nx_agraph.write_dot(self.resultGraph, self.dbase.options.name+'.dot')
+            nx.nx_agraph.write_dot(self.resultGraph, self.options.name+'.dot')
         except Exception as e:
             raise IOError('Problems during the file generation: %s' % str(e)) 
              
  
         logging.info(30*'-')    
-        logging.info('The following files have been generated:\n%s.dot\tGraph file\n%s.png\tPng file\n%s.txt\tMapping Text file' % (self.dbase.options.name, self.dbase.options.name,  self.dbase.options.name ))
+        logging.info('The following files have been generated:\n%s.dot\tGraph file\n%s.png\tPng file\n%s.txt\tMapping Text file' % (self.options.name, self.options.name,  self.options.name ))
         logging.info(30*'-')
 
         return
@@ -939,25 +1024,9 @@ class GraphGen(object):
             logging.info('The number of generated graph nodes %d exceed the max number of drawable nodes %s' % (nx.number_of_nodes(self.resultGraph), self.max_nodes))
             return
 
-
-        def max_dist_mol(mol):
-            
-            max_dist = 0.0
-            conf = mol.GetConformer()
-            
-            for i in range(0,conf.GetNumAtoms()):
-                
-                crdi = np.array([conf.GetAtomPosition(i).x,conf.GetAtomPosition(i).y,conf.GetAtomPosition(i).z])
-                
-                for j in range(i+1,conf.GetNumAtoms()):
-                    crdj = np.array([conf.GetAtomPosition(j).x,conf.GetAtomPosition(i).y,conf.GetAtomPosition(j).z])
-                    dist = np.linalg.norm(crdi-crdj)
-                    
-                    if dist > max_dist:
-                        max_dist = dist
-
-            return max_dist
-
+        import matplotlib.pyplot as plt
+        from PyQt4 import QtGui
+        from rdkit.Chem import Draw
 
         # Determine the screen resolution by using PyQt4 
         app = QtGui.QApplication([])
@@ -1081,3 +1150,119 @@ class GraphGen(object):
         plt.show()
         
         return
+
+
+#*************************
+# Depiction functions
+#*************************
+
+
+# Drawing options of the molecule depictions. They are part of the depiction 
+# cache keys, therefore the cached images are rendered again when they change
+DEPICTION_OPTIONS = {'size': (200, 200), 'kekulize': False, 'fitimage': True, 'bondLineWidth': 2.5}
+
+
+def max_dist_mol(mol, block=256):
+    """
+    This function computes the maximum distance between the atoms of a 
+    molecule, used to select the depicted molecules. The pairwise distances
+    are computed in blocks of rows
+
+    Parameters
+    ----------
+    mol : RDKit molecule object
+       the molecule
+    block : int
+       the number of atoms whose distances are computed at once
+
+    Returns
+    -------
+    max_dist : float
+       the maximum atom distance
+
+    """
+
+    conf = mol.GetConformer()
+
+    crds = np.array([list(conf.GetAtomPosition(i)) for i in range(0, conf.GetNumAtoms())], dtype=np.float64)
+
+    max_dist2 = 0.0
+
+    for a in range(0, crds.shape[0], block):
+        diff = crds[a:a+block, np.newaxis, :] - crds[np.newaxis, :, :]
+        max_dist2 = max(max_dist2, float((diff*diff).sum(axis=-1).max()))
+
+    return math.sqrt(max_dist2)
+
+
+def depiction_key(mol):
+    """
+    This function returns the cache key of a molecule depiction: the hash 
+    of the molecule and of the drawing options
+
+    Parameters
+    ----------
+    mol : RDKit molecule object
+       the depicted molecule
+
+    Returns
+    -------
+    key : str
+       the hexadecimal depiction key
+
+    """
+
+    from rdkit import Chem
+
+    key = hashlib.sha1()
+    key.update(Chem.MolToMolBlock(mol, kekulize=False).encode('utf-8'))
+    key.update(repr(sorted(DEPICTION_OPTIONS.items())).encode('utf-8'))
+
+    return key.hexdigest()
+
+
+def render_depiction(task):
+    """
+    This function renders the png image of a molecule used as graph node. 
+    The image is not rendered again if the file is already present. It is 
+    used by the processes allocated to generate the depictions
+
+    Parameters
+    ----------
+    task : tuple
+       the molecule, its name and the image file name
+
+    Returns
+    -------
+    fname : str
+       the image file name
+
+    """
+
+    from rdkit.Chem import Draw
+    from rdkit.Chem.Draw.MolDrawing import DrawingOptions
+
+    mol, name, fname = task
+
+    if os.path.isfile(fname):
+        return fname
+
+    #1, modify here to calculate the 2D structure for ligands cannot remove Hydrogens by rdkit
+    #2, change the graph size to get better resolution            
+    try:
+        mol = AllChem.RemoveHs(mol)
+    except:
+        ######need to ask RDKit to fix this if possible, see the code issue tracker for more details######
+        logging.info("Error attempting to remove hydrogens for molecule %s using RDKit. RDKit cannot kekulize the molecule" % name)
+
+    AllChem.Compute2DCoords(mol)
+    DrawingOptions.bondLineWidth = DEPICTION_OPTIONS['bondLineWidth']
+
+    # The image is renamed when complete, so that concurrent runs sharing the 
+    # cache never read partial files
+    tmp_fname = '%s.%d.tmp' % (fname, os.getpid())
+    Draw.MolToFile(mol, tmp_fname, size=DEPICTION_OPTIONS['size'], kekulize=DEPICTION_OPTIONS['kekulize'],
+                   fitimage=DEPICTION_OPTIONS['fitimage'], imageType='png', options=DrawingOptions)
+    os.rename(tmp_fname, fname)
+
+    return fname
@@ -45,12 +45,11 @@ potential ligands within a substantial of compounds.
 from rdkit import Chem
 from rdkit.Chem import rdFMCS
 from rdkit.Chem import AllChem
-from rdkit.Chem.Draw.MolDrawing import DrawingOptions
-from rdkit.Chem import Draw
 from rdkit import DataStructs
-from rdkit.Chem.Fingerprints import FingerprintMols
+from lomap import fp
 import sys
 import math
+import time
 from rdkit import RDLogger
 import logging
 import argparse
@@ -220,6 +219,9 @@ class MCS(object):
         # Local pointers to the passed molecules
         self.moli = moli
         self.molj = molj
+
+        # User options, used to select the fingerprint type
+        self.options = options
         
         if not options.verbose == 'pedantic':
             lg = RDLogger.logger()
@@ -240,6 +242,7 @@ class MCS(object):
 
         # MCS calculaton. In RDKit the MCS is a smart string. Ring atoms are 
         # always mapped in ring atoms. 
+        start = time.time()
         self.__mcs = rdFMCS.FindMCS([self.__moli_noh, self.__molj_noh],
                                           timeout=options.time, 
                                           atomCompare=rdFMCS.AtomCompare.CompareAny, 
@@ -248,6 +251,10 @@ class MCS(object):
                                           ringMatchesRingOnly=True, 
                                           completeRingsOnly=False, 
                                           matchChiralTag=False)
+
+        # Times in seconds spent to find the MCS and to map it on the molecules
+        self.timings = {'mcs': time.time() - start, 'mapping': 0.0}
+        self.timeout = self.__mcs.canceled
         
         # Checking
         if self.__mcs.canceled:
@@ -285,6 +292,8 @@ class MCS(object):
 
         if not options.verbose == 'pedantic':
             lg.setLevel(RDLogger.WARNING)
+
+        self.timings['mapping'] = time.time() - start - self.timings['mcs']
         
         return
 
@@ -398,6 +407,9 @@ class MCS(object):
 
         # depict the mapping by using a .png file
         if fname:
+            from rdkit.Chem.Draw.MolDrawing import DrawingOptions
+            from rdkit.Chem import Draw
+
             AllChem.Compute2DCoords(moli_c)
             AllChem.Compute2DCoords(molj_c)
             AllChem.Compute2DCoords(mcs_mol)
@@ -434,8 +446,8 @@ class MCS(object):
         scr_tan : float
             the rule score
         """
-        fps_moli = FingerprintMols.FingerprintMol(self.moli)
-        fps_molj = FingerprintMols.FingerprintMol(self.molj)
+        fps_moli = fp.options_fingerprint(self.moli, self.options)
+        fps_molj = fp.options_fingerprint(self.molj, self.options)
         scr_tan = DataStructs.FingerprintSimilarity(fps_moli, fps_molj)
         return scr_tan
     def mcsr(self, beta=0.1):
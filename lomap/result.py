@@ -0,0 +1,297 @@
+#******************
+# MODULE DOCSTRING
+#******************
+
+"""
+
+LOMAP: Result bundle
+=====
+
+Alchemical free energy calculations hold increasing promise as an aid to drug
+discovery efforts. However, applications of these techniques in discovery
+projects have been relatively few, partly because of the difficulty of planning
+and setting up calculations. The Lead Optimization Mapper (LOMAP) is an
+automated algorithm to plan efficient relative free energy calculations between
+potential ligands within a substantial of compounds.
+
+"""
+
+#*****************************************************************************
+# Lomap2: A toolkit to plan alchemical relative binding affinity calculations
+# Copyright 2015 - 2016  UC Irvine and the Authors
+#
+# Authors: Dr Gaetano Calabro' and Dr David Mobley
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see http://www.gnu.org/licenses/
+#*****************************************************************************
+
+
+#****************
+# MODULE IMPORTS
+#****************
+
+import numpy as np
+import hashlib
+import os
+import struct
+import zipfile
+
+__all__ = ['save_result', 'load_result', 'score_arrays', 'scoring_settings', 'RESULT_VERSION']
+
+
+# Version of the result bundle format
+RESULT_VERSION = 1
+
+
+# User options that change the similarity scores
+SCORING_OPTIONS = ['time', 'ecrscore', 'fingerprint', 'fingerprint_type', 'fingerprint_radius', 
+                   'fingerprint_size', 'candidates', 'triage', 'cluster', 'bridges']
+
+# Scoring options that select the scored pairs
+SELECTION_OPTIONS = ['candidates', 'triage', 'cluster', 'bridges']
+
+
+def file_hash(fname):
+    """
+    This function computes the SHA-1 hash of a file
+
+    Parameters
+    ----------
+    fname : str
+       the file name
+
+    Returns
+    -------
+    hash : str
+       the hexadecimal file hash
+
+    """
+
+    sha = hashlib.sha1()
+
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def scoring_settings(options):
+    """
+    This function returns a string with the user options that change the 
+    similarity scores, used to check the saved scores before reusing them
+
+    Parameters
+    ----------
+    options : argparse python object
+       the list of user options
+
+    Returns
+    -------
+    settings : str
+       the scoring option names and values
+
+    """
+
+    return ' '.join(['%s=%s' % (key, getattr(options, key, None)) for key in SCORING_OPTIONS])
+
+
+def selection_settings(settings):
+    """
+    This function returns the values of the pair selection options of the
+    scoring settings returned by the scoring_settings function. The unset
+    options are zero and the bridges are used just by the clustering
+
+    Parameters
+    ----------
+    settings : str
+       the scoring option names and values
+
+    Returns
+    -------
+    selection : tuple of float
+       the candidates, triage, cluster and bridges values
+
+    """
+
+    values = dict(item.split('=', 1) for item in settings.split())
+
+    selection = []
+    for key in SELECTION_OPTIONS:
+        try:
+            selection.append(float(values.get(key)))
+        except (TypeError, ValueError):
+            selection.append(0.0)
+
+    if not selection[2]:
+        selection[3] = 0.0
+
+    return tuple(selection)
+
+
+def score_arrays(dbase):
+    """
+    This function collects the arrays saved for the similarity scores of a
+    molecule database: the format version, the linear arrays of the upper 
+    triangular score matrices with the computed score flags, the molecule IDs,
+    file names and mol2 file hashes and the scoring options
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule database with the computed similarity score matrices
+
+    Returns
+    -------
+    arrays : dictionary
+       the score arrays keyed by name
+
+    """
+
+    # The lazy scores which have not been computed and the pairs not selected
+    # as candidates are saved as zero and flagged by the scored array
+    strict_mtx, loose_mtx, ecr_mtx = dbase.computed_matrices()
+
+    scored = dbase.scored_flags()
+
+    n = dbase.nums()
+
+    names = [dbase[i].getName() for i in range(0, n)]
+    hashes = [file_hash(os.path.join(dbase.options.directory, name)) for name in names]
+
+    return dict(version=np.array(RESULT_VERSION, dtype=np.int64),
+                strict=np.asarray(strict_mtx, dtype=np.float64).ravel(),
+                loose=np.asarray(loose_mtx, dtype=np.float64).ravel(),
+                ecr=np.asarray(ecr_mtx, dtype=np.float64).ravel(),
+                scored=scored,
+                ids=np.array([dbase[i].getID() for i in range(0, n)], dtype=np.int64),
+                names=np.array(names, dtype=np.str_),
+                hashes=np.array(hashes, dtype=np.str_),
+                scoring=np.array(scoring_settings(dbase.options), dtype=np.str_))
+
+
+def save_result(dbase, graph, fname):
+    """
+    This function saves the results of a run in an uncompressed numpy .npz
+    bundle: the score arrays returned by the score_arrays function, the 
+    final graph edges and the lead compound index. The bundle does not
+    contain RDKit objects and can be read by numpy alone
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule database with the computed similarity score matrices
+    graph : GraphGen object
+       the graph generated from the molecule database
+    fname : str
+       the bundle file name
+
+    """
+
+    edges = sorted((min(u, v), max(u, v), d['similarity'], d['strict_flag'])
+                   for u, v, d in graph.resultGraph.edges(data=True))
+
+    lead = graph.lead_index if graph.lead_index is not None else -1
+
+    np.savez(fname,
+             edges=np.array([e[0:2] for e in edges], dtype=np.int64).reshape(-1, 2),
+             edge_similarity=np.array([e[2] for e in edges], dtype=np.float64),
+             edge_strict=np.array([e[3] for e in edges], dtype=bool),
+             lead=np.array(lead, dtype=np.int64),
+             **score_arrays(dbase))
+
+
+def load_result(fname, mmap_mode='r'):
+    """
+    This function loads a result bundle saved by the save_result function.
+    The arrays are memory mapped from the bundle file unless mmap_mode is
+    None
+
+    Parameters
+    ----------
+    fname : str
+       the bundle file name
+    mmap_mode : str or None
+       the numpy memory mapping mode, 'r' or 'c'. The arrays are read in
+       memory if None
+
+    Returns
+    -------
+    result : dictionary
+       the bundle arrays keyed by name
+
+    """
+
+    result = {}
+
+    with np.load(fname, allow_pickle=False) as bundle:
+        if 'version' not in bundle.files or int(bundle['version']) > RESULT_VERSION:
+            raise ValueError('%s is not a supported Lomap result bundle' % fname)
+
+        with zipfile.ZipFile(fname) as zf, open(fname, 'rb') as f:
+            for info in zf.infolist():
+                key = info.filename[:-len('.npy')]
+
+                result[key] = None
+                if mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+                    result[key] = memmap_member(fname, f, info, mmap_mode)
+
+                if result[key] is None:
+                    result[key] = bundle[key]
+
+    return result
+
+
+def memmap_member(fname, f, info, mmap_mode):
+    """
+    This function memory maps a .npy member stored uncompressed in a .npz
+    file
+
+    Parameters
+    ----------
+    fname : str
+       the .npz file name
+    f : file object
+       the .npz file opened in binary mode
+    info : ZipInfo object
+       the member information
+    mmap_mode : str
+       the numpy memory mapping mode
+
+    Returns
+    -------
+    array : numpy memmap or None
+       the memory mapped array, None if the array can not be memory mapped
+
+    """
+
+    # The member data start after the zip local file header
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        return None
+
+    if dtype.hasobject or len(shape) == 0 or 0 in shape:
+        return None
+
+    return np.memmap(fname, dtype=dtype, mode=mmap_mode, offset=f.tell(), shape=shape,
+                     order='F' if fortran_order else 'C')
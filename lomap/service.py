@@ -0,0 +1,498 @@
+#******************
+# MODULE DOCSTRING
+#******************
+
+"""
+
+LOMAP: Planning service
+=====
+
+Alchemical free energy calculations hold increasing promise as an aid to drug
+discovery efforts. However, applications of these techniques in discovery
+projects have been relatively few, partly because of the difficulty of planning
+and setting up calculations. The Lead Optimization Mapper (LOMAP) is an
+automated algorithm to plan efficient relative free energy calculations between
+potential ligands within a substantial of compounds.
+
+"""
+
+#*****************************************************************************
+# Lomap2: A toolkit to plan alchemical relative binding affinity calculations
+# Copyright 2015 - 2016  UC Irvine and the Authors
+#
+# Authors: Dr Gaetano Calabro' and Dr David Mobley
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see http://www.gnu.org/licenses/
+#*****************************************************************************
+
+
+#****************
+# MODULE IMPORTS
+#****************
+
+import numpy as np
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from lomap import graphgen
+from lomap import result
+from lomap.dbmol import SMatrix
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# The python 2 JSON strings are unicode strings
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+__all__ = ['PlanningService', 'make_server', 'serve']
+
+
+# Graph options which can be changed by each plan request
+GRAPH_OPTIONS = ['cutoff', 'max', 'radial', 'hub', 'fast', 'engine']
+
+
+class PlanningService(object):
+    """
+    This class keeps a molecule database in memory together with the molecule
+    fingerprints and a cache of the pair similarity scores, and plans graphs
+    for subsets of the molecules. The pair scores are keyed by the mol2 file
+    hashes, so they are reused between plans with different molecule subsets
+    and graph options and only the missing pairs are scored
+
+    """
+
+    def __init__(self, dbase):
+        """
+        Initialization class function
+
+        Parameters
+        ----------
+        dbase : DBMolecules object
+           the molecule library. The already built similarity score matrices
+           are used to fill the pair score cache
+
+        """
+
+        self.dbase = dbase
+
+        # Serializes the requests, the molecule database is not thread safe
+        self.lock = threading.Lock()
+
+        # The mol2 file hashes identify the molecules in the pair score cache
+        self.hashes = [result.file_hash(os.path.join(dbase.options.directory, dbase[i].getName()))
+                       for i in range(0, dbase.nums())]
+
+        # Pair score cache: the strict, loose and ECR scores keyed by the
+        # sorted hashes of the pair molecules
+        self.pair_cache = {}
+
+        self.stats = {'plans': 0, 'scored_pairs': 0, 'cached_pairs': 0}
+
+        # The per molecule features are computed once
+        if dbase.options.fingerprint:
+            dbase.fingerprints()
+
+        self.seed_cache()
+
+
+    def seed_cache(self):
+        """
+        This function fills the pair score cache with the scores of the
+        molecule database matrices, if they have been built. The lazy scores
+        which have not been computed and the pairs not selected as candidates
+        are not cached
+
+        """
+
+        n = self.dbase.nums()
+
+        if self.dbase.strict_mtx.size != n*(n-1)//2 or n < 2:
+            return
+
+        strict_mtx, loose_mtx, ecr_mtx = self.dbase.computed_matrices()
+
+        # The scores not computed in lazy mode or not selected as candidates are not cached
+        indexes = np.nonzero(self.dbase.scored_flags())[0]
+
+        i, j = self.dbase.strict_mtx.index_pairs(indexes)
+
+        for k, a, b in zip(indexes.tolist(), i.tolist(), j.tolist()):
+            self.pair_cache[self.pair_key(a, b)] = (float(strict_mtx[k]), float(loose_mtx[k]), float(ecr_mtx[k]))
+
+        logging.info('Pair score cache filled with %d scores' % len(self.pair_cache))
+
+
+    def pair_key(self, i, j):
+        """
+        This function returns the pair score cache key of two molecules
+
+        Parameters
+        ----------
+        i, j : int
+           the molecule database indexes
+
+        Returns
+        -------
+        key : tuple of str
+           the sorted mol2 file hashes
+
+        """
+
+        return tuple(sorted((self.hashes[i], self.hashes[j])))
+
+
+    def molecules(self):
+        """
+        This function returns the molecule file names of the library
+
+        Returns
+        -------
+        names : list of str
+           the molecule file names ordered by ID
+
+        """
+
+        with self.lock:
+            return [self.dbase[i].getName() for i in range(0, self.dbase.nums())]
+
+
+    def add_molecule(self, name, mol2):
+        """
+        This function writes a mol2 file in the molecule directory and adds the
+        molecule to the library. Adding a molecule already present with the same
+        content has no effect
+
+        Parameters
+        ----------
+        name : str
+           the mol2 file name
+        mol2 : str
+           the mol2 file content
+
+        Returns
+        -------
+        molecule : dictionary
+           the molecule ID and file name
+
+        """
+
+        if not isinstance(name, string_types) or os.path.basename(name) != name or not name.endswith('.mol2'):
+            raise ValueError('%s is not a valid mol2 file name' % name)
+
+        if not isinstance(mol2, string_types):
+            raise ValueError('The mol2 file content must be a string')
+
+        data = mol2.encode()
+        fname = os.path.join(self.dbase.options.directory, name)
+
+        with self.lock:
+            names = [self.dbase[i].getName() for i in range(0, self.dbase.nums())]
+
+            if name in names:
+                index = names.index(name)
+                if self.hashes[index] != hashlib.sha1(data).hexdigest():
+                    raise ValueError('The molecule %s is already in the library with a different content' % name)
+                return {'id': self.dbase[index].getID(), 'name': name}
+
+            if os.path.exists(fname):
+                raise ValueError('The file %s already exists in the molecule directory' % name)
+
+            with open(fname, 'wb') as f:
+                f.write(data)
+
+            try:
+                mol = self.dbase.add_molecule(name)
+            except Exception:
+                os.remove(fname)
+                raise
+
+            self.hashes.append(result.file_hash(fname))
+
+            return {'id': mol.getID(), 'name': name}
+
+
+    def plan(self, names=None, options=None):
+        """
+        This function generates the graph of a subset of the library molecules.
+        The cached pair scores are reused and the missing ones are computed and
+        cached
+
+        Parameters
+        ----------
+        names : list of str
+           the selected molecule file names. If None all the library molecules
+           are selected
+        options : dictionary
+           the graph options of the plan, between cutoff, max, radial, hub,
+           fast and engine. The library options are used for the missing ones
+
+        Returns
+        -------
+        plan : dictionary
+           the selected molecules, the graph edges with their similarity and
+           strict flag, the lead compound and the number of scored and cached
+           pairs
+
+        """
+
+        with self.lock:
+            library = [self.dbase[i].getName() for i in range(0, self.dbase.nums())]
+
+            if names is None:
+                names = library
+
+            indexes = []
+            for name in names:
+                if name not in library:
+                    raise ValueError('The molecule %s is not in the library' % name)
+                indexes.append(library.index(name))
+
+            if len(set(indexes)) != len(indexes):
+                raise ValueError('The molecule selection contains duplicates')
+
+            if len(indexes) < 2:
+                raise ValueError('At least two molecules must be selected')
+
+            sub = self.dbase.subset(indexes)
+            set_graph_options(sub.options, options or {})
+
+            # The plan results are returned and not written in files
+            sub.options.output = False
+            sub.options.display = False
+
+            n = sub.nums()
+            size = n*(n-1)//2
+
+            sub.strict_mtx = SMatrix(shape=(n,))
+            sub.loose_mtx = SMatrix(shape=(n,))
+            sub.ecr_mtx = SMatrix(shape=(n,))
+
+            i, j = sub.strict_mtx.index_pairs(np.arange(size))
+            keys = [self.pair_key(indexes[a], indexes[b]) for a, b in zip(i.tolist(), j.tolist())]
+
+            missing = []
+            for k, key in enumerate(keys):
+                if key in self.pair_cache:
+                    sub.strict_mtx[k], sub.loose_mtx[k], sub.ecr_mtx[k] = self.pair_cache[key]
+                else:
+                    missing.append(k)
+
+            if missing:
+                sub.compute_pairs(np.array(missing), sub.strict_mtx, sub.loose_mtx, sub.ecr_mtx)
+
+                for k in missing:
+                    self.pair_cache[keys[k]] = (float(sub.strict_mtx[k]), float(sub.loose_mtx[k]), float(sub.ecr_mtx[k]))
+
+            Gr = graphgen.GraphGen(sub)
+            graph = Gr.getGraph()
+
+            edges = sorted((min(u, v), max(u, v), d['similarity'], d['strict_flag'])
+                           for u, v, d in graph.edges(data=True))
+
+            self.stats['plans'] += 1
+            self.stats['scored_pairs'] += len(missing)
+            self.stats['cached_pairs'] += size - len(missing)
+
+            lead = None
+            if Gr.lead_index is not None:
+                lead = sub[Gr.lead_index].getName()
+
+            return {'molecules': [sub[k].getName() for k in range(0, n)],
+                    'edges': [{'mol_i': sub[a].getName(), 'mol_j': sub[b].getName(),
+                               'similarity': float(s), 'strict_flag': bool(f)} for a, b, s, f in edges],
+                    'lead': lead,
+                    'scored_pairs': len(missing),
+                    'cached_pairs': size - len(missing)}
+
+
+    def statistics(self):
+        """
+        This function returns the service statistics
+
+        Returns
+        -------
+        stats : dictionary
+           the number of molecules, cached pair scores, plans and the total
+           number of scored and cached pairs used by the plans
+
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+            stats['molecules'] = self.dbase.nums()
+            stats['pair_cache'] = len(self.pair_cache)
+            return stats
+
+
+
+def set_graph_options(options, graph_options):
+    """
+    This function checks and sets the graph options of a plan request
+
+    Parameters
+    ----------
+    options : argparse python object
+       the options to update
+    graph_options : dictionary
+       the requested graph options
+
+    """
+
+    for key, value in graph_options.items():
+        if key not in GRAPH_OPTIONS:
+            raise ValueError('%s is not a graph option' % key)
+
+        if key == 'cutoff':
+            value = float(value)
+            if value < 0.0:
+                raise ValueError('%s is not a positive real number' % value)
+        elif key == 'max':
+            value = int(value)
+            if value < 1:
+                raise ValueError('%s is not a positive integer number' % value)
+        elif key in ('radial', 'fast'):
+            value = bool(value)
+        elif key == 'engine':
+            if value not in ('networkx', 'native'):
+                raise ValueError('%s is not a graph engine' % value)
+        else:
+            value = str(value)
+
+        setattr(options, key, value)
+
+
+
+class PlanningHandler(BaseHTTPRequestHandler):
+    """
+    This class handles the HTTP requests of the planning service. The
+    requests and the replies are JSON documents:
+
+    GET  /molecules   the library molecule names
+    POST /molecules   add a molecule: {"name": "x.mol2", "mol2": "..."}
+    POST /plan        plan a subset: {"molecules": [...], "options": {...}}
+    GET  /stats       the service statistics
+
+    """
+
+    def do_GET(self):
+        if self.path == '/molecules':
+            self.reply(200, {'molecules': self.server.service.molecules()})
+        elif self.path == '/stats':
+            self.reply(200, self.server.service.statistics())
+        else:
+            self.reply(404, {'error': 'Unknown resource %s' % self.path})
+
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode() or '{}')
+
+            if not isinstance(request, dict):
+                raise ValueError('The request must be a JSON object')
+
+            if self.path == '/molecules':
+                reply = self.server.service.add_molecule(request.get('name'), request.get('mol2'))
+            elif self.path == '/plan':
+                reply = self.server.service.plan(request.get('molecules'), request.get('options'))
+            else:
+                self.reply(404, {'error': 'Unknown resource %s' % self.path})
+                return
+
+        except (ValueError, IOError) as e:
+            self.reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logging.error(str(e))
+            self.reply(500, {'error': str(e)})
+            return
+
+        self.reply(200, reply)
+
+
+    def reply(self, code, document):
+        data = json.dumps(document).encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        logging.info('%s - %s' % (self.address_string(), format % args))
+
+
+
+def make_server(service, host='127.0.0.1', port=0):
+    """
+    This function creates the HTTP server of a planning service
+
+    Parameters
+    ----------
+    service : PlanningService object
+       the planning service
+    host : str
+       the server address, local by default
+    port : int
+       the server port. If 0 a free port is selected
+
+    Returns
+    -------
+    server : HTTPServer object
+       the bound HTTP server. The selected port is in server.server_address
+
+    """
+
+    server = HTTPServer((host, port), PlanningHandler)
+    server.service = service
+
+    return server
+
+
+def serve(dbase, host='127.0.0.1', port=8000):
+    """
+    This function runs the planning service of a molecule database until
+    it is interrupted
+
+    Parameters
+    ----------
+    dbase : DBMolecules object
+       the molecule library
+    host : str
+       the server address
+    port : int
+       the server port
+
+    """
+
+    server = make_server(PlanningService(dbase), host, port)
+
+    logging.info('Planning service listening on %s:%d' % server.server_address[0:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -2,16 +2,40 @@ import os.path, sys
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 
 import unittest
+import importlib
+import gzip
 from unittest import skipIf
 from lomap.dbmol import DBMolecules
+from lomap.dbmol import SMatrix
+from lomap.dbmol import LazySMatrix
+from lomap.dbmol import ScoringProgress
+from lomap.dbmol import startup
 from lomap.graphgen import GraphGen
+from lomap.graphgen import depiction_key
 from lomap.mcs import MCS
+from lomap.fp import PackedFingerprints
+from lomap.fp import molecule_fingerprint
+from lomap.result import save_result
+from lomap.result import load_result
+from lomap.service import PlanningService
+from lomap.service import make_server
 import argparse
 import multiprocessing
 import networkx as nx
+import numpy as np
 import networkx.algorithms.isomorphism as iso
 import pickle
+import shutil
+import tempfile
+import threading
+import json
 from rdkit import RDLogger
+from rdkit import DataStructs
+from rdkit.Chem.Fingerprints import FingerprintMols
+try:
+    from urllib.request import urlopen, Request
+except ImportError:
+    from urllib2 import urlopen, Request
 
 # Python graph section must be update to fix a bug
 py_ver = int(sys.version[0])
@@ -83,6 +107,96 @@ class TestLomap(unittest.TestCase):
         self.assertEqual(True, all(s_strict == p_strict))
         self.assertEqual(True, all(s_loose == p_loose))
     
+    # Check the bulk fingerprint similarity matrices
+    def test_fingerprint_matrices(self):
+        db = DBMolecules('test/radial/', fingerprint=True, parallel=2)
+        strict, loose = db.build_matrices()
+
+        for i in range(0, db.nums()):
+            for j in range(i+1, db.nums()):
+                fps_moli = FingerprintMols.FingerprintMol(db[i].getMolecule())
+                fps_molj = FingerprintMols.FingerprintMol(db[j].getMolecule())
+                fps_tan = DataStructs.FingerprintSimilarity(fps_moli, fps_molj)
+                self.assertEqual(strict[i,j], fps_tan)
+                self.assertEqual(loose[i,j], fps_tan)
+
+    # Check the selectable fingerprint types and the fingerprint cache file
+    def test_fingerprint_types(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        for fname in os.listdir('test/radial/'):
+            shutil.copy(os.path.join('test/radial/', fname), tmp)
+
+        for kind in ['morgan', 'atompair']:
+            db = DBMolecules(tmp, fingerprint=True, fingerprint_type=kind, fingerprint_size=1024, fingerprint_cache=True)
+            strict, loose = db.build_matrices()
+
+            fps = [molecule_fingerprint(db[i].getMolecule(), kind, size=1024) for i in range(0, db.nums())]
+            self.assertEqual(list(strict), [DataStructs.FingerprintSimilarity(fps[i], fps[j]) 
+                                            for i in range(0, db.nums()) for j in range(i+1, db.nums())])
+            self.assertTrue(os.path.isfile(db.fingerprint_cache_file()))
+
+            cached = DBMolecules(tmp, fingerprint=True, fingerprint_type=kind, fingerprint_size=1024, fingerprint_cache=True)
+            self.assertEqual(cached.fingerprints(), fps)
+
+    # Check the packed fingerprint all pairs and top k similarities
+    def test_packed_fingerprints(self):
+        db = DBMolecules('test/radial/', fingerprint=True)
+        strict, loose = db.build_matrices()
+
+        packed = PackedFingerprints(db.fingerprints(), tile=4096)
+
+        self.assertEqual(list(packed.all_pairs(parallel=2, block=5)), list(strict))
+
+        indexes, scores = packed.top_k(3, block=5)
+
+        for i in range(0, db.nums()):
+            best = sorted([j for j in range(0, db.nums()) if j != i], key=lambda j: (-strict[i,j], j))[:3]
+            self.assertEqual(list(indexes[i]), best)
+            self.assertEqual(list(scores[i]), [strict[i,j] for j in best])
+
+    # Check the SMatrix linear index conversion and row extraction
+    def test_smatrix_index_pairs_row(self):
+        mtx = SMatrix(shape=(7,))
+        mtx[:] = [0.1*k for k in range(0, mtx.size)]
+
+        i, j = mtx.index_pairs(range(0, mtx.size))
+
+        for k in range(0, mtx.size):
+            self.assertEqual(mtx[k], mtx[int(i[k]), int(j[k])])
+
+        for r in range(0, 7):
+            self.assertEqual(list(mtx.row(r)), [mtx[r,c] for c in range(0, 7)])
+
+        for r, row_sum in enumerate(mtx.row_sums()):
+            self.assertAlmostEqual(row_sum, sum([mtx[r,c] for c in range(0, 7)]))
+        
+    # Check the lazy matrix evaluation and memoization
+    def test_lazy_smatrix(self):
+        values = SMatrix(shape=(5,))
+        scored = np.zeros(values.size, dtype=bool)
+        evaluated = []
+
+        def evaluate(indexes):
+            indexes = [int(k) for k in indexes if not scored[k]]
+            evaluated.extend(indexes)
+            for k in indexes:
+                values[k] = 0.1*(k+1)
+            scored[indexes] = True
+
+        mtx = LazySMatrix(values, scored, evaluate)
+
+        self.assertEqual(mtx[3,1], mtx[1,3])
+        self.assertEqual(mtx[2,2], 0.0)
+        self.assertEqual(len(evaluated), 1)
+
+        mtx.prefetch(0, np.array([1, 2, 3]))
+        self.assertEqual(len(evaluated), 4)
+
+        self.assertEqual(list(mtx.row(1)), [values[1,c] for c in range(0, 5)])
+        self.assertEqual(list(np.asarray(mtx)), [0.1*(k+1) for k in range(0, values.size)])
+        self.assertEqual(sorted(evaluated), list(range(0, values.size)))
+
     # Check Graph
     @skipIf(not GR_COMP, 'The graph test has been skipped untill a bug in the graph generation between py2 and py3 will be fixed')
     def test_graph(self):
@@ -208,6 +322,499 @@ class TestLomap(unittest.TestCase):
         
         self.assertEqual(True, nx.is_isomorphic(graph, mol2_graph , node_match=nm, edge_match=em))
 
+    # Check that the native graph engine generates the same graphs as the NetworkX engine
+    def test_graph_native_engine(self):
+
+        def graph_data(graph):
+            nodes = sorted([(n, sorted(d.items())) for n, d in graph.nodes(data=True)])
+            edges = sorted([(min(u,v), max(u,v), d['similarity'], d['strict_flag']) for u, v, d in graph.edges(data=True)])
+            return nodes, edges
+
+        options = [('test/basic/', {}),
+                   ('test/basic/', {'cutoff': 0.6}),
+                   ('test/radial/', {}),
+                   ('test/radial/', {'radial': True}),
+                   ('test/radial/', {'radial': True, 'hub': 'ejm_46.mol2'}),
+                   ('test/radial/', {'radial': True, 'hub': 'ejm_46.mol2', 'fast': True})]
+
+        matrices = {}
+
+        for directory, kwargs in options:
+            db = DBMolecules(directory, **kwargs)
+
+            if directory not in matrices:
+                matrices[directory] = db.build_matrices() + (db.ecr_mtx,)
+
+            db.strict_mtx, db.loose_mtx, db.ecr_mtx = matrices[directory]
+
+            nx_graph = GraphGen(db).getGraph()
+
+            db.options.engine = 'native'
+            native_graph = GraphGen(db).getGraph()
+
+            self.assertEqual(graph_data(nx_graph), graph_data(native_graph))
+
+    def test_graph_sweep(self):
+        db = DBMolecules('test/basic/', parallel=2)
+        db.build_matrices()
+
+        graphs = db.build_graph_sweep([0.4, 0.6], [3, 6])
+
+        self.assertEqual(sorted(graphs.keys()), [(0.4, 3), (0.4, 6), (0.6, 3), (0.6, 6)])
+
+        for (cutoff, max_value), graph in graphs.items():
+            db.options.cutoff = cutoff
+            db.options.max = max_value
+            single_graph = GraphGen(db).getGraph()
+            self.assertEqual(sorted([sorted(e) for e in graph.edges()]), sorted([sorted(e) for e in single_graph.edges()]))
+
+    # Check that the maximum distance constraint changes the graph with both engines
+    def test_graph_sweep_max(self):
+        db = DBMolecules('test/basic/')
+        db.build_matrices()
+
+        for engine in ['networkx', 'native']:
+            db.options.engine = engine
+            graphs = db.build_graph_sweep(max_values=[1, 2, 6])
+
+            edges = dict((max_value, sorted([sorted(e) for e in graphs[(0.4, max_value)].edges()])) for max_value in [1, 2, 6])
+
+            self.assertNotEqual(edges[1], edges[6])
+            self.assertTrue(len(edges[1]) > len(edges[6]))
+
+            for max_value in [1, 2, 6]:
+                db.options.max = max_value
+                nx_graph = GraphGen(db, options=argparse.Namespace(**dict(vars(db.options), engine='networkx'))).getGraph()
+                self.assertEqual(edges[max_value], sorted([sorted(e) for e in nx_graph.edges()]))
+
+            db.options.max = 6
+
+    def test_graph_lazy(self):
+        db = DBMolecules('test/radial/', radial=True, hub='ejm_44.mol2', fast=True, cutoff=0.6)
+        db.build_matrices()
+        graph = db.build_graph()
+
+        lazy_db = DBMolecules('test/radial/', radial=True, hub='ejm_44.mol2', fast=True, cutoff=0.6, lazy=True, parallel=2)
+        lazy_db.build_matrices()
+        lazy_graph = lazy_db.build_graph()
+
+        self.assertTrue(lazy_db.scored.sum() < lazy_db.strict_mtx.size)
+
+        for i in range(0, db.nums()):
+            bounds = lazy_db.score_bounds(i)
+            for j in range(0, db.nums()):
+                self.assertTrue(db.strict_mtx[i,j] <= bounds[j])
+
+        self.assertEqual(sorted([sorted(e) for e in graph.edges()]), sorted([sorted(e) for e in lazy_graph.edges()]))
+
+    def test_candidates(self):
+        db = DBMolecules('test/basic/')
+        strict, loose = db.build_matrices()
+
+        candidate_db = DBMolecules('test/basic/', candidates=2, parallel=2)
+        candidate_strict, candidate_loose = candidate_db.build_matrices()
+
+        indexes = set(candidate_db.candidate_pairs(2).tolist())
+        
+        for k in range(0, strict.size):
+            if k in indexes:
+                self.assertEqual(candidate_strict[k], strict[k])
+                self.assertEqual(candidate_loose[k], loose[k])
+            else:
+                self.assertEqual(candidate_strict[k], 0.0)
+
+        report = db.candidate_report([2, db.nums() - 1])
+        
+        self.assertEqual(report[0]['pairs'], len(indexes))
+        self.assertEqual([report[1]['pair_recall'], report[1]['partner_recall'], report[1]['edge_recall']], [1.0, 1.0, 1.0])
+
+        self.assertRaises(ValueError, candidate_db.candidate_report, [2])
+
+        # The candidate scores are rejected whatever the current options are
+        candidate_db.options.candidates = 0
+        self.assertRaises(ValueError, candidate_db.candidate_report, [2])
+
+        # The command line rejects the candidate report before the scoring
+        argv = sys.argv
+        sys.argv = ['lomap', 'test/basic/', '--candidates', '2', '--candidate_report', '2']
+        try:
+            self.assertRaises(SystemExit, startup)
+        finally:
+            sys.argv = argv
+
+    def test_triage(self):
+        db = DBMolecules('test/basic/')
+        strict, loose = db.build_matrices()
+
+        triage_db = DBMolecules('test/basic/', triage=0.5, parallel=2)
+        triage_strict, triage_loose = triage_db.build_matrices()
+
+        fps = db.fingerprints()
+        indexes = set(triage_db.triage_pairs(0.5).tolist())
+
+        for k in range(0, strict.size):
+            i, j = strict.index_pairs(k)
+            self.assertEqual(k in indexes, DataStructs.FingerprintSimilarity(fps[i], fps[j]) >= 0.5)
+            if k in indexes:
+                self.assertEqual(triage_strict[k], strict[k])
+                self.assertEqual(triage_loose[k], loose[k])
+            else:
+                self.assertEqual(triage_loose[k], 0.0)
+
+        # The triage of given pairs compares just those pairs
+        candidates = np.arange(0, strict.size, 2)
+        self.assertEqual(triage_db.triage_pairs(0.5, candidates).tolist(),
+                         [k for k in candidates.tolist() if k in indexes])
+
+    def test_cluster(self):
+        db = DBMolecules('test/basic/')
+        strict, loose = db.build_matrices()
+
+        cluster_db = DBMolecules('test/basic/', cluster=0.5, bridges=1, parallel=2)
+        cluster_strict, cluster_loose = cluster_db.build_matrices()
+
+        labels = cluster_db.fingerprint_clusters(0.5)
+        indexes = set(cluster_db.cluster_pairs(0.5, 1).tolist())
+
+        self.assertTrue(labels.max() > 0)
+
+        for k in range(0, strict.size):
+            i, j = strict.index_pairs(k)
+            if labels[i] == labels[j]:
+                self.assertTrue(k in indexes)
+            if k in indexes:
+                self.assertEqual(cluster_strict[k], strict[k])
+                self.assertEqual(cluster_loose[k], loose[k])
+            else:
+                self.assertEqual(cluster_loose[k], 0.0)
+
+        # Each cluster is linked to the other clusters by at least one bridge pair
+        for c in range(0, labels.max() + 1):
+            self.assertTrue(any((labels[i] == c) != (labels[j] == c) for i, j in zip(*strict.index_pairs(sorted(indexes)))))
+
+    # Check the score report filters and compression
+    def test_layout_info(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        name = os.path.join(tmp, 'out')
+
+        db = DBMolecules('test/basic/', name=name)
+        db.build_matrices()
+        graph = GraphGen(db)
+        graph.getGraph()
+        graph.layout_info()
+        with open(name + '_score_with_connection.txt') as f:
+            lines = f.readlines()
+
+        self.assertEqual(len(lines), db.strict_mtx.size + 1)
+
+        db = DBMolecules('test/basic/', name=name, report_connected=True, report_gzip=True)
+        db.build_matrices()
+        graph = GraphGen(db)
+        graph.getGraph()
+        graph.layout_info()
+        with gzip.open(name + '_score_with_connection.txt.gz', 'rt') as f:
+            connected = f.readlines()
+
+        self.assertEqual(connected, [lines[0]] + [line for line in lines[1:] if line.split(',')[-1].strip() == 'Yes'])
+        self.assertEqual(len(connected), graph.resultGraph.number_of_edges() + 1)
+
+        db = DBMolecules('test/basic/', name=name, report_threshold=0.5)
+        db.build_matrices()
+        graph = GraphGen(db)
+        graph.getGraph()
+        graph.layout_info()
+        with open(name + '_score_with_connection.txt') as f:
+            self.assertEqual(f.readlines(), [lines[0]] + [line for line in lines[1:] if float(line.split(',')[-2]) >= 0.5])
+
+    # Check the result bundle saved and loaded with memory mapping
+    def test_result_bundle(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fname = os.path.join(tmp, 'out.npz')
+
+        db = DBMolecules('test/radial/', radial=True, hub='ejm_46.mol2', fast=True, lazy=True)
+        db.build_matrices()
+        graph = GraphGen(db)
+        save_result(db, graph, fname)
+
+        res = load_result(fname)
+        strict, loose, ecr = db.computed_matrices()
+
+        self.assertTrue(isinstance(res['strict'], np.memmap))
+        self.assertEqual(list(res['strict']), list(strict))
+        self.assertEqual(list(res['loose']), list(loose))
+        self.assertEqual(list(res['scored']), list(db.scored))
+        self.assertEqual(list(res['names']), [db[i].getName() for i in range(0, db.nums())])
+        self.assertEqual(int(res['lead']), graph.lead_index)
+        self.assertEqual(sorted(map(tuple, res['edges'].tolist())), 
+                         sorted((min(u, v), max(u, v)) for u, v in graph.resultGraph.edges()))
+
+        # The memory mapped bundle is closed before the directory is removed
+        del res
+
+    # Check the graph generated from the reloaded similarity scores
+    def test_save_load_matrices(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fname = os.path.join(tmp, 'scores.npz')
+
+        db = DBMolecules('test/basic/')
+        strict, loose = db.build_matrices()
+        db.save_matrices(fname)
+
+        for options in [dict(cutoff=0.6), dict(radial=True, hub='toluene.mol2', fast=True)]:
+            scored_db = DBMolecules('test/basic/', **options)
+            scored_db.build_matrices()
+            loaded_db = DBMolecules('test/basic/', **options)
+            loaded_strict, loaded_loose = loaded_db.load_matrices(fname)
+
+            self.assertEqual(list(loaded_strict), list(strict))
+            self.assertEqual(list(loaded_loose), list(loose))
+
+            scored_graph = scored_db.build_graph()
+            loaded_graph = loaded_db.build_graph()
+            self.assertEqual(sorted(scored_graph.edges()), sorted(loaded_graph.edges()))
+
+        self.assertRaises(ValueError, DBMolecules('test/radial/').load_matrices, fname)
+
+        # The pairs not selected as candidates are saved as not computed and 
+        # are computed on demand after the reload
+        candidate_db = DBMolecules('test/basic/', candidates=2)
+        candidate_db.build_matrices()
+        candidate_db.save_matrices(fname)
+
+        scored = load_result(fname, mmap_mode=None)['scored']
+        self.assertEqual(scored.tolist(), candidate_db.candidate_scored.tolist())
+        self.assertFalse(scored.all())
+
+        self.assertRaises(ValueError, DBMolecules('test/basic/').load_matrices, fname)
+
+        loaded_db = DBMolecules('test/basic/', candidates=2)
+        loaded_strict, loaded_loose = loaded_db.load_matrices(fname)
+        self.assertEqual(loaded_db.scored.tolist(), scored.tolist())
+        self.assertEqual(list(loaded_strict[:]), list(strict))
+        self.assertEqual(list(loaded_loose[:]), list(loose))
+
+    # Check the pair scoring records collected by the serial and parallel scoring
+    def test_pair_timings(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        name = os.path.join(tmp, 'out')
+
+        pairs = []
+        for parallel in [1, 2]:
+            db = DBMolecules('test/basic/', parallel=parallel, timing=True, name=name)
+            db.build_matrices()
+            pairs.append(sorted((r['i'], r['j']) for r in db.pair_records))
+
+            for r in db.pair_records:
+                self.assertIn(r['status'], ['scored', 'failed', 'charge'])
+                self.assertTrue(r['total'] >= r['mcs'] + r['mapping'] + r['tmcsr'])
+
+            summary = db.timing_summary(slowest=3)
+            self.assertEqual(summary['pairs'], 28)
+            self.assertEqual(summary['scored'] + summary['failed'] + summary['charge'], 28)
+            self.assertEqual(len(summary['slowest']), 3)
+
+            with open(name + '_timing.txt') as f:
+                rows = [line for line in f if not line.startswith('#')]
+            self.assertEqual(len(rows), 29)
+
+        self.assertEqual(pairs[0], [(i, j) for i in range(0, 8) for j in range(i+1, 8)])
+        self.assertEqual(pairs[1], pairs[0])
+
+        # Without the timing option the records are not collected
+        for parallel in [1, 2]:
+            db = DBMolecules('test/basic/', parallel=parallel)
+            db.build_matrices()
+            self.assertEqual(db.pair_records, [])
+
+        # In lazy mode the table is written after the graph generation
+        lazy_name = os.path.join(tmp, 'lazy')
+        db = DBMolecules('test/basic/', lazy=True, timing=True, name=lazy_name)
+        db.build_matrices()
+        self.assertFalse(os.path.exists(lazy_name + '_timing.txt'))
+        db.build_graph()
+
+        with open(lazy_name + '_timing.txt') as f:
+            rows = [line for line in f if not line.startswith('#')]
+        self.assertEqual(len(rows), int(db.scored.sum()) + 1)
+
+    # Check the scoring progress counters and the status file
+    def test_scoring_progress(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        status_file = os.path.join(tmp, 'status.json')
+
+        for parallel in [1, 2]:
+            db = DBMolecules('test/basic/', parallel=parallel, progress=0.01, status_file=status_file)
+            db.build_matrices()
+
+            with open(status_file) as f:
+                status = json.load(f)
+            self.assertEqual(status['state'], 'done')
+            self.assertEqual((status['pairs_done'], status['pairs_total']), (28, 28))
+            self.assertEqual(status['processes'], parallel)
+
+        progress = ScoringProgress(10, processes=2, interval=3600.0)
+        for slot, timeout in [(0, False), (1, True), (1, False)]:
+            progress.advance(slot, timeout)
+        status = progress.status()
+        self.assertEqual((status['pairs_done'], status['timeouts']), (3, 1))
+        self.assertTrue(status['eta'] > 0.0)
+
+    # Check the subset score matrices gathered from a scored and a lazy molecule database
+    def test_subset_matrices(self):
+        names = ['toluene.mol2', '2-naftanol.mol2', 'methylcyclohexane.mol2', '2-methylnaphthalene.mol2']
+
+        db = DBMolecules('test/basic/', output=False)
+        db.build_matrices()
+        strict = db.strict_mtx.to_numpy_2D_array()
+        indexes = [[db[i].getName() for i in range(0, db.nums())].index(name) for name in names]
+
+        sub = db.subset_matrices(names)
+        self.assertEqual([sub[i].getName() for i in range(0, sub.nums())], names)
+        self.assertTrue(np.array_equal(sub.strict_mtx.to_numpy_2D_array(), strict[np.ix_(indexes, indexes)]))
+
+        sub = db.subset_matrices(indexes[0:2])
+        self.assertEqual(sub.strict_mtx[0, 1], strict[indexes[0], indexes[1]])
+
+        lazy_db = DBMolecules('test/basic/', output=False)
+        lazy_sub = lazy_db.subset_matrices(names)
+        self.assertEqual(int(lazy_db.scored.sum()), 6)
+        self.assertTrue(np.array_equal(lazy_sub.strict_mtx.to_numpy_2D_array(), strict[np.ix_(indexes, indexes)]))
+
+        lazy_db.subset_matrices(names[0:3])
+        self.assertEqual(int(lazy_db.scored.sum()), 6)
+
+        self.assertEqual(sorted(lazy_sub.build_graph().edges()), sorted(db.subset_matrices(names).build_graph().edges()))
+        self.assertRaises(ValueError, db.subset_matrices, ['toluene.mol2', 'unknown.mol2'])
+        self.assertEqual(db.subset_matrices([u'toluene.mol2', u'2-naftanol.mol2']).nums(), 2)
+
+        # The pairs not selected as candidates have not been scored
+        candidate_db = DBMolecules('test/basic/', output=False, candidates=2)
+        candidate_db.build_matrices()
+        self.assertRaises(ValueError, candidate_db.subset_matrices, names)
+
+        # The subset pairs not selected as candidates by the saved run are computed
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fname = os.path.join(tmp, 'candidates.npz')
+        candidate_db.save_matrices(fname)
+
+        loaded_db = DBMolecules('test/basic/', output=False, candidates=2)
+        loaded_sub = loaded_db.subset_matrices(names, matrices=fname)
+        self.assertTrue(np.array_equal(loaded_sub.strict_mtx.to_numpy_2D_array(), strict[np.ix_(indexes, indexes)]))
+
+    # Check the planning service plans and its pair score cache on localhost
+    def test_planning_service(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        for fname in os.listdir('test/basic/'):
+            if fname.endswith('.mol2') and fname != 'toluene.mol2':
+                shutil.copy(os.path.join('test/basic/', fname), tmp)
+
+        db = DBMolecules(tmp, output=False)
+        service = PlanningService(db)
+
+        plan = service.plan()
+        self.assertEqual((plan['scored_pairs'], plan['cached_pairs']), (21, 0))
+
+        ref_db = DBMolecules(tmp, output=False)
+        ref_db.build_matrices()
+        ref_graph = ref_db.build_graph()
+        ref_edges = sorted((ref_db[min(u, v)].getName(), ref_db[max(u, v)].getName(), d['similarity']) 
+                           for u, v, d in ref_graph.edges(data=True))
+        self.assertEqual(sorted((e['mol_i'], e['mol_j'], e['similarity']) for e in plan['edges']), ref_edges)
+
+        plan = service.plan(plan['molecules'][0:4], {'radial': True, 'cutoff': 0.2})
+        self.assertEqual((plan['scored_pairs'], plan['cached_pairs']), (0, 6))
+        self.assertIn(plan['lead'], plan['molecules'])
+
+        server = make_server(service)
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def post(path, document):
+            request = Request(url + path, json.dumps(document).encode(), {'Content-Type': 'application/json'})
+            return json.loads(urlopen(request).read().decode())
+
+        try:
+            with open('test/basic/toluene.mol2') as f:
+                added = post('/molecules', {'name': 'toluene.mol2', 'mol2': f.read()})
+            self.assertEqual(added['id'], 7)
+
+            plan = post('/plan', {'options': {'max': 3}})
+            self.assertEqual((plan['scored_pairs'], plan['cached_pairs']), (7, 21))
+            self.assertIn('toluene.mol2', plan['molecules'])
+
+            self.assertRaises(Exception, post, '/plan', {'molecules': ['unknown.mol2', 'toluene.mol2']})
+
+            stats = json.loads(urlopen(url + '/stats').read().decode())
+            self.assertEqual((stats['molecules'], stats['pair_cache']), (8, 28))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # Check that the planning service caches just the scores computed by a candidate run
+    def test_planning_service_candidates(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fname = os.path.join(tmp, 'candidates.npz')
+
+        candidate_db = DBMolecules('test/basic/', output=False, candidates=2)
+        candidate_db.build_matrices()
+        candidate_db.save_matrices(fname)
+        scored = int(candidate_db.candidate_scored.sum())
+
+        ref_db = DBMolecules('test/basic/', output=False)
+        ref_db.build_matrices()
+        ref_graph = ref_db.build_graph()
+        ref_edges = sorted((ref_db[min(u, v)].getName(), ref_db[max(u, v)].getName(), d['similarity']) 
+                           for u, v, d in ref_graph.edges(data=True))
+
+        for db in [candidate_db, DBMolecules('test/basic/', output=False, candidates=2)]:
+            if db is not candidate_db:
+                db.load_matrices(fname)
+
+            service = PlanningService(db)
+            self.assertEqual(len(service.pair_cache), scored)
+
+            plan = service.plan()
+            self.assertEqual((plan['scored_pairs'], plan['cached_pairs']), (28 - scored, scored))
+            self.assertEqual(sorted((e['mol_i'], e['mol_j'], e['similarity']) for e in plan['edges']), ref_edges)
+
+    # Check the maximum atom distance of the molecules
+    def test_max_distance(self):
+        for i in range(0, self.inst.nums()):
+            conf = self.inst[i].getMolecule().GetConformer()
+            crds = [np.array(list(conf.GetAtomPosition(a))) for a in range(0, conf.GetNumAtoms())]
+            max_dist = max(np.linalg.norm(crds[a] - crds[b]) for a in range(0, len(crds)) for b in range(a+1, len(crds)))
+            self.assertAlmostEqual(self.inst[i].getMaxDistance(), max_dist, places=10)
+
+    # Check the depiction cache keys
+    def test_depiction_key(self):
+        keys = [depiction_key(self.inst[i].getMolecule()) for i in range(0, self.inst.nums())]
+        self.assertEqual(len(set(keys)), self.inst.nums())
+        self.assertEqual(keys[0], depiction_key(self.inst[0].getMolecule()))
+
+    # Check that importing lomap does not import the plotting, Qt and drawing modules
+    def test_import_lazy(self):
+        heavy = ('matplotlib', 'PyQt4', 'rdkit.Chem.Draw')
+        saved = dict(sys.modules)
+        try:
+            for name in list(sys.modules):
+                if name == 'lomap' or name.startswith('lomap.') or name.startswith(heavy):
+                    del sys.modules[name]
+            importlib.import_module('lomap')
+            self.assertEqual([name for name in sys.modules if name.startswith(heavy)], [])
+        finally:
+            sys.modules.clear()
+            sys.modules.update(saved)
+
     def test_mcs(self):
         f = open('test/basic/MCS.pickle','rb')
         data = pickle.load(f)